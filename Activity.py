@@ -17,18 +17,73 @@ Usage:
 Dependencies:
 - Tkinter (for GUI)
 - Database module (for database operations like fetching songs, creating playlists, etc.)
-- Pygame
+- SearchController module (for debounced searching off the Tk thread)
+- Catalog module (for searching the in-memory song catalog)
+- AsyncDatabase module (for playlist writes on the single writer thread)
+- PlaylistEdit module (for saving only what changed in the playlist editors)
+- VirtualList module (for song lists that only create the visible rows)
+- Playback module (for pygame playback with prefetching and gapless playlists)
+- Instrumentation module (for Tk handler timings, F12 switches it on and off)
+- QueryCache module (for the cache hit rate logged when F12 switches instrumentation off)
+- LibraryWatcher module (for picking up songs added to or removed from Songs/ while the window is open)
 """
 
-import os
+import os, queue
 import subprocess, tkinter as tk
-import pygame
 from tkinter import BOTH, BOTTOM, END, LEFT, RIGHT, TOP, VERTICAL, Y, PhotoImage, ttk
 from tkinter import messagebox
 import Database
+import AsyncDatabase
+import Catalog
+import Instrumentation
+import LibrarySync
+import QueryCache
+from LibraryWatcher import LibraryWatcher
+from PlaylistEdit import PlaylistEditSession
+from SearchController import SearchController, when_done
+from VirtualList import VirtualList
+from Playback import PlaybackEngine
+
+log = Instrumentation.get_logger(__name__)
+
+LIBRARY_POLL_MS = 250  #How often the Tk thread picks up changes found by the library watcher
 
 
 #The modification the GUI is split between left side and right side for simplicity.
+def show_write_error(error):
+    """Function to report a background database write that failed"""
+    messagebox.showerror("Error", f"Could not save your changes: {error}")
+
+def list_pages(songs, page_size=Database.PAGE_SIZE):
+    """Function to build a page loader over a list that is already in memory"""
+    def load_page(cursor):
+        start = cursor or 0
+        end = start + page_size
+        return songs[start:end], (end if end < len(songs) else None)
+    return load_page
+
+def song_pages(search_term, sort="title"):
+    """Function to build the page loader for a song list, search results when there is a search term"""
+    search_term = search_term.strip()
+    if search_term:
+        #Filter the in-memory catalog on title and artist, without a database query
+        return list_pages(Catalog.get_catalog().filter(search_term, sort=sort))
+    return lambda cursor: Database.get_songs_page(sort, cursor)
+
+def first_song_page(search_term, sort="title"):
+    """Function for the search workers (no Tk calls): returns the page loader and its first page"""
+    load_page = song_pages(search_term, sort)
+    return load_page, load_page(None)
+
+def playlist_summary_text(summary):
+    """Function to describe a playlist summary, e.g. 12 songs, 47 min"""
+    tracks = summary['tracks']
+    minutes = int(summary['duration'] // 60)
+    text = f"{tracks} song" if tracks == 1 else f"{tracks} songs"
+    if minutes >= 60:
+        return f"{text}, {minutes // 60} h {minutes % 60} min"
+    return f"{text}, {minutes} min"
+
 def create_left_area(root, current_user, update_song_info_callback):
     """Function to create the left area (3/4 of the screen) with tabs for 'All Songs' and 'Playlist'"""
     #Create the left frame
@@ -38,6 +93,8 @@ def create_left_area(root, current_user, update_song_info_callback):
 
     #Create the logout button
     def logout():
+        Database.logout()
+
         #Destroy the current activity window (activity_root)
         root.destroy()
 
@@ -71,28 +128,14 @@ def create_left_area(root, current_user, update_song_info_callback):
     song_sections_label.place(x=10, y=100)
     all_songs_aesthetic_header.place(y=80)
    
-    #Adds scrollbar
-    all_songs_canvas = tk.Canvas(all_songs_frame,width=900, height=800)
-    all_songs_canvas.place(x=0,y=160)
-    all_songs_scroll_bar = tk.Scrollbar(all_songs_frame, orient=VERTICAL, command=all_songs_canvas.yview) 
-    all_songs_scroll_bar.pack(side=RIGHT, fill=Y) 
-    all_songs_canvas.configure(yscrollcommand=all_songs_scroll_bar.set)
-    all_songs_canvas.bind('<Configure>', lambda e: all_songs_canvas.configure(scrollregion=all_songs_canvas.bbox("all")))
-
-    all_songs_scroll_frame = tk.Frame(all_songs_canvas)
-    all_songs_canvas.create_window((0, 0), window=all_songs_scroll_frame, anchor="nw")
-
-
-    #Get and display all songs from the database
-    songs = Database.get_all_songs()
-    
-    if songs:
-        for song in songs:
-            song_button = tk.Button(all_songs_scroll_frame, text=song, font=("Arial", 16), 
-                                    command=lambda s=song: update_song_info_callback(s)).pack()
-    else:
-        no_songs_label = tk.Label(all_songs_canvas, text="No songs found in the database.", font=("Arial", 16))
-        no_songs_label.place(x=10, y=50)
+    #Adds scrollable list, only the visible song buttons are created
+    all_songs_list = VirtualList(all_songs_frame, on_click=update_song_info_callback, width=900, height=800,
+                                 empty_text="No songs found in the database.")
+    all_songs_list.place(x=0,y=160)
+
+    #Get and display the songs from the database, more pages are loaded while scrolling
+    sort_order = "title"
+    all_songs_list.set_pages(song_pages("", sort_order))
     
     #Search bar with label to the left
     search_label = tk.Label(all_songs_frame, text="Search:", font=("Arial", 20))
@@ -102,55 +145,54 @@ def create_left_area(root, current_user, update_song_info_callback):
     search_entry = tk.Entry(all_songs_frame, textvariable=search_var, width=30, font=("Arial", 20))
     search_entry.place(x=130, y=10)
 
-    def update_song_list():
-        search_term = search_var.get().lower()
+    #Sort order for the list when nothing is searched
+    sort_label = tk.Label(all_songs_frame, text="Sort:", font=("Arial", 20))
+    sort_label.place(x=620, y=10)
+    sort_var = tk.StringVar(value="Title")
+    sort_menu = tk.OptionMenu(all_songs_frame, sort_var, "Title", "Artist", "Added")
+    sort_menu.config(font=("Arial", 14))
+    sort_menu.place(x=700, y=12)
 
-        #Debugging: Check if the search term is being retrieved correctly
-        print(f"Search term: {search_term}")
+    def search_song_list(search_term):
+        #Runs on a search worker thread, so no Tk calls in here
+        search_term = search_term.lower()
 
-        #Clear existing song buttons
-        for widget in all_songs_scroll_frame.winfo_children():
-            widget.destroy()
+        log.debug("Search term: %s", search_term)
 
-        #Get all songs and filter by search term
-        all_songs = Database.get_all_songs()
-
-        #Debugging: Check if songs are being retrieved from the database
-        print(f"All songs retrieved: {all_songs}")
-
-        filtered_songs = [song for song in all_songs if search_term in song.lower()]
-
-        #Debugging: Check the filtered songs
-        print(f"Filtered songs: {filtered_songs}")
-
-        #Helper to parse song into components (title, artist)
-        def parse_song(song_str):
-            print(f"Parsing song: {song_str}")  #Debugging print
-            parts = song_str.split(", ")
-            if len(parts) == 2:
-                name = parts[0].strip()  #The song name
-                artist_with_extension = parts[1].strip()  #The artist and file extension
-                artist = artist_with_extension.replace(".mp3", "")  #Remove the .mp3 extension
-                print(f"Parsed name: {name}, artist: {artist}")  #Debugging print
-                return name, artist
-            return song_str, ""  #If it's not in the expected format
-
-        #Display the filtered songs
-        if filtered_songs:
-            for song in filtered_songs:
-                tk.Button(
-                    all_songs_scroll_frame,
-                    text=song,
-                    font=("Arial", 16),
-                    command=lambda s=song: update_song_info_callback(s)
-                ).pack()
-        else:
-            tk.Label(all_songs_scroll_frame, text="No songs found.", font=("Arial", 16)).pack()
+        #First page from the catalog (or the database for an empty search), the rest loads while scrolling
+        return first_song_page(search_term, sort_order)
 
-    #Adding the trace for search_var to call update_song_list when the search text is changed
-    search_var.trace_add("write", lambda *args: update_song_list())
+    @Instrumentation.tk_handler
+    def update_song_list(result):
+        load_page, first_page = result
+        log.debug("Filtered songs: %d on the first page", len(first_page[0]))
+
+        #Display the filtered songs, the list reuses its row buttons
+        all_songs_list.empty_text = "No songs found."
+        all_songs_list.set_pages(load_page, first_page)
+
+    #Search off the Tk thread once the user pauses typing, then call update_song_list with the results
+    song_search = SearchController(all_songs_frame, search_song_list, update_song_list).attach(search_var)
+
+    def change_sort(*args):
+        nonlocal sort_order
+        sort_order = sort_var.get().lower()
+        song_search.schedule(search_var.get())
+
+    sort_var.trace_add("write", change_sort)
+
+    @Instrumentation.tk_handler
+    def on_library_change(changes):
+        """Function to update the All Songs list in place after the watcher synced the Songs folder"""
+        if search_var.get().strip():
+            song_search.schedule(search_var.get())  #New songs may or may not match the search, run it again
+            return
+        all_songs_list.remove_items(changes['removed'])
+        #Slot new songs into the pages already loaded, in the order the database sorts them
+        all_songs_list.insert_items(changes['added'], Database.song_sort_key(sort_order))
 
     #Fetch and display the user's playlists
+    @Instrumentation.tk_handler
     def show_playlist_songs(playlist_name):
         """Function to show songs of the selected playlist."""
         for widget in playlist_frame.winfo_children():
@@ -162,6 +204,7 @@ def create_left_area(root, current_user, update_song_info_callback):
         tk.Button(playlist_frame, text="Edit Playlist", font=("Arial", 14),
           command=lambda: edit_playlist_ui(playlist_name)).pack(pady=10)
         
+        @Instrumentation.tk_handler
         def edit_playlist_ui(playlist_name):
             for widget in playlist_frame.winfo_children():
                 widget.destroy()
@@ -179,50 +222,44 @@ def create_left_area(root, current_user, update_song_info_callback):
             search_entry = tk.Entry(search_frame, textvariable=search_var, font=("Arial", 14), width=30)
             search_entry.pack(side=tk.LEFT)
 
-            #Scrollable song checkbox list
-            canvas = tk.Canvas(playlist_frame, width=500, height=400)
-            scroll_frame = tk.Frame(canvas)
-            scrollbar = tk.Scrollbar(playlist_frame, orient="vertical", command=canvas.yview)
-            canvas.configure(yscrollcommand=scrollbar.set)
-
-            canvas.create_window((0, 0), window=scroll_frame, anchor='nw')
-            canvas.pack(side="left", fill="both", expand=True, padx=10)
-            scrollbar.pack(side="right", fill="y")
-
-            check_vars = {}
-
-            def populate_checkboxes(filter_text=""):
-                for widget in scroll_frame.winfo_children():
-                    widget.destroy()
-                check_vars.clear()
-
-                all_songs = Database.get_all_songs()
-                current_songs, _ = Database.get_playlist(playlist_name)
-                filtered_songs = [song for song in all_songs if filter_text.lower() in song.lower()]
+            current_songs, _ = Database.get_playlist(playlist_name, current_user)
+            current_songs = current_songs or []
+            #Every check and uncheck is recorded as an edit, saving only writes those
+            edit_session = PlaylistEditSession(current_user, playlist_name, current_songs)
 
-                for song in filtered_songs:
-                    var = tk.BooleanVar(value=(song in current_songs))
-                    check = tk.Checkbutton(scroll_frame, text=song, variable=var, font=("Arial", 12),
-                                        anchor="w", justify="left", wraplength=450)
-                    check.pack(anchor="w")
-                    check_vars[song] = var
+            #Scrollable song checkbox list, the checked songs live in song_checklist.selected
+            song_checklist = VirtualList(playlist_frame, checkboxes=True, font=("Arial", 12), width=500, height=400,
+                                         wraplength=450, on_toggle=edit_session.set_checked)
+            song_checklist.pack(side="left", fill="both", expand=True, padx=10)
+            song_checklist.selected.update(current_songs)
 
-                scroll_frame.update_idletasks()
-                canvas.config(scrollregion=canvas.bbox("all"))
+            def populate_checkboxes(result):
+                song_checklist.set_pages(*result)
 
-            populate_checkboxes()
-            search_var.trace_add("write", lambda *args: populate_checkboxes(search_var.get()))
+            song_checklist.set_pages(song_pages(""))
+            SearchController(song_checklist, first_song_page, populate_checkboxes).attach(search_var)
 
+            @Instrumentation.tk_handler
             def save_edited_playlist():
-                selected_songs = [song for song, var in check_vars.items() if var.get()]
-                if not selected_songs:
+                if not song_checklist.selected:
                     messagebox.showerror("Error", "Select at least one song to keep in the playlist.")
                     return
+                if not len(edit_session):
+                    show_playlist_songs(playlist_name)
+                    return
+
+                #Only the checked and unchecked songs are written (the rest keep their order, new songs go to the end),
+                #on the writer thread so the window stays responsive meanwhile
+                def on_saved(result):
+                    success, message = result
+                    if not success:
+                        messagebox.showerror("Error", message)
+                        return
+                    messagebox.showinfo("Success", f"Playlist '{playlist_name}' updated!")
+                    show_playlist_songs(playlist_name)
 
-                #Overwrite the playlist content
-                Database.replace_playlist_songs(current_user, playlist_name, selected_songs)
-                messagebox.showinfo("Success", f"Playlist '{playlist_name}' updated!")
-                show_playlist_songs(playlist_name)
+                future = edit_session.submit(AsyncDatabase.get_instance())
+                when_done(playlist_frame, future, on_saved, show_write_error)
 
             tk.Button(playlist_frame, text="Save Changes", font=("Arial", 14), command=save_edited_playlist).pack(pady=10)
             tk.Button(playlist_frame, text="Cancel", font=("Arial", 12), command=lambda: show_playlist_songs(playlist_name)).pack(pady=5)
@@ -233,20 +270,22 @@ def create_left_area(root, current_user, update_song_info_callback):
         playlist_name_aesthetic_header.pack(pady=10)
         playlist_name_label.place(x=500, y=25,anchor = "n")
 
-        songs, error = Database.get_playlist(playlist_name)
+        songs, error = Database.get_playlist(playlist_name, current_user)
         if error:
             playlist_error_label = tk.Label(playlist_frame, text=f"Error: {error}", font=("Arial", 16))
             playlist_error_label.pack(pady=20)
         else:
             if songs:
                 for song in songs:
+                    #Pass the playlist along so Play continues with the songs after this one
                     song_button = tk.Button(playlist_frame, text=song, font=("Arial", 16),
-                                            command=lambda s=song: update_song_info_callback(s))
+                                            command=lambda s=song: update_song_info_callback(s, songs))
                     song_button.pack(anchor="w", padx=20, pady=5)
             else:
                 no_playlist_label = tk.Label(playlist_frame, text="No songs in this playlist.", font=("Arial", 16))
                 no_playlist_label.pack(pady=20)
 
+    @Instrumentation.tk_handler
     def show_playlists():
         """Function to show the list of playlists."""
         for widget in playlist_frame.winfo_children():
@@ -260,6 +299,7 @@ def create_left_area(root, current_user, update_song_info_callback):
 
         
         
+        @Instrumentation.tk_handler
         def new_playlist_ui():
             for widget in playlist_frame.winfo_children():
                 widget.destroy()
@@ -283,58 +323,48 @@ def create_left_area(root, current_user, update_song_info_callback):
             search_entry.pack(side=tk.LEFT)
 
 
-            #Frame + canvas for checkbox song list
-            #scrollbar
-            canvas = tk.Canvas(playlist_frame, width=500, height=400)
-            scroll_frame = tk.Frame(canvas)
-            scrollbar = tk.Scrollbar(playlist_frame, orient="vertical", command=canvas.yview)
-            canvas.configure(yscrollcommand=scrollbar.set)
-
-            canvas.create_window((0, 0), window=scroll_frame, anchor='nw')
-            canvas.pack(side="left", fill="both", expand=True, padx=10)
-            scrollbar.pack(side="right", fill="y")
-
-            check_vars = {}  #Dictionary to store checkbox vars
+            #Scrollable checkbox song list
+            #checked songs are kept in song_checklist.selected
+            song_checklist = VirtualList(playlist_frame, checkboxes=True, font=("Arial", 12), width=500, height=400,
+                                         wraplength=450)
+            song_checklist.pack(side="left", fill="both", expand=True, padx=10)
 
-            def populate_checkboxes(filter_text=""):
-                #Clear previous
-                for widget in scroll_frame.winfo_children():
-                    widget.destroy()
-                check_vars.clear()
+            def populate_checkboxes(result):
+                song_checklist.set_pages(*result)
 
-                all_songs = Database.get_all_songs()
-                filtered_songs = [song for song in all_songs if filter_text.lower() in song.lower()]
+            #Initially populate all songs, a page at a time
+            song_checklist.set_pages(song_pages(""))
 
-                for song in filtered_songs:
-                    var = tk.BooleanVar()
-                    check = tk.Checkbutton(scroll_frame, text=song, variable=var, font=("Arial", 12), anchor="w", justify="left", wraplength=450)
-                    check.pack(anchor="w")
-                    check_vars[song] = var
-
-                scroll_frame.update_idletasks()
-                canvas.config(scrollregion=canvas.bbox("all"))
-
-            #Initially populate all songs
-            populate_checkboxes()
-
-            #Update on search change
-            search_var.trace_add("write", lambda *args: populate_checkboxes(search_var.get()))
+            #Update on search change, debounced and searched off the Tk thread
+            SearchController(song_checklist, first_song_page, populate_checkboxes).attach(search_var)
 
             #Create Playlist button
+            @Instrumentation.tk_handler
             def create_playlist():
                 name = playlist_name_var.get().strip()
                 if not name:
                     messagebox.showerror("Error", "Playlist name cannot be empty.")
                     return
 
-                selected_songs = [song for song, var in check_vars.items() if var.get()]
+                selected_songs = sorted(song_checklist.selected)
                 if not selected_songs:
                     messagebox.showerror("Error", "Select at least one song to create a playlist.")
                     return
 
-                Database.add_songs_to_playlist(current_user, name, selected_songs)
-                messagebox.showinfo("Success", f"Playlist '{name}' created!")
-                show_playlists()
+                def on_created(result):
+                    success, message = result
+                    if not success:
+                        messagebox.showerror("Error", message)
+                        return
+                    messagebox.showinfo("Success", f"Playlist '{name}' created!")
+                    show_playlists()
+
+                #The playlist row and its songs are written in the same transaction
+                new_playlist = PlaylistEditSession(current_user, name, create=True)
+                for song in selected_songs:
+                    new_playlist.add(song)
+                future = new_playlist.submit(AsyncDatabase.get_instance())
+                when_done(playlist_frame, future, on_created, show_write_error)
 
             tk.Button(playlist_frame, text="Create Playlist", font=("Arial", 14), command=create_playlist).pack(pady=10)
 
@@ -345,7 +375,8 @@ def create_left_area(root, current_user, update_song_info_callback):
         new_playlist_button = tk.Button(playlist_frame, text="New Playlist", font=("Arial", 14), command=new_playlist_ui)
         new_playlist_button.place(x=20, y=20)
 
-        playlists, error = Database.get_all_playlists_for_user(current_user)
+        #Names, track counts and durations come back from one query
+        playlists, error = Database.get_playlist_summaries(current_user)
         if error:
             playlist_error_label = tk.Label(playlist_frame, text=f"Error: {error}", font=("Arial", 16))
             playlist_error_label.pack(pady=20)
@@ -368,12 +399,15 @@ def create_left_area(root, current_user, update_song_info_callback):
             
                     playlist_row.pack(pady=5, fill="x")
 
-                    playlist_button = tk.Button(playlist_row, text=playlist, font=("Arial", 14),
-                                                command=lambda name=playlist: show_playlist_songs(name))
+                    playlist_button = tk.Button(playlist_row, text=playlist['name'], font=("Arial", 14),
+                                                command=lambda name=playlist['name']: show_playlist_songs(name))
                     playlist_button.pack(side="left", padx=5)
 
+                    playlist_info = tk.Label(playlist_row, text=playlist_summary_text(playlist), font=("Arial", 12))
+                    playlist_info.pack(side="left", padx=5)
+
                     remove_button = tk.Button(playlist_row, text="Remove", font=("Arial", 12), fg="red",
-                                            command=lambda name=playlist: confirm_remove_playlist(name))
+                                            command=lambda name=playlist['name']: confirm_remove_playlist(name))
                     remove_button.pack(side="right", padx=5)
             else:
                 no_playlist_label = tk.Label(playlist_frame, text="No playlists found.", font=("Arial", 16))
@@ -393,10 +427,18 @@ def create_left_area(root, current_user, update_song_info_callback):
     def confirm_remove_playlist(name):
         confirm = messagebox.askyesno("Remove Playlist", f"Are you sure you want to delete '{name}'?")
         if confirm:
-            Database.remove_playlist(current_user, name)
-            messagebox.showinfo("Deleted", f"'{name}' has been deleted.")
-            show_playlists()
+            def on_removed(result):
+                success, message = result
+                if not success:
+                    messagebox.showerror("Error", message)
+                    return
+                messagebox.showinfo("Deleted", f"'{name}' has been deleted.")
+                show_playlists()
 
+            future = AsyncDatabase.get_instance().remove_playlist(current_user, name)
+            when_done(playlist_frame, future, on_removed, show_write_error)
+
+    @Instrumentation.tk_handler
     def on_tab_changed(event):
         selected_tab = notebook.tab(notebook.select(), "text")
         if selected_tab == "Account":
@@ -406,12 +448,14 @@ def create_left_area(root, current_user, update_song_info_callback):
 
     notebook.bind("<<NotebookTabChanged>>", on_tab_changed)
 
+    #Return the library change handler so the watcher can be connected to it
+    return on_library_change
 
 
 def create_right_area(root):
     """Function to create the right area (1/4 of the screen) to show selected song info"""
-    #Initialize pygame mixer for audio playback
-    pygame.mixer.init()
+    #Initialize the playback engine (pygame mixer plus a background prefetch thread)
+    engine = PlaybackEngine()
 
     #Create the right frame
     right_frame = tk.Frame(root, bg="white")
@@ -432,27 +476,50 @@ def create_right_area(root):
     duration_label.pack(anchor="w", padx=20, pady=5)
 
     current_song_name = None
+    upcoming_songs = []  #Songs after the selected one when it was picked from a playlist
     is_playing = False  #Track if the song is currently playing
 
     #Function to play or stop the song
+    @Instrumentation.tk_handler
     def toggle_play_stop():
         nonlocal is_playing, current_song_name
         
         if is_playing:
-            print(f"Stopping: {current_song_name}")
-            pygame.mixer.music.stop()  #Stop the music
+            log.debug("Stopping: %s", engine.current)
+            engine.stop()  #Stop the music
             play_button.config(text="Play")  #Change button text to "Play"
             is_playing = False
         else:
-            print(f"Playing: {current_song_name}")
-            current_song_dir = os.path.join(os.getcwd(), 'Songs', current_song_name)
-            pygame.mixer.music.load(current_song_dir)  #Load the song
-            pygame.mixer.music.play()  #Play the song
+            log.debug("Playing: %s", current_song_name)
+            engine.play(current_song_name, upcoming_songs)  #Already prefetched when the song was selected
             play_button.config(text="Stop")  #Change button text to "Stop"
             is_playing = True
+            follow_engine(current_song_name)
+
+    #Function to keep the labels in step when the engine moves on to the next playlist song
+    def follow_engine(last_song):
+        nonlocal is_playing
+        if not is_playing:
+            return
+        if not engine.playing:
+            play_button.config(text="Play")
+            is_playing = False
+            return
+        if engine.current != last_song:
+            show_song_details(engine.current)
+        right_frame.after(500, follow_engine, engine.current)
 
     #Function to update the song info labels when a song is selected
-    def update_song_info(song_name):
+    @Instrumentation.tk_handler
+    def update_song_info(song_name, playlist=None):
+        nonlocal upcoming_songs
+
+        #Remember what follows this song in the playlist and start reading it from disk
+        upcoming_songs = playlist[playlist.index(song_name) + 1:] if playlist and song_name in playlist else []
+        engine.prefetch([song_name] + upcoming_songs[:1])
+        show_song_details(song_name)
+
+    def show_song_details(song_name):
         nonlocal current_song_name  #Use the outer variable
         
         #Get the details for the song
@@ -486,7 +553,7 @@ def create_right_area(root):
         #Update the current song name
         current_song_name = song_name
         current_song_dir = os.path.join(os.getcwd(), 'Songs', current_song_name)
-        print(f"Song directory: {current_song_dir}")
+        log.debug("Song directory: %s", current_song_dir)
         
         
  
@@ -518,7 +585,39 @@ def launch_activity():
     update_song_info = create_right_area(activity_root)
 
     #Pass the update_song_info function to the left area
-    create_left_area(activity_root, current_user, update_song_info)
+    on_library_change = create_left_area(activity_root, current_user, update_song_info)
+
+    #Watch Songs/ while the window is open, batches are written through the single database writer thread
+    library_changes = queue.Queue()
+    watcher = LibraryWatcher(LibrarySync.SONGS_FOLDER,
+                             write=lambda function, *args: AsyncDatabase.get_instance().write(function, *args).result())
+    watcher.subscribe(library_changes.put)  #Runs on the watcher thread, the Tk thread picks the changes up below
+    watcher.start()
+
+    def poll_library_changes():
+        while not library_changes.empty():
+            on_library_change(library_changes.get_nowait())
+        activity_root.after(LIBRARY_POLL_MS, poll_library_changes)
+
+    activity_root.after(LIBRARY_POLL_MS, poll_library_changes)
+    activity_root.bind("<Destroy>", lambda event: watcher.stop() if event.widget is activity_root else None)
+
+    #F12 switches the timing instrumentation on, and off again with a dump to instrumentation.json
+    def toggle_instrumentation(event=None):
+        if Instrumentation.is_enabled():
+            Instrumentation.disable()
+            Instrumentation.dump_json("instrumentation.json")
+            log.info("Instrumentation off, timings written to instrumentation.json")
+            cache = QueryCache.get_stats()
+            log.info("Query cache: %d hits, %d misses (%.0f%% hit rate), %d entries", cache['hits'], cache['misses'],
+                     cache['hit_rate'] * 100, cache['entries'])
+        else:
+            Instrumentation.reset()
+            Instrumentation.enable()
+            log.info("Instrumentation on")
+
+    activity_root.bind("<F12>", toggle_instrumentation)
+    Instrumentation.watch_tk(activity_root)
 
     activity_root.mainloop()
 
@@ -0,0 +1,199 @@
+"""
+Module: AsyncDatabase.py
+Author: Jacob       : Backend
+
+Description:
+This module lets the GUI (or any other caller) use the Database module without blocking on the disk. Read functions run
+on a small pool of reader threads. Every write function is funnelled through one writer thread, so there is never more
+than one writer and SQLite never reports "database is locked" between our own threads. The writer takes whatever writes
+are waiting (up to a batch limit), runs each one in its own savepoint inside a single transaction, and commits once for
+the whole batch. A write that fails only rolls back its own savepoint.
+
+That transaction holds the database's write lock, so nothing slow may run inside it. Writes with a slow part (hashing a
+password, reading audio files) are split in two: the slow half runs on a reader thread first and only the SQL half is
+queued for the writer (see PREPARED_WRITES).
+
+Every call returns a concurrent.futures.Future right away. Futures can be polled from Tk (see SearchController.when_done)
+or awaited from asyncio code with the `*_async` variants.
+
+Usage:
+- `db = AsyncDatabase.get_instance()`
+- `future = db.replace_playlist_songs(user, name, songs)` then `future.result()` or `future.done()`
+- `songs = await db.call_async("search_songs", "billie")` from a coroutine
+
+Dependencies:
+- Database and ConnectionPool modules (for the actual queries and transactions)
+- concurrent.futures, threading, queue (for the reader pool and writer thread)
+"""
+
+import asyncio, queue, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import ConnectionPool
+import Database
+
+#Database functions that only read
+READ_FUNCTIONS = {
+    'get_playlist', 'get_all_playlists_for_user', 'get_all_songs', 'search_songs', 'get_song_details',
+    'get_library_stats', 'get_playlist_summaries',
+}
+
+#Database functions that write, these all go through the writer thread
+WRITE_FUNCTIONS = {
+    'create_playlist', 'add_songs_to_playlist', 'replace_playlist_songs', 'remove_playlist', 'append_song_to_playlist',
+    'remove_song_from_playlist', 'move_song_in_playlist', 'apply_playlist_edits',
+}
+
+#Writes with a slow half, name -> (slow half on a reader thread, SQL half on the writer thread). The slow half returns
+#the SQL half's arguments. login is one of them: it sets the current user and session and may store an upgraded hash
+PREPARED_WRITES = {
+    'signup': ('prepare_signup', 'create_user'),
+    'login': ('check_password', 'finish_login'),
+    'load_songs_to_database': ('read_songs_folder', 'load_songs_to_database'),
+}
+
+READER_THREADS = 3
+BATCH_SIZE = 64  #Most writes committed together
+BATCH_WINDOW = 0.005  #Seconds the writer waits for more writes before committing a batch
+
+class AsyncDatabase:
+    """Class that runs Database reads on a thread pool and all writes on one batching writer thread"""
+
+    def __init__(self, readers=READER_THREADS, batch_size=BATCH_SIZE, batch_window=BATCH_WINDOW):
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._writes = queue.Queue()
+        self._closed = False
+        self._stats_lock = threading.Lock()  #Counters are bumped from the callers, the readers and the writer
+        self.stats = {'reads': 0, 'writes': 0, 'prepared_writes': 0, 'batches': 0, 'failed_writes': 0}
+        self._writer = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+        self._writer.start()
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def read(self, function, *args, **kwargs):
+        """Function to run a read on the reader pool, returns a Future"""
+        self.count('reads')
+        return self._readers.submit(function, *args, **kwargs)
+
+    def write(self, function, *args, **kwargs):
+        """Function to queue a write for the writer thread, returns a Future"""
+        if self._closed:
+            raise RuntimeError("AsyncDatabase has been closed.")
+        future = Future()
+        self._writes.put((future, function, args, kwargs))
+        return future
+
+    def prepared_write(self, prepare, function, *args, **kwargs):
+        """Function to run prepare on the reader pool, then queue function(*prepare's result) for the writer thread,
+        returns a Future of the write"""
+        if self._closed:
+            raise RuntimeError("AsyncDatabase has been closed.")
+        future = Future()
+
+        def queue_write(prepared):
+            error = prepared.exception()
+            if error is None:
+                self._writes.put((future, function, prepared.result(), {}))
+            elif future.set_running_or_notify_cancel():
+                self.count('failed_writes')
+                future.set_exception(error)
+
+        self.count('prepared_writes')
+        self._readers.submit(prepare, *args, **kwargs).add_done_callback(queue_write)
+        return future
+
+    def call(self, name, *args, **kwargs):
+        """Function to run a Database function by name on the right thread"""
+        if name in PREPARED_WRITES:
+            prepare, function = PREPARED_WRITES[name]
+            return self.prepared_write(getattr(Database, prepare), getattr(Database, function), *args, **kwargs)
+        if name in WRITE_FUNCTIONS:
+            return self.write(getattr(Database, name), *args, **kwargs)
+        if name in READ_FUNCTIONS:
+            return self.read(getattr(Database, name), *args, **kwargs)
+        raise AttributeError(f"Database has no async function '{name}'.")
+
+    async def call_async(self, name, *args, **kwargs):
+        """Function to await a Database function from asyncio code"""
+        return await asyncio.wrap_future(self.call(name, *args, **kwargs))
+
+    def __getattr__(self, name):
+        #db.get_playlist(...) is the same as db.call("get_playlist", ...)
+        if name in READ_FUNCTIONS or name in WRITE_FUNCTIONS or name in PREPARED_WRITES:
+            return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+        raise AttributeError(name)
+
+    def close(self, wait=True):
+        """Function to finish the queued writes and stop the threads"""
+        self._closed = True
+        self._readers.shutdown(wait=wait)  #First, so prepared writes are queued before the writer is told to stop
+        self._writes.put(None)
+        if wait:
+            self._writer.join()
+
+    def _next_batch(self):
+        """Helper Function that blocks for one write, then collects any others already waiting"""
+        job = self._writes.get()
+        if job is None:
+            return None
+        batch = [job]
+        while len(batch) < self.batch_size:
+            try:
+                job = self._writes.get(timeout=self.batch_window)
+            except queue.Empty:
+                break
+            if job is None:
+                self._writes.put(None)  #Stop after this batch
+                break
+            batch.append(job)
+        return batch
+
+    def _write_loop(self):
+        """Helper Function for the writer thread"""
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            results = []
+            try:
+                with ConnectionPool.connection(write=True) as conn:
+                    for future, function, args, kwargs in batch:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        try:
+                            #Each write gets its own savepoint, a failure only undoes that write
+                            with ConnectionPool.connection():
+                                results.append((future, True, function(*args, **kwargs)))
+                        except Exception as e:
+                            results.append((future, False, e))
+            except Exception as e:
+                #The commit itself failed, none of the batch was saved
+                results = [(future, False, e) for future, *_ in batch if future.running()]
+
+            self.count('batches')
+            for future, success, value in results:
+                if success:
+                    self.count('writes')
+                    future.set_result(value)
+                else:
+                    self.count('failed_writes')
+                    future.set_exception(value)
+
+_instance = None
+_instance_lock = threading.Lock()
+
+def get_instance():
+    """Function to get the process-wide AsyncDatabase, created on first use"""
+    global _instance
+    with _instance_lock:
+        if _instance is None:
+            _instance = AsyncDatabase()
+        return _instance
@@ -0,0 +1,191 @@
+"""
+Module: Auth.py
+Author: Jacob       : Backend
+
+Description:
+This module holds the password hashing and login sessions used by Database.signup() and Database.login(). Passwords are
+stored with a slow key derivation function (PBKDF2-HMAC-SHA256 by default, scrypt as an option) using a random salt per
+user, in a self-describing string such as `pbkdf2_sha256$600000$<salt>$<hash>`. Because the algorithm and its cost are
+stored with every hash, the cost can be tuned at any time: older hashes still verify and are upgraded the next time
+their owner logs in. The plain SHA-256 hex digests written by older versions of the app are recognised the same way.
+All comparisons use hmac.compare_digest so they take the same time whether or not the password is close.
+
+A slow hash makes every login deliberately expensive, so a successful login also issues a session token. Later calls
+can check the token against the in-memory SessionCache (a dictionary lookup) instead of running the hash again.
+
+Usage:
+- `encoded = hash_password(password)` and `ok, upgrade = verify_password(password, encoded)`
+- `configure("scrypt", n=2**14)` or `configure("pbkdf2_sha256", iterations=300000)` to pick the hasher and its cost
+- `token = sessions.create(username)`, `sessions.get(token)` returns the username until the token expires
+
+Dependencies:
+- hashlib, hmac, secrets (for the key derivation functions, constant-time comparison and random salts/tokens)
+"""
+
+import hashlib, hmac, secrets, threading, time
+
+SALT_BYTES = 16
+
+class Pbkdf2Hasher:
+    """Class that hashes passwords with PBKDF2-HMAC-SHA256"""
+    algorithm = "pbkdf2_sha256"
+
+    def __init__(self, iterations=600000):
+        self.iterations = iterations
+
+    def encode(self, password, salt=None):
+        salt = salt or secrets.token_hex(SALT_BYTES)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), self.iterations).hex()
+        return f"{self.algorithm}${self.iterations}${salt}${digest}"
+
+    def verify(self, password, encoded):
+        algorithm, iterations, salt, digest = encoded.split("$")
+        candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), int(iterations)).hex()
+        return hmac.compare_digest(candidate, digest)
+
+    def needs_rehash(self, encoded):
+        return encoded.split("$")[1] != str(self.iterations)
+
+class ScryptHasher:
+    """Class that hashes passwords with scrypt (memory-hard, cost set by n, r and p)"""
+    algorithm = "scrypt"
+
+    def __init__(self, n=2**14, r=8, p=1):
+        self.n, self.r, self.p = n, r, p
+
+    def _derive(self, password, salt, n, r, p):
+        #maxmem has to cover 128 * n * r bytes plus some headroom, the default of 32 MiB is too small for larger n
+        return hashlib.scrypt(password.encode(), salt=salt.encode(), n=n, r=r, p=p,
+                              maxmem=256 * n * r + 2**20, dklen=32).hex()
+
+    def encode(self, password, salt=None):
+        salt = salt or secrets.token_hex(SALT_BYTES)
+        digest = self._derive(password, salt, self.n, self.r, self.p)
+        return f"{self.algorithm}${self.n}${self.r}${self.p}${salt}${digest}"
+
+    def verify(self, password, encoded):
+        algorithm, n, r, p, salt, digest = encoded.split("$")
+        return hmac.compare_digest(self._derive(password, salt, int(n), int(r), int(p)), digest)
+
+    def needs_rehash(self, encoded):
+        return encoded.split("$")[1:4] != [str(self.n), str(self.r), str(self.p)]
+
+class LegacySha256Hasher:
+    """Class that checks the unsalted SHA-256 hex digests stored by older versions, never used for new passwords"""
+    algorithm = "sha256"
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded)
+
+    def needs_rehash(self, encoded):
+        return True
+
+HASHERS = {'pbkdf2_sha256': Pbkdf2Hasher, 'scrypt': ScryptHasher}
+_legacy = LegacySha256Hasher()
+_hasher = Pbkdf2Hasher()
+
+def configure(algorithm="pbkdf2_sha256", **params):
+    """Function to choose the hasher (and its cost) used for new and upgraded passwords"""
+    global _hasher, _dummy_hash
+    if algorithm not in HASHERS:
+        raise ValueError(f"Unknown password hasher '{algorithm}'.")
+    _hasher = HASHERS[algorithm](**params)
+    _dummy_hash = None
+    return _hasher
+
+def get_hasher():
+    return _hasher
+
+def _hasher_for(encoded):
+    """Helper Function that finds the hasher that wrote a stored hash"""
+    if "$" not in encoded:
+        return _legacy
+    algorithm = encoded.split("$", 1)[0]
+    if algorithm not in HASHERS:
+        raise ValueError(f"Unknown password hash format '{algorithm}'.")
+    if algorithm == _hasher.algorithm:
+        return _hasher
+    return HASHERS[algorithm]()
+
+def hash_password(password):
+    """Function to hash a new password with the configured hasher and a fresh salt"""
+    return _hasher.encode(password)
+
+def verify_password(password, encoded):
+    """Function to check a password, returns (matches, needs_rehash)"""
+    hasher = _hasher_for(encoded)
+    if not hasher.verify(password, encoded):
+        return False, False
+    return True, hasher is not _hasher or hasher.needs_rehash(encoded)
+
+_dummy_hash = None
+
+def burn_verify(password):
+    """Function to spend the same time as a real check, used for unknown usernames so they can't be told apart"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = _hasher.encode("")
+    _hasher.verify(password, _dummy_hash)
+
+#Login sessions
+SESSION_TTL = 8 * 60 * 60  #Seconds a session stays valid after its last use
+MAX_SESSIONS = 1024
+
+class SessionCache:
+    """Class that maps random session tokens to usernames in memory, with sliding expiry"""
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._clock = clock
+        self._sessions = {}  #Token -> [username, expires_at]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def create(self, username):
+        """Function to start a session for a user who just logged in, returns its token"""
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                self._purge()
+            if len(self._sessions) >= self.max_sessions:
+                #Still full, drop the session closest to expiring
+                del self._sessions[min(self._sessions, key=lambda key: self._sessions[key][1])]
+            self._sessions[token] = [username, self._clock() + self.ttl]
+        return token
+
+    def get(self, token):
+        """Function to return the username for a live token (and extend it), or None"""
+        with self._lock:
+            entry = self._sessions.get(token) if token else None
+            now = self._clock()
+            if entry is None or entry[1] <= now:
+                self._sessions.pop(token, None)
+                self.misses += 1
+                return None
+            entry[1] = now + self.ttl
+            self.hits += 1
+            return entry[0]
+
+    def revoke(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def revoke_user(self, username):
+        """Function to end every session of a user, e.g. after their password changes"""
+        with self._lock:
+            for token in [token for token, entry in self._sessions.items() if entry[0] == username]:
+                del self._sessions[token]
+
+    def _purge(self):
+        now = self._clock()
+        for token in [token for token, entry in self._sessions.items() if entry[1] <= now]:
+            del self._sessions[token]
+
+    def get_stats(self):
+        with self._lock:
+            self._purge()
+            return {'active': len(self._sessions), 'hits': self.hits, 'misses': self.misses}
+
+sessions = SessionCache()
@@ -0,0 +1,139 @@
+"""
+Module: BulkIngest.py
+Author: Jacob       : Backend
+
+Description:
+This module imports the metadata of a large library in parallel. A normal sync reads new files one at a time, which is
+fine for a handful of new songs but slow for a fresh import of a whole library. Bulk ingest registers the files with
+LibrarySync first, then fans the MP3 parsing out over a process pool in chunks. Results stream back to the main process,
+which is the only writer, and are committed in batched transactions while files/sec progress is reported.
+
+Every committed batch is final, so an interrupted ingest (Ctrl+C, or a worker process that died) keeps its progress,
+including the chunks that finished but were not committed yet. Files whose cached metadata already matches their size
+and mtime are skipped, so running the command again resumes where it stopped.
+
+Usage:
+- `python BulkIngest.py --workers 8` ingests the Songs folder from the command line.
+- `bulk_ingest("Songs", workers=8)` does the same from Python and returns a summary dict.
+
+Dependencies:
+- concurrent.futures (for the process pool)
+- LibrarySync and Metadata modules (for registering files and reading/storing metadata)
+- Instrumentation module (for the musicdb.BulkIngest logger)
+"""
+
+import argparse, os, time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import ConnectionPool
+import Instrumentation
+import LibrarySync
+import Metadata
+
+log = Instrumentation.get_logger(__name__)
+
+CHUNK_SIZE = 200  #Files parsed per task sent to a worker
+BATCH_SIZE = 2000  #Rows committed per transaction
+
+def _read_chunk(songs_folder, chunk):
+    """Helper Function run in a worker process, parses one chunk of (name, size, mtime) files"""
+    return [Metadata.metadata_row(size, mtime, Metadata.read_audio_metadata(os.path.join(songs_folder, name)), name)
+            for name, size, mtime in chunk]
+
+def find_pending(songs_folder=LibrarySync.SONGS_FOLDER):
+    """Function to list the files whose metadata is missing or older than the file"""
+    entries = LibrarySync.scan_folder(songs_folder)
+    with ConnectionPool.connection() as conn:
+        cursor = conn.execute('''
+        SELECT Song, Song_Metadata.Size, Song_Metadata.Mtime
+        FROM Song_Table JOIN Song_Metadata ON Song_Metadata.Song_Index = Song_Table."Index"
+        ''')
+        cached = {song: (size, mtime) for song, size, mtime in cursor}
+    return [(name, *stat) for name, stat in entries.items() if cached.get(name) != stat]
+
+def log_progress(done, total, rate):
+    log.info("Ingested %d/%d files (%.0f files/sec)", done, total, rate)
+
+def bulk_ingest(songs_folder=LibrarySync.SONGS_FOLDER, workers=None, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE,
+                progress=log_progress):
+    """Function to sync the songs folder and read all missing metadata on a process pool"""
+    #Register new/removed files without reading their metadata inline
+    LibrarySync.sync_library(songs_folder, read_metadata=False)
+
+    pending = find_pending(songs_folder)
+    total = len(pending)
+    chunks = (pending[start:start + chunk_size] for start in range(0, total, chunk_size))
+
+    done = 0
+    buffer = []
+    started = time.perf_counter()
+    interrupted = False
+
+    def commit():
+        nonlocal done, buffer
+        if buffer:
+            with ConnectionPool.connection(write=True) as conn:
+                Metadata.store_metadata(conn, buffer)
+            done += len(buffer)
+            buffer = []
+            progress(done, total, done / max(time.perf_counter() - started, 1e-9))
+
+    def collect(futures):
+        #Buffer the rows of every chunk that finished before raising the first failure, so none of them are lost
+        failure = None
+        for future in futures:
+            if not future.done() or future.cancelled():
+                continue
+            if future.exception() is None:
+                buffer.extend(future.result())
+            elif failure is None:
+                failure = future.exception()
+        if failure is not None:
+            raise failure
+
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers)
+    max_in_flight = workers * 2  #Keep memory bounded, only a few chunks are queued at once
+    in_flight = set()
+    try:
+        for chunk in chunks:
+            in_flight.add(executor.submit(_read_chunk, songs_folder, chunk))
+            while len(in_flight) >= max_in_flight:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(finished)
+                if len(buffer) >= batch_size:
+                    commit()
+
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(finished)
+            if len(buffer) >= batch_size:
+                commit()
+    except (KeyboardInterrupt, BrokenProcessPool) as e:
+        #Ctrl+C also reaches the workers, one that dies mid-chunk breaks the whole pool
+        interrupted = True
+        log.warning("Ingest interrupted (%s), saving finished files. Run it again to resume.", type(e).__name__)
+        try:
+            collect(in_flight)  #Chunks that finished while we were waiting on others
+        except BaseException:
+            pass  #The failed chunks are read again on the next run
+    finally:
+        executor.shutdown(wait=not interrupted, cancel_futures=True)
+        commit()
+
+    elapsed = time.perf_counter() - started
+    return {'files': done, 'pending': total, 'seconds': elapsed, 'files_per_sec': done / elapsed if elapsed else 0.0,
+            'interrupted': interrupted}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read the metadata of every song in parallel.")
+    parser.add_argument("--songs", default=LibrarySync.SONGS_FOLDER, help="folder with the song files")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    import Database
+    Instrumentation.configure_logging()  #Progress is reported through the logger
+    Database.init()  #Creates/migrates the tables
+    print(bulk_ingest(args.songs, args.workers, args.chunk_size, args.batch_size))
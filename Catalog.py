@@ -0,0 +1,337 @@
+"""
+Module: Catalog.py
+Author: Jacob       : Backend
+
+Description:
+This module keeps an in-memory snapshot of the song catalog so the app can look songs up and filter them without a
+database round trip. A snapshot stores its columns compactly instead of as lists of Python strings:
+
+- song ids in an array('q'), plus an id -> row array, so looking a song up by id is O(1)
+- file names, titles and a lower-cased "title<tab>artist" search key each joined into one string, with an array('Q') of
+  where every row starts. Substring and prefix filters are str.find calls over the lower-cased keys, which run in C, and
+  match the title and artist but not the file name, so a term like "mp3" or "," doesn't match every song. A filter of
+  several words matches the songs that contain all of them, in any order and in either column.
+- artists as an array('I') of numbers into a table of interned artist names, since most artists have many songs
+
+Snapshots are never changed once built, so a view that holds one keeps a consistent catalog while a newer one is made.
+Keeping the snapshot current does not mean reloading it. Triggers on Song_Table log the id of every inserted, updated or
+deleted song in Song_Change_Log (migration 6); refresh() checks the newest log number, and if it moved, it reads just the
+songs logged since the snapshot was built and makes a new snapshot from the old one plus those rows. Only when the log
+was pruned past the snapshot (or the pool points at another database) is the catalog loaded again from scratch.
+
+Usage:
+- `Catalog.get_catalog()` returns the current snapshot, refreshed first if the database changed.
+- `snapshot.filter("hello")` / `snapshot.prefix("hel")` return the file names of songs whose title or artist matches,
+  `snapshot.lookup(song_id)` a row.
+- `prune_change_log(conn)` is called by the write paths to keep the change log short.
+
+Dependencies:
+- array, bisect (for the compact columns and mapping text positions back to rows)
+- ConnectionPool module (for the shared database connections)
+- Instrumentation module (for timings and the musicdb.Catalog logger)
+"""
+
+import sys, threading
+from array import array
+from bisect import bisect_right
+import ConnectionPool
+import Instrumentation
+
+log = Instrumentation.get_logger(__name__)
+
+CHANGE_LOG_KEEP = 10000  #Change log entries kept by prune_change_log, older snapshots are reloaded instead
+COMPACT_RATIO = 0.25  #Rebuild a snapshot once this share of its rows are replaced or deleted
+FETCH_BATCH = 500  #Song ids per IN (...) query when reading changed songs
+
+class TextColumn:
+    """Class for a column of strings stored as one joined string plus the offset where each row starts"""
+
+    def __init__(self, text="", starts=None):
+        self.text = text
+        self.starts = starts if starts is not None else array('Q', [0])  #One more entry than rows, the end of the text
+
+    @classmethod
+    def build(cls, values):
+        values = [value.replace('\n', ' ') for value in values]
+        starts = array('Q', [0])
+        position = 0
+        for value in values:
+            position += len(value) + 1
+            starts.append(position)
+        return cls(''.join(value + '\n' for value in values), starts)
+
+    def extended(self, values):
+        """Function to return a new column with values appended, the rows already stored keep their offsets"""
+        added = TextColumn.build(values)
+        base = len(self.text)
+        starts = array('Q', self.starts)
+        starts.extend(start + base for start in added.starts[1:])
+        return TextColumn(self.text + added.text, starts)
+
+    def __getitem__(self, row):
+        return self.text[self.starts[row]:self.starts[row + 1] - 1]
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def find_rows(self, needle, at_start=False):
+        """Function to yield the rows containing needle (or starting with it), each row once and in order"""
+        text, starts = self.text, self.starts
+        if at_start:
+            needle = '\n' + needle  #Every row but the first follows a newline, the first is checked directly
+            if text.startswith(needle[1:]):
+                yield 0
+        position = text.find(needle)
+        while position != -1:
+            row = bisect_right(starts, position + at_start) - 1
+            yield row
+            position = text.find(needle, starts[row + 1] - at_start)
+
+class CatalogSnapshot:
+    """Class for one immutable version of the song catalog in compact columns"""
+
+    def __init__(self, version, ids, names, keys, titles, artist_ids, artists, artist_numbers, pool=None):
+        self.version = version  #Newest Song_Change_Log entry included
+        self.ids = ids
+        self.names = names
+        self.keys = keys  #Lower-cased "title<tab>artist" of every row, what filter() and prefix() search
+        self.titles = titles
+        self.artist_ids = artist_ids
+        self.artists = artists  #Shared between snapshots, only ever appended to
+        self._artist_numbers = artist_numbers
+        self.pool = pool
+        self.live = bytearray(b'\1') * len(ids)  #0 for rows replaced or deleted by a later change
+        self.dead = 0
+        self._row_by_id = array('q', [-1]) * ((max(ids) + 1) if ids else 0)
+        for row, song_id in enumerate(ids):
+            self._row_by_id[song_id] = row
+
+    @classmethod
+    def from_rows(cls, version, rows, artists=None, artist_numbers=None, pool=None):
+        """Function to build a snapshot from (id, song, title, artist) rows"""
+        artists = artists if artists is not None else []
+        artist_numbers = artist_numbers if artist_numbers is not None else {}
+        ids = array('q', (row[0] for row in rows))
+        names = [row[1] for row in rows]
+        artist_ids = array('I', (cls._artist_number(artists, artist_numbers, row[3]) for row in rows))
+        return cls(version, ids, TextColumn.build(names), TextColumn.build([cls._search_key(row) for row in rows]),
+                   TextColumn.build([row[2] or '' for row in rows]), artist_ids, artists, artist_numbers, pool)
+
+    @staticmethod
+    def _search_key(row):
+        """Helper Function that returns the lower-cased "title<tab>artist" of an (id, song, title, artist) row"""
+        return f"{row[2] or ''}\t{row[3] or 'Unknown'}".lower()
+
+    @staticmethod
+    def _artist_number(artists, artist_numbers, artist):
+        """Helper Function that returns the number of an artist in the interned artist table, adding it if new"""
+        artist = artist or "Unknown"
+        number = artist_numbers.get(artist)
+        if number is None:
+            number = artist_numbers[artist] = len(artists)
+            artists.append(sys.intern(artist))
+        return number
+
+    def updated(self, version, rows, deleted_ids):
+        """Function to return a new snapshot with rows inserted or replaced and deleted_ids removed"""
+        retired = [self._row_by_id[song_id] for song_id in [row[0] for row in rows] + list(deleted_ids)
+                   if 0 <= song_id < len(self._row_by_id) and self._row_by_id[song_id] >= 0]
+        if self.dead + len(retired) > len(self.ids) * COMPACT_RATIO:
+            #Too many stale rows, build a fresh snapshot from the live ones
+            replaced = {row[0] for row in rows} | set(deleted_ids)
+            kept = [(song_id, self.names[row], self.titles[row], self.artists[self.artist_ids[row]])
+                    for row, song_id in enumerate(self.ids) if self.live[row] and song_id not in replaced]
+            kept.extend(rows)
+            kept.sort()
+            return CatalogSnapshot.from_rows(version, kept, self.artists, self._artist_numbers, self.pool)
+
+        snapshot = CatalogSnapshot.__new__(CatalogSnapshot)
+        snapshot.version = version
+        snapshot.ids = array('q', self.ids)
+        snapshot.ids.extend(row[0] for row in rows)
+        snapshot.names = self.names.extended([row[1] for row in rows])
+        snapshot.keys = self.keys.extended([self._search_key(row) for row in rows])
+        snapshot.titles = self.titles.extended([row[2] or '' for row in rows])
+        snapshot.artists = self.artists
+        snapshot._artist_numbers = self._artist_numbers
+        snapshot.artist_ids = array('I', self.artist_ids)
+        snapshot.artist_ids.extend(self._artist_number(self.artists, self._artist_numbers, row[3]) for row in rows)
+        snapshot.pool = self.pool
+        snapshot.live = bytearray(self.live) + bytearray(b'\1') * len(rows)
+        for row in retired:
+            snapshot.live[row] = 0
+        snapshot.dead = self.dead + len(retired)
+
+        snapshot._row_by_id = array('q', self._row_by_id)
+        for song_id in deleted_ids:
+            if 0 <= song_id < len(snapshot._row_by_id):
+                snapshot._row_by_id[song_id] = -1
+        highest = max((row[0] for row in rows), default=-1)
+        if highest >= len(snapshot._row_by_id):
+            snapshot._row_by_id.extend(array('q', [-1]) * (highest + 1 - len(snapshot._row_by_id)))
+        for row, song_id in enumerate(snapshot.ids[len(self.ids):], start=len(self.ids)):
+            snapshot._row_by_id[song_id] = row
+        return snapshot
+
+    def __len__(self):
+        return len(self.ids) - self.dead
+
+    def _row(self, song_id):
+        if 0 <= song_id < len(self._row_by_id):
+            row = self._row_by_id[song_id]
+            if row >= 0:
+                return row
+        return None
+
+    def __contains__(self, song_id):
+        return self._row(song_id) is not None
+
+    def lookup(self, song_id):
+        """Function to get (song, title, artist) for a song id in O(1), or None if there is no such song"""
+        row = self._row(song_id)
+        if row is None:
+            return None
+        return self.names[row], self.titles[row], self.artists[self.artist_ids[row]]
+
+    def song_names(self, song_ids):
+        """Function to turn song ids into file names, unknown ids are skipped"""
+        rows = (self._row(song_id) for song_id in song_ids)
+        return [self.names[row] for row in rows if row is not None]
+
+    def _sort_key(self, sort):
+        """Helper Function that returns a row sort key matching Database.SORT_ORDERS"""
+        if sort == 'title':
+            return lambda row: (self.titles[row].lower(), self.ids[row])
+        if sort == 'artist':
+            return lambda row: (self.artists[self.artist_ids[row]].lower(), self.titles[row].lower(), self.ids[row])
+        if sort in (None, 'added'):
+            return None
+        raise ValueError(f"Unknown sort order: {sort}")
+
+    def _collect(self, rows, limit, sort=None):
+        key = self._sort_key(sort)
+        if key is not None:
+            rows = sorted((row for row in rows if self.live[row]), key=key)
+        songs = []
+        for row in rows:
+            if self.live[row]:
+                songs.append(self.names[row])
+                if limit is not None and len(songs) >= limit:
+                    break
+        return songs
+
+    def filter(self, text, limit=None, sort=None):
+        """Function to get the file names of the songs whose title or artist contain every word of text
+        (case-insensitive), in the order the songs were added unless sort is 'title' or 'artist'"""
+        words = sorted(set(self._needle(text).split()), key=len, reverse=True)
+        if not words:
+            return self._collect(range(len(self.ids)), limit, sort)
+
+        #The longest word is usually the rarest, search the keys for it and check the others on just those rows
+        rows = self.keys.find_rows(words[0])
+        if len(words) > 1:
+            keys, others = self.keys, words[1:]
+            rows = (row for row in rows if all(word in keys[row] for word in others))
+        return self._collect(rows, limit, sort)
+
+    def prefix(self, text, limit=None):
+        """Function to get the file names of the songs whose title starts with text (case-insensitive)"""
+        text = self._needle(text)
+        if not text:
+            return self._collect(range(len(self.ids)), limit)
+        return self._collect(self.keys.find_rows(text, at_start=True), limit)
+
+    @staticmethod
+    def _needle(text):
+        """Helper Function that lower-cases a search term and keeps it from matching across the key separators"""
+        return text.lower().replace('\n', ' ').replace('\t', ' ')
+
+    def by_artist(self, artist, limit=None):
+        """Function to get the file names of an artist's songs"""
+        number = self._artist_numbers.get(artist)
+        if number is None:
+            return []
+        return self._collect((row for row, value in enumerate(self.artist_ids) if value == number), limit)
+
+    def get_stats(self):
+        text_bytes = sum(len(column.text) + column.starts.itemsize * len(column.starts)
+                         for column in (self.names, self.keys, self.titles))
+        array_bytes = sum(values.itemsize * len(values) for values in (self.ids, self.artist_ids, self._row_by_id))
+        return {'version': self.version, 'songs': len(self), 'rows': len(self.ids), 'stale_rows': self.dead,
+                'artists': len(self.artists), 'approx_bytes': text_bytes + array_bytes + len(self.live)}
+
+#Process-wide snapshot
+_lock = threading.Lock()
+_snapshot = None
+_stats = {'full_loads': 0, 'incremental_refreshes': 0, 'changed_songs': 0}
+
+def _change_log_bounds(conn):
+    """Helper Function that returns the (oldest, newest) change log entry numbers, each a single index lookup"""
+    return conn.execute('SELECT (SELECT MIN(Seq) FROM Song_Change_Log), (SELECT MAX(Seq) FROM Song_Change_Log)').fetchone()
+
+def _load(conn, version, pool):
+    rows = conn.execute('SELECT "Index", Song, Title, Artist FROM Song_Table WHERE Song IS NOT NULL ORDER BY "Index"').fetchall()
+    _stats['full_loads'] += 1
+    log.debug("Catalog loaded: %d songs at change %d.", len(rows), version)
+    return CatalogSnapshot.from_rows(version, rows, pool=pool)
+
+def _read_changes(conn, snapshot, newest):
+    """Helper Function that reads the songs logged after the snapshot, returns (current rows, deleted ids)"""
+    song_ids = sorted({row[0] for row in conn.execute(
+        'SELECT Song_Index FROM Song_Change_Log WHERE Seq > ? AND Seq <= ?', (snapshot.version, newest))})
+    rows = []
+    for start in range(0, len(song_ids), FETCH_BATCH):
+        batch = song_ids[start:start + FETCH_BATCH]
+        placeholders = ', '.join('?' * len(batch))
+        rows.extend(conn.execute(f'SELECT "Index", Song, Title, Artist FROM Song_Table '
+                                 f'WHERE "Index" IN ({placeholders}) AND Song IS NOT NULL', batch))
+    found = {row[0] for row in rows}
+    return rows, [song_id for song_id in song_ids if song_id not in found]
+
+@Instrumentation.timed
+def refresh():
+    """Function to bring the process-wide snapshot up to date with the database and return it"""
+    global _snapshot
+    with _lock:
+        pool = ConnectionPool.get_pool()
+        snapshot = _snapshot
+        with pool.connection() as conn:
+            oldest, newest = _change_log_bounds(conn)
+            newest = newest or 0
+            if snapshot is None or snapshot.pool is not pool or newest < snapshot.version or \
+                    (oldest is not None and snapshot.version < oldest - 1):
+                #First use, another database, or the entries we need were pruned
+                snapshot = _load(conn, newest, pool)
+            elif newest > snapshot.version:
+                rows, deleted_ids = _read_changes(conn, snapshot, newest)
+                snapshot = snapshot.updated(newest, rows, deleted_ids)
+                _stats['incremental_refreshes'] += 1
+                _stats['changed_songs'] += len(rows) + len(deleted_ids)
+        _snapshot = snapshot
+    return snapshot
+
+def change_counter():
+    """Function to read the newest Song_Change_Log entry number, it moves whenever a song is added, changed or removed"""
+    with ConnectionPool.connection() as conn:
+        return conn.execute('SELECT MAX(Seq) FROM Song_Change_Log').fetchone()[0] or 0
+
+def get_catalog():
+    """Function to get the current catalog snapshot"""
+    return refresh()
+
+def invalidate():
+    """Function to drop the snapshot so the next get_catalog() loads the catalog again"""
+    global _snapshot
+    with _lock:
+        _snapshot = None
+
+def prune_change_log(conn, keep=CHANGE_LOG_KEEP):
+    """Function to delete all but the newest keep change log entries"""
+    conn.execute('DELETE FROM Song_Change_Log WHERE Seq <= (SELECT MAX(Seq) FROM Song_Change_Log) - ?', (keep,))
+
+def get_stats():
+    stats = dict(_stats)
+    snapshot = _snapshot
+    if snapshot is not None:
+        stats.update(snapshot.get_stats())
+    return stats
@@ -0,0 +1,221 @@
+"""
+Module: CommandLine.py
+Author: Jacob       : Backend
+
+Description:
+This module is a headless command-line interface to the music database, so imports, playlist exports and maintenance can
+be scripted on machines without a display. It only uses the Database module and the backend modules (it never imports
+Tkinter or pygame), prints every result as JSON, and accepts song lists and user lists from files for large batches.
+
+Usage:
+    python -m CommandLine [--db song_database.db] <command> ...
+
+    create-user USERNAME --password PASSWORD      create one user
+    create-user --from-file users.csv             create users from "username,password" lines
+    sync [--songs Songs] [--bulk] [--workers N]   sync the Songs folder (--bulk reads metadata in parallel)
+    search QUERY [--limit N] [--offset N]         full-text search over titles and artists
+    playlist list USERNAME                        list a user's playlists
+    playlist create|append|replace USERNAME NAME [SONG ...] [--from-file songs.txt]
+    playlist export USERNAME NAME [--output songs.txt] [--format json|lines|m3u|jsonl|csv]
+    playlist import USERNAME NAME --input mix.m3u [--format m3u|jsonl|csv] [--append] [--unmatched missing.txt]
+    stats                                         library counters, schema version and pool statistics
+
+    --metrics FILE [--metrics-format json|prometheus]   time the command and write function/SQL timings to FILE
+
+Song files hold one song file name per line ("-" reads from standard input). M3U, JSON Lines and CSV playlists are
+streamed through the PlaylistIO module; their format follows the file extension unless --format is given.
+
+Dependencies:
+- argparse, json (for parsing arguments and printing results)
+- Database module (for all database operations)
+- PlaylistIO module (for importing and exporting playlist files)
+- Instrumentation module (for log output and --metrics)
+"""
+
+import argparse, contextlib, csv, json, os, sys
+import ConnectionPool
+import Database
+import Instrumentation
+import PlaylistIO
+
+def _read_lines(path):
+    """Helper Function that yields the non-empty lines of a file, or of stdin for "-" """
+    handle = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in handle:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+def _song_arguments(args):
+    songs = list(args.songs)
+    if args.from_file:
+        songs.extend(_read_lines(args.from_file))
+    return songs
+
+def cmd_create_user(args):
+    if args.from_file:
+        handle = sys.stdin if args.from_file == "-" else open(args.from_file, newline="", encoding="utf-8")
+        with handle:
+            users = [(row[0].strip(), row[1]) for row in csv.reader(handle) if len(row) >= 2]
+    elif args.username and args.password:
+        users = [(args.username, args.password)]
+    else:
+        return False, {'error': "Give USERNAME and --password, or --from-file."}
+
+    results = []
+    for username, password in users:
+        success, message = Database.signup(username, password)
+        results.append({'username': username, 'created': success, 'message': message})
+    return all(result['created'] for result in results), {'users': results}
+
+def cmd_sync(args):
+    if args.bulk:
+        import BulkIngest
+        return True, BulkIngest.bulk_ingest(args.songs, args.workers, progress=lambda done, total, rate: None)
+
+    import LibrarySync
+    changes = LibrarySync.sync_library(args.songs)
+    return True, {key: len(names) for key, names in changes.items()}
+
+def cmd_search(args):
+    songs = Database.search_songs(args.query, args.limit, args.offset)
+    return True, {'query': args.query, 'count': len(songs), 'songs': songs}
+
+def _playlist_file_format(args):
+    """Helper Function that returns the PlaylistIO format of an export, None for the plain json/lines output"""
+    if args.format in ("json", "lines"):
+        return None
+    if args.format:
+        return args.format
+    if args.output and os.path.splitext(args.output)[1].lower() in PlaylistIO.FORMATS:
+        return PlaylistIO.detect_format(args.output)
+    return None
+
+def cmd_playlist(args):
+    if args.action == "list":
+        playlists, error = Database.get_all_playlists_for_user(args.username)
+        return True, {'username': args.username, 'playlists': playlists or []}
+
+    if args.action == "import":
+        if not args.input:
+            return False, {'error': "Give the playlist file with --input."}
+        report, error = PlaylistIO.import_playlist(args.username, args.name, args.input, args.format,
+                                                   replace=not args.append, unmatched_path=args.unmatched)
+        return (True, report) if error is None else (False, {'error': error})
+
+    if args.action == "export" and _playlist_file_format(args):
+        if not args.output:
+            return False, {'error': f"--format {args.format} needs --output."}
+        report, error = PlaylistIO.export_playlist(args.username, args.name, args.output, _playlist_file_format(args),
+                                                   args.song_folder)
+        return (True, report) if error is None else (False, {'error': error})
+
+    playlists, _ = Database.get_all_playlists_for_user(args.username)
+    exists = args.name in (playlists or [])
+
+    if args.action == "export":
+        if not exists:
+            return False, {'error': f"Playlist '{args.name}' not found for user '{args.username}'."}
+        songs, error = Database.get_playlist(args.name, args.username)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as handle:
+                if args.format == "lines":
+                    handle.writelines(f"{song}\n" for song in songs)
+                else:
+                    json.dump(songs, handle, indent=2)
+            return True, {'playlist': args.name, 'count': len(songs), 'output': args.output}
+        return True, {'playlist': args.name, 'count': len(songs), 'songs': songs}
+
+    songs = _song_arguments(args)
+    if args.action == "create":
+        if exists:
+            return False, {'error': f"Playlist '{args.name}' already exists for user '{args.username}'."}
+        Database.add_songs_to_playlist(args.username, args.name, songs)
+    elif args.action == "append":
+        if not exists:
+            return False, {'error': f"Playlist '{args.name}' not found for user '{args.username}'."}
+        Database.add_songs_to_playlist(args.username, args.name, songs)
+    else:
+        Database.replace_playlist_songs(args.username, args.name, songs)
+
+    stored, _ = Database.get_playlist(args.name, args.username)
+    return True, {'playlist': args.name, 'requested': len(songs), 'count': len(stored or [])}
+
+def cmd_stats(args):
+    stats = Database.get_library_stats()
+    stats['pool'] = ConnectionPool.get_stats()
+    return True, stats
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m CommandLine", description="Headless music database tools.")
+    parser.add_argument("--db", default=ConnectionPool.DATABASE_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--metrics", metavar="FILE", help="record function and SQL timings and write them to FILE")
+    parser.add_argument("--metrics-format", choices=["json", "prometheus"], default="json")
+    parser.add_argument("--log-level", default=None, help="DEBUG, INFO (default), WARNING or ERROR")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create_user = commands.add_parser("create-user", help="create users")
+    create_user.add_argument("username", nargs="?")
+    create_user.add_argument("--password")
+    create_user.add_argument("--from-file", help='CSV file of "username,password" lines, "-" for stdin')
+    create_user.set_defaults(handler=cmd_create_user)
+
+    sync = commands.add_parser("sync", help="sync the Songs folder into the database")
+    sync.add_argument("--songs", default="Songs")
+    sync.add_argument("--bulk", action="store_true", help="read metadata on a process pool")
+    sync.add_argument("--workers", type=int, default=None)
+    sync.set_defaults(handler=cmd_sync)
+
+    search = commands.add_parser("search", help="search song titles and artists")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=100)
+    search.add_argument("--offset", type=int, default=0)
+    search.set_defaults(handler=cmd_search)
+
+    playlist = commands.add_parser("playlist", help="list, create, append to, replace, import or export playlists")
+    playlist.add_argument("action", choices=["list", "create", "append", "replace", "import", "export"])
+    playlist.add_argument("username")
+    playlist.add_argument("name", nargs="?")
+    playlist.add_argument("songs", nargs="*", help="song file names")
+    playlist.add_argument("--from-file", help='file with one song per line, "-" for stdin')
+    playlist.add_argument("--output", help="export to this file instead of printing")
+    playlist.add_argument("--format", choices=["json", "lines", "m3u", "m3u8", "jsonl", "csv"], default=None,
+                          help="json (default), lines, or a playlist file format (default: from the file extension)")
+    playlist.add_argument("--input", help="playlist file to import (.m3u, .m3u8, .jsonl or .csv)")
+    playlist.add_argument("--append", action="store_true", help="import after the existing songs instead of replacing them")
+    playlist.add_argument("--unmatched", help="write every import entry that matched no song to this file")
+    playlist.add_argument("--song-folder", help="folder written in front of the song names in exported M3U files")
+    playlist.set_defaults(handler=cmd_playlist)
+
+    stats = commands.add_parser("stats", help="show library statistics")
+    stats.set_defaults(handler=cmd_stats)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "playlist" and args.action != "list" and not args.name:
+        parser.error("playlist name is required")
+
+    #Log messages go to stderr so stdout stays valid JSON
+    Instrumentation.configure_logging(args.log_level)
+    if args.metrics:
+        Instrumentation.enable()
+    with contextlib.redirect_stdout(sys.stderr):
+        Database.init(args.db)
+        success, result = args.handler(args)
+    print(json.dumps(result, indent=2))
+
+    if args.metrics:
+        if args.metrics_format == "prometheus":
+            Instrumentation.dump_prometheus(args.metrics)
+        else:
+            Instrumentation.dump_json(args.metrics)
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
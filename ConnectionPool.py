@@ -0,0 +1,239 @@
+"""
+Module: ConnectionPool.py
+Author: Jacob       : Backend
+
+Description:
+This module keeps a small pool of long-lived SQLite connections so the functions in Database.py no longer open and close
+song_database.db on every call. Connections are created lazily (WAL mode and the tuned pragmas are applied once, when a
+connection is opened) and every thread is handed back the same warm connection whenever it is free. Connections are lent
+out through a context manager that wraps the work in a transaction; nested use on the same thread reuses the borrowed
+connection inside a savepoint, so helpers can call each other without opening a second connection.
+
+Blocks that write ask for `connection(write=True)`, which starts with BEGIN IMMEDIATE and so takes the write lock up
+front (waiting up to busy_timeout for it). A plain BEGIN only takes it at the first write, and in WAL mode that upgrade
+fails at once with "database is locked" if another connection committed since the block started reading; busy_timeout
+does not retry that case. Read-only blocks keep the plain BEGIN so they never wait for writers.
+
+Usage:
+- `with ConnectionPool.connection() as conn:` borrows a connection, commits on success and rolls back on an exception.
+  Use `connection(write=True)` for anything that writes, nested blocks join the outer transaction.
+- `ConnectionPool.configure(path, size)` points the pool at another database file or changes how many connections it keeps.
+- `ConnectionPool.get_stats()` reports pool hits/misses and how long callers waited for a free connection.
+- `ConnectionPool.after_commit(callback)` runs callback once the calling thread's transaction has committed.
+
+Dependencies:
+- SQLite3 (for database management)
+- threading (for handing connections to several threads safely)
+- Instrumentation module (for SQL statement tracing while it is switched on)
+"""
+
+import sqlite3, threading, time
+from contextlib import contextmanager
+import Instrumentation
+
+#Defaults used by the process-wide pool
+DATABASE_PATH = 'song_database.db'
+POOL_SIZE = 4
+ACQUIRE_TIMEOUT = 30.0
+
+#Applied once to every new connection
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 134217728',
+    'PRAGMA busy_timeout = 5000',
+)
+
+class ConnectionPool:
+    """Class that lends out a bounded number of warm SQLite connections, preferring one per thread"""
+
+    def __init__(self, path=DATABASE_PATH, size=POOL_SIZE, timeout=ACQUIRE_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = []  #Connections that are open but not lent to any thread
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'timeouts': 0, 'wait_time': 0.0, 'max_wait': 0.0}
+
+    def _open(self):
+        """Helper Function that opens and tunes a new connection"""
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        """Helper Function that takes a free connection, opening or waiting for one if needed"""
+        conn = None
+        wait_started = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Connection pool has been closed.")
+
+                #Prefer the connection this thread used last time so its page cache stays warm
+                home = getattr(self._local, 'home', None)
+                if home is not None and home in self._idle:
+                    self._idle.remove(home)
+                    conn = home
+                    self._stats['hits'] += 1
+                    break
+                if self._idle:
+                    conn = self._idle.pop()
+                    self._stats['hits'] += 1
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    self._stats['misses'] += 1
+                    break
+
+                #Every connection is lent out, wait for one to come back
+                now = time.perf_counter()
+                if wait_started is None:
+                    wait_started = now
+                    self._stats['waits'] += 1
+                remaining = self.timeout - (now - wait_started)
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    self._stats['timeouts'] += 1
+                    self._record_wait(wait_started)
+                    raise sqlite3.OperationalError("Timed out waiting for a database connection.")
+
+            if wait_started is not None:
+                self._record_wait(wait_started)
+
+        if conn is None:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+
+        self._local.home = conn
+        return conn
+
+    def _record_wait(self, wait_started):
+        waited = time.perf_counter() - wait_started
+        self._stats['wait_time'] += waited
+        self._stats['max_wait'] = max(self._stats['max_wait'], waited)
+
+    def _release(self, conn):
+        """Helper Function that gives a connection back to the pool"""
+        with self._cond:
+            if self._closed:
+                self._created -= 1
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, write=False):
+        """Function to borrow a connection for the duration of a `with` block, write=True takes the write lock first"""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+
+        if conn is not None:
+            #Nested use on the same thread: reuse the borrowed connection inside a savepoint
+            local.depth += 1
+            savepoint = f'sp_{local.depth}'
+            conn.execute(f'SAVEPOINT {savepoint}')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute(f'ROLLBACK TO {savepoint}')
+                conn.execute(f'RELEASE {savepoint}')
+                raise
+            else:
+                conn.execute(f'RELEASE {savepoint}')
+            finally:
+                local.depth -= 1
+        else:
+            conn = self._acquire()
+            local.conn = conn
+            local.depth = 0
+            local.after_commit = []
+            Instrumentation.attach_connection(conn)
+            try:
+                conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+                try:
+                    yield conn
+                except BaseException:
+                    conn.rollback()
+                    raise
+                else:
+                    conn.commit()
+            finally:
+                Instrumentation.detach_connection(conn)
+                local.conn = None
+                callbacks, local.after_commit = local.after_commit, []
+                self._release(conn)
+            #Only reached when the transaction committed
+            for callback in callbacks:
+                callback()
+
+    def in_transaction(self):
+        """Function to tell if this thread is inside a `with connection()` block"""
+        return getattr(self._local, 'conn', None) is not None
+
+    def after_commit(self, callback):
+        """Function to run callback when this thread's transaction commits, right away if there is none"""
+        if not self.in_transaction():
+            callback()
+        else:
+            self._local.after_commit.append(callback)
+
+    def get_stats(self):
+        """Function to report pool hit/miss and wait-time counters"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._created
+            stats['idle'] = len(self._idle)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        """Function to close every idle connection, borrowed ones are closed when they come back"""
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                conn.close()
+            self._created -= len(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+
+#Process-wide pool shared by Database.py and the other backend modules
+_pool = ConnectionPool()
+
+def configure(path=None, size=None, timeout=None):
+    """Function to replace the process-wide pool, e.g. to use another database file"""
+    global _pool
+    old_pool = _pool
+    _pool = ConnectionPool(path or old_pool.path, size or old_pool.size, timeout or old_pool.timeout)
+    old_pool.close()
+    return _pool
+
+def get_pool():
+    return _pool
+
+def connection(write=False):
+    """Function to borrow a connection from the process-wide pool, write=True for blocks that write"""
+    return _pool.connection(write)
+
+def in_transaction():
+    return _pool.in_transaction()
+
+def after_commit(callback):
+    return _pool.after_commit(callback)
+
+def get_stats():
+    return _pool.get_stats()
@@ -13,23 +13,43 @@ Usage:
 - Users can sign up, log in, and manage their playlists.
 - Songs can be loaded from a directory and added to playlists, which are then stored in the database.
 - Functions like `signup()`, `login()`, and `add_songs_to_playlist()` handle the core interactions with the database.
+- `signup()`, `login()` and `load_songs_to_database()` are also split into a slow half that only reads (hashing, reading
+  files) and a short write half, e.g. `create_user(*prepare_signup(username, password))`, for AsyncDatabase's writer.
+- Playlist names are unique per user; `get_playlist_summaries()` lists a user's playlists with track counts and durations.
+- `apply_playlist_edits()` saves only what changed in a playlist editor, recorded by PlaylistEdit.PlaylistEditSession.
+- Playlist and song list reads are cached by QueryCache; every write here calls `QueryCache.touch()` for the tables it
+  changes, so a cached read never outlives a write.
+- Large libraries are read a page at a time with `get_songs_page()` / `search_songs_page()`, or streamed with `iter_songs()`.
+- Call `init()` once at startup to pick the database file and create or upgrade its tables. Importing this module
+  does not touch the database, and it never imports Tkinter, pygame or mutagen (mutagen is loaded by Metadata on first use).
 
 
 Dependencies:
 - SQLite3 (for database management)
-- hashlib (for password hashing)
-- tkinter (for GUI interactions with message boxes)
-- mutagen (for MP3 file metadata extraction)
+- ConnectionPool module (for the shared, long-lived database connections)
+- LibrarySync module (for incremental syncing of the Songs directory)
+- Migrations module (for upgrading existing databases in place)
+- Auth module (for salted, tunable password hashing and login sessions)
+- Metadata module (for cached MP3 durations and tags)
+- Instrumentation module (for function timings and the musicdb.Database logger)
+- QueryCache module (for keeping playlist and song reads in memory until they are written)
 
 """
 
-import sqlite3, hashlib, os, json
-from tkinter import messagebox
-from mutagen.mp3 import MP3
-import Activity
+import sqlite3, os, re, string, threading
+import Auth
+import ConnectionPool
+import Instrumentation
+import LibrarySync
+import Metadata
+import Migrations
+import QueryCache
+
+log = Instrumentation.get_logger(__name__)
 
 #Global variable and functions to store the current user
 _current_user = None
+_current_session = None
 conn = None
 
 def set_current_user(username):
@@ -39,321 +59,691 @@ def set_current_user(username):
 def get_current_user():
     return _current_user
 
-def connect():
-    conn = sqlite3.connect('song_database.db')
-    return conn
-
+def get_session_token():
+    """Function to get the session token issued by the last successful login"""
+    return _current_session
+
+#Set once the tables have been created, see init()
+_initialized = False
+_init_lock = threading.Lock()
+
+def init(path=None, pool_size=None):
+    """Function to choose the database file and create or migrate its tables, call once at startup"""
+    global _initialized
+    with _init_lock:
+        if path or pool_size:
+            ConnectionPool.configure(path, pool_size)
+        create_tables()
+        QueryCache.clear()  #Another file, or one that was changed while nothing was watching it
+        _initialized = True
+
+def _ensure_initialized():
+    if not _initialized:
+        init()  #First use without an explicit init()
+
+def connect(write=False):
+    """Function to borrow a pooled connection, use it as `with connect() as conn:` (write=True for writes)"""
+    _ensure_initialized()
+    return ConnectionPool.connection(write)
+
+@Instrumentation.timed
 def remove_playlist(username, playlist_name):
     """Function to remove a playlist belonging to a user."""
-    conn = connect()
-    cursor = conn.cursor()
-
-    #Check if the playlist exists for this user
-    cursor.execute('SELECT * FROM Playlist_Table WHERE Name = ? AND User_Username = ?', (playlist_name, username))
-    row = cursor.fetchone()
-
-    if row:
-        #Delete the playlist
-        cursor.execute('DELETE FROM Playlist_Table WHERE Name = ? AND User_Username = ?', (playlist_name, username))
-        conn.commit()
-        conn.close()
-        return True, f"Playlist '{playlist_name}' has been removed."
-    else:
-        conn.close()
-        return False, f"Playlist '{playlist_name}' not found for user '{username}'."
+    with connect(write=True) as conn:
+        cursor = conn.cursor()
+
+        #Check if the playlist exists for this user
+        cursor.execute('SELECT * FROM Playlist_Table WHERE Name = ? AND User_Username = ?', (playlist_name, username))
+        row = cursor.fetchone()
+
+        if row:
+            #Delete the playlist and its songs
+            cursor.execute('DELETE FROM Playlist_Song WHERE PlaylistID = ?', (row[0],))
+            cursor.execute('DELETE FROM Playlist_Table WHERE PlaylistID = ?', (row[0],))
+            QueryCache.touch('Playlist_Table', 'Playlist_Song')
+            return True, f"Playlist '{playlist_name}' has been removed."
+        else:
+            return False, f"Playlist '{playlist_name}' not found for user '{username}'."
 
 #Database Creation
 def create_tables():
     """Function to set up database incase it does not already exists"""
-    conn = connect()
-    cursor = conn.cursor()
-
-    #Create User_Table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS User_Table (
-        Username VARCHAR(45) PRIMARY KEY,
-        Password VARCHAR(45),
-        Playlist_Table_Name VARCHAR(45),
-        FOREIGN KEY (Playlist_Table_Name) REFERENCES Playlist_Table(Name)
-    )
-    ''')
-
-    #Create Playlist_Table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Playlist_Table (
-        PlaylistID INTEGER PRIMARY KEY AUTOINCREMENT,
-        Name VARCHAR(45),
-        User_Username VARCHAR(45),
-        List JSON,
-        FOREIGN KEY (User_Username) REFERENCES User_Table(Username)
-    )
-    ''')
-
-    #Create Song_Table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Song_Table (
-        "Index" INTEGER PRIMARY KEY AUTOINCREMENT,
-        Song TEXT
-    )
-    ''')
-
-    conn.commit()
-    conn.close()
+    with ConnectionPool.connection(write=True) as conn:
+        cursor = conn.cursor()
+
+        #Create User_Table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS User_Table (
+            Username VARCHAR(45) PRIMARY KEY,
+            Password VARCHAR(45),
+            Playlist_Table_Name VARCHAR(45),
+            FOREIGN KEY (Playlist_Table_Name) REFERENCES Playlist_Table(Name)
+        )
+        ''')
+
+        #Create Playlist_Table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Playlist_Table (
+            PlaylistID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Name VARCHAR(45),
+            User_Username VARCHAR(45),
+            List JSON,
+            FOREIGN KEY (User_Username) REFERENCES User_Table(Username)
+        )
+        ''')
+
+        #Create Song_Table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Song_Table (
+            "Index" INTEGER PRIMARY KEY AUTOINCREMENT,
+            Song TEXT
+        )
+        ''')
+
+        #Create Scan_Manifest (last seen size and mtime of every file in Songs/)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Scan_Manifest (
+            Path TEXT PRIMARY KEY,
+            Size INTEGER,
+            Mtime INTEGER
+        )
+        ''')
+
+        #Bring older databases up to the current schema
+        Migrations.migrate(conn)
 
 #Login and Signup methods
 def hash_password(password):
     """ Helper Function that deals with hashing passwords"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    return Auth.hash_password(password)
 
+@Instrumentation.timed
 def signup(username, password):
     """Function to handles the database interaction with singup"""
-    conn = connect()
-    cursor = conn.cursor()
+    return create_user(*prepare_signup(username, password))
+
+def prepare_signup(username, password):
+    """Function for the slow half of signup, returns the arguments for create_user"""
+    #Hash before taking a connection, the KDF is slow on purpose and shouldn't hold the write lock
+    return username, hash_password(password)
 
-    #Check if user already exists
-    cursor.execute('SELECT * FROM User_Table WHERE Username = ?', (username,))
-    if cursor.fetchone():
-        conn.close()
-        return False, "Username already exists."
+def create_user(username, hashed):
+    """Function for the write half of signup, stores a user whose password prepare_signup already hashed"""
+    with connect(write=True) as conn:
+        cursor = conn.cursor()
 
-    #Create empty playlist (optional: you can customize this later)
-    playlist_name = f"{username}_playlist"
-    cursor.execute('INSERT INTO Playlist_Table (Name, List) VALUES (?, ?)', (playlist_name, '[]'))
+        #Check if user already exists
+        cursor.execute('SELECT * FROM User_Table WHERE Username = ?', (username,))
+        if cursor.fetchone():
+            return False, "Username already exists."
 
-    #Insert the new user
-    hashed = hash_password(password)
-    cursor.execute('INSERT INTO User_Table (Username, Password, Playlist_Table_Name) VALUES (?, ?, ?)', (username, hashed, playlist_name))
+        #Create empty playlist (optional: you can customize this later)
+        playlist_name = f"{username}_playlist"
+        cursor.execute('INSERT INTO Playlist_Table (Name, User_Username) VALUES (?, ?)', (playlist_name, username))
+
+        #Insert the new user
+        cursor.execute('INSERT INTO User_Table (Username, Password, Playlist_Table_Name) VALUES (?, ?, ?)', (username, hashed, playlist_name))
+        QueryCache.touch('User_Table', 'Playlist_Table')
 
-    conn.commit()
-    conn.close()
     return True, "User created successfully."
 
+@Instrumentation.timed
 def login(username, password):
     """Function to handles the database interaction with login"""
-    global _current_user
-    
-    if not username or not password:
-        return False, "Username and password cannot be empty."
+    return finish_login(*check_password(username, password))
 
-    conn = connect()
-    cursor = conn.cursor()
+def finish_login(username, success, message, rehash=None):
+    """Function for the write half of login, makes the user check_password accepted the current user"""
+    global _current_user, _current_session
 
-    cursor.execute('SELECT Password FROM User_Table WHERE Username = ?', (username,))
-    row = cursor.fetchone()
+    success, message, token = open_session(username, success, message, rehash)
+    if success:
+        _current_user = username
+        _current_session = token
+    return success, message
 
-    conn.close()
+def authenticate(username, password):
+    """Function to check a password and open a session without changing the current user, returns (success, message, token)"""
+    return open_session(*check_password(username, password))
 
-    if row:
-        stored_hashed_password = row[0]
-        if stored_hashed_password == hash_password(password):
-            _current_user = username
-            return True, "Login successful."
-        else:
-            return False, "Incorrect username or password."
-    else:
-        return False, "Incorrect username or password."
+def check_password(username, password):
+    """Function for the slow half of a login, checks the password without writing anything and returns the
+    arguments for open_session or finish_login: (username, success, message, rehash)"""
+    if not username or not password:
+        return username, False, "Username and password cannot be empty.", None
+
+    with connect() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT Password FROM User_Table WHERE Username = ?', (username,))
+        row = cursor.fetchone()
+
+    if not row or not row[0]:
+        Auth.burn_verify(password)  #Take as long as a real check so unknown usernames can't be detected
+        return username, False, "Incorrect username or password.", None
+
+    stored_hashed_password = row[0]
+    matches, needs_rehash = Auth.verify_password(password, stored_hashed_password)
+    if not matches:
+        return username, False, "Incorrect username or password.", None
+
+    #Legacy SHA-256 or an old cost setting, hash it again now that we know the password (before any write lock)
+    rehash = (stored_hashed_password, hash_password(password)) if needs_rehash else None
+    return username, True, "Login successful.", rehash
+
+def open_session(username, success, message, rehash=None):
+    """Function for the write half of a login, stores the upgraded hash and returns (success, message, token)"""
+    if not success:
+        return False, message, None
+
+    if rehash is not None:
+        stored_hashed_password, hashed = rehash
+        with connect(write=True) as conn:
+            conn.execute('UPDATE User_Table SET Password = ? WHERE Username = ? AND Password = ?',
+                         (hashed, username, stored_hashed_password))
+            QueryCache.touch('User_Table')
+
+    return True, message, Auth.sessions.create(username)
+
+def check_session(token):
+    """Function to get the username for a session token without re-checking the password, None if expired"""
+    return Auth.sessions.get(token)
+
+def end_session(token):
+    """Function to end one session, e.g. a service client's, without touching the current user"""
+    Auth.sessions.revoke(token)
+
+def logout():
+    """Function to end the current session"""
+    global _current_user, _current_session
+    Auth.sessions.revoke(_current_session)
+    _current_user = None
+    _current_session = None
     
-#Database Manipulation Methods
-def load_songs_to_database():
-    """Function that periodically will sync the Songs dir with the database"""
-    conn = connect()
-    cursor = conn.cursor()
-
-    songs_folder = "Songs"
-
-    #Make sure Songs/ folder exists
-    if not os.path.exists(songs_folder):
-        os.makedirs(songs_folder)
-
-    #List all files in Songs/
-    for filename in os.listdir(songs_folder):
-        filepath = os.path.join(songs_folder, filename)
-
-        if os.path.isfile(filepath):
-            #Check if the song is already in the database
-            cursor.execute('SELECT * FROM Song_Table WHERE Song = ?', (filename,))
-            if cursor.fetchone() is None:
-                #Insert the song into the database
-                cursor.execute('INSERT INTO Song_Table (Song) VALUES (?)', (filename,))
-                print(f"Added {filename} to database.")  #Debugging line
-
-    conn.commit()
-    conn.close()
 
+#Database Manipulation Methods
+@Instrumentation.timed
+def load_songs_to_database(prepared=None):
+    """Function that periodically will sync the Songs dir with the database, prepared is read_songs_folder()' result"""
+    _ensure_initialized()
+    changes = LibrarySync.sync_library("Songs", prepared=prepared)
+
+    #Debugging line
+    log.info("Library sync: %d added, %d changed, %d removed.", len(changes['added']), len(changes['changed']), len(changes['removed']))
+    return changes
+
+def read_songs_folder():
+    """Function for the slow half of load_songs_to_database (statting and reading the files), returns its arguments"""
+    _ensure_initialized()
+    return (LibrarySync.read_library("Songs"),)
+
+@Instrumentation.timed
 def add_songs_to_playlist(username, playlist_name, song_list):
     """Function to add a song to a users playlist"""
-    conn = connect()
-    cursor = conn.cursor()
+    with connect(write=True) as conn:
+        cursor = conn.cursor()
 
-    #Check if the playlist exists for the given user
-    cursor.execute('SELECT * FROM Playlist_Table WHERE Name = ? AND User_Username = ?', (playlist_name, username))
-    row = cursor.fetchone()
-
-    if not row:
-        #If the playlist doesn't exist, create it with an empty song list
-        cursor.execute('INSERT INTO Playlist_Table (Name, User_Username, List) VALUES (?, ?, ?)', 
-                       (playlist_name, username, '[]'))
-        print(f"Playlist '{playlist_name}' created for user {username}.")
-        conn.commit()
-    else:
-        print(f"Playlist '{playlist_name}' already exists for user {username}.")
-
-    #Retrieve the existing song list (if any) for the playlist
-    cursor.execute('SELECT List FROM Playlist_Table WHERE Name = ? AND User_Username = ?', (playlist_name, username))
-    playlist_row = cursor.fetchone()
+        #Check if the playlist exists for the given user
+        playlist_id = _get_playlist_id(cursor, username, playlist_name)
 
-    if playlist_row:
-        current_list = json.loads(playlist_row[0])  #Load the existing list from JSON
-
-        #Add new songs to the current list
-        new_songs = [song for song in song_list if song not in current_list]  #Avoid duplicates
-        current_list.extend(new_songs)  #Add new songs
-
-        #Update the playlist with the new list of songs
-        cursor.execute('UPDATE Playlist_Table SET List = ? WHERE Name = ? AND User_Username = ?', 
-                       (json.dumps(current_list), playlist_name, username))
-        print(f"Added songs to playlist {playlist_name} for user {username}: {new_songs}")
-    else:
-        print(f"Error: Playlist {playlist_name} not found for user {username}.")
-    
-    conn.commit()
-    conn.close()
-
-#GUI Methods
-def do_signup(entry_username, entry_password):
-    """Function to handles Main.py signup Request"""
-    username = entry_username.get()
-    password = entry_password.get()
-
-    success, message = signup(username, password)
-    if success:
-        messagebox.showinfo("Success", message)
-    else:
-        messagebox.showerror("Error", message)
-
-def do_login(entry_username, entry_password, root):
-    """Function to handles Main.py login Request"""
-    username = entry_username.get()
-    password = entry_password.get()
-
-    success, message = login(username, password)
-    if success:
-        root.destroy()  #Close the old login window
-        load_songs_to_database()  #Load songs for any user
-        Activity.launch_activity()  #Launch the Activity window
-    else:
-        messagebox.showerror("Login Error", message)
-
-def replace_playlist_songs(username, playlist_name, new_songs):
-    conn = connect()
-    cursor = conn.cursor()
-
-    #Check if the playlist exists for the user
-    cursor.execute('SELECT List FROM Playlist_Table WHERE Name = ? AND User_Username = ?', (playlist_name, username))
+        if playlist_id is None:
+            #If the playlist doesn't exist, create it with an empty song list
+            cursor.execute('INSERT INTO Playlist_Table (Name, User_Username) VALUES (?, ?)', (playlist_name, username))
+            playlist_id = cursor.lastrowid
+            log.debug("Playlist '%s' created for user %s.", playlist_name, username)
+        else:
+            log.debug("Playlist '%s' already exists for user %s.", playlist_name, username)
+
+        #Append the songs after the current last position, the primary key skips duplicates
+        added = _append_song_ids(cursor, playlist_id, _resolve_song_ids(cursor, song_list))
+        QueryCache.touch('Playlist_Table', 'Playlist_Song')
+        log.debug("Added %d songs to playlist %s for user %s.", added, playlist_name, username)
+
+@Instrumentation.timed
+def create_playlist(username, playlist_name, song_list):
+    """Function to create a new playlist with songs, raises sqlite3.IntegrityError if the user has one by that name"""
+    with connect(write=True) as conn:
+        cursor = conn.cursor()
+
+        #Insert straight away, the unique (User_Username, Name) index decides between two callers racing for the name
+        cursor.execute('INSERT INTO Playlist_Table (Name, User_Username) VALUES (?, ?)', (playlist_name, username))
+        playlist_id = cursor.lastrowid
+        _append_song_ids(cursor, playlist_id, _resolve_song_ids(cursor, song_list))
+        QueryCache.touch('Playlist_Table', 'Playlist_Song')
+        return True, f"Playlist '{playlist_name}' created."
+
+@Instrumentation.timed
+def append_song_to_playlist(username, playlist_name, song):
+    """Function to add one song to the end of a playlist"""
+    with connect(write=True) as conn:
+        cursor = conn.cursor()
+        playlist_id = _get_playlist_id(cursor, username, playlist_name)
+        if playlist_id is None:
+            return False, f"Playlist '{playlist_name}' not found for user '{username}'."
+
+        song_ids = _resolve_song_ids(cursor, [song])
+        if not song_ids:
+            return False, f"Song '{song}' not found."
+        if not _append_song_ids(cursor, playlist_id, song_ids):
+            return False, f"'{song}' is already in '{playlist_name}'."
+        QueryCache.touch('Playlist_Song')
+        return True, f"Added '{song}' to '{playlist_name}'."
+
+@Instrumentation.timed
+def remove_song_from_playlist(username, playlist_name, song):
+    """Function to take one song out of a playlist"""
+    with connect(write=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        DELETE FROM Playlist_Song
+        WHERE PlaylistID = (SELECT PlaylistID FROM Playlist_Table WHERE Name = ? AND User_Username = ?)
+          AND Song_Index = (SELECT "Index" FROM Song_Table WHERE Song = ?)
+        ''', (playlist_name, username, song))
+
+        if cursor.rowcount:
+            QueryCache.touch('Playlist_Song')
+            return True, f"Removed '{song}' from '{playlist_name}'."
+        return False, f"'{song}' is not in '{playlist_name}'."
+
+@Instrumentation.timed
+def move_song_in_playlist(username, playlist_name, song, before_song=None):
+    """Function to move a song in front of before_song, or to the end when before_song is None"""
+    with connect(write=True) as conn:
+        cursor = conn.cursor()
+        playlist_id = _get_playlist_id(cursor, username, playlist_name)
+        if playlist_id is None:
+            return False, f"Playlist '{playlist_name}' not found for user '{username}'."
+
+        song_ids = _resolve_song_ids(cursor, [song] if before_song is None else [song, before_song])
+        members = [song_ids.get(name) for name in (song, before_song) if name is not None]
+        cursor.execute('SELECT COUNT(*) FROM Playlist_Song WHERE PlaylistID = ? AND Song_Index IN (?, ?)',
+                       (playlist_id, members[0], members[-1]))
+        if None in members or cursor.fetchone()[0] != len(set(members)):
+            return False, f"Song is not in '{playlist_name}'."
+
+        position = _position_before(cursor, playlist_id, song_ids[song], song_ids.get(before_song))
+        if position is None:
+            #The neighbours are too close together to split, spread the playlist out and try again
+            _renumber_playlist(cursor, playlist_id)
+            position = _position_before(cursor, playlist_id, song_ids[song], song_ids.get(before_song))
+
+        cursor.execute('UPDATE Playlist_Song SET Position = ? WHERE PlaylistID = ? AND Song_Index = ?',
+                       (position, playlist_id, song_ids[song]))
+        QueryCache.touch('Playlist_Song')
+        return True, f"Moved '{song}' in '{playlist_name}'."
+
+#Playlist helpers
+def _get_playlist_id(cursor, username, playlist_name):
+    """Helper Function that finds the id of a users playlist"""
+    cursor.execute('SELECT PlaylistID FROM Playlist_Table WHERE Name = ? AND User_Username = ?', (playlist_name, username))
     row = cursor.fetchone()
-
-    if not row:
-        #Playlist does not exist — create it with the new songs list
-        cursor.execute('INSERT INTO Playlist_Table (Name, User_Username, List) VALUES (?, ?, ?)', 
-                       (playlist_name, username, json.dumps(new_songs)))
-        print(f"Playlist '{playlist_name}' created for user {username} with songs: {new_songs}")
+    return row[0] if row else None
+
+def _resolve_song_ids(cursor, song_list, batch_size=500):
+    """Helper Function that maps song file names to their Song_Table index, unknown songs are left out"""
+    song_ids = {}
+    for start in range(0, len(song_list), batch_size):
+        batch = song_list[start:start + batch_size]
+        placeholders = ', '.join('?' * len(batch))
+        cursor.execute(f'SELECT Song, "Index" FROM Song_Table WHERE Song IN ({placeholders})', batch)
+        song_ids.update(cursor.fetchall())
+
+    #Keep the callers order
+    return {song: song_ids[song] for song in song_list if song in song_ids}
+
+def _append_song_ids(cursor, playlist_id, song_ids):
+    """Helper Function that appends songs to the end of a playlist and returns how many were new"""
+    cursor.execute('SELECT MAX(Position) FROM Playlist_Song WHERE PlaylistID = ?', (playlist_id,))
+    last_position = cursor.fetchone()[0] or 0
+
+    before = cursor.connection.total_changes
+    cursor.executemany('INSERT OR IGNORE INTO Playlist_Song (PlaylistID, Song_Index, Position) VALUES (?, ?, ?)',
+                       [(playlist_id, song_id, last_position + offset)
+                        for offset, song_id in enumerate(song_ids.values(), start=1)])
+    return cursor.connection.total_changes - before
+
+def _position_before(cursor, playlist_id, song_id, before_id):
+    """Helper Function that picks a position for song_id between before_id and the song ahead of it"""
+    if before_id is None:
+        cursor.execute('SELECT MAX(Position) FROM Playlist_Song WHERE PlaylistID = ?', (playlist_id,))
+        return (cursor.fetchone()[0] or 0) + 1
+
+    cursor.execute('SELECT Position FROM Playlist_Song WHERE PlaylistID = ? AND Song_Index = ?', (playlist_id, before_id))
+    upper = cursor.fetchone()[0]
+    cursor.execute('SELECT MAX(Position) FROM Playlist_Song WHERE PlaylistID = ? AND Position < ? AND Song_Index != ?',
+                   (playlist_id, upper, song_id))
+    lower = cursor.fetchone()[0]
+    lower = upper - 1 if lower is None else lower
+
+    position = (lower + upper) / 2
+    return position if lower < position < upper else None
+
+def _renumber_playlist(cursor, playlist_id):
+    """Helper Function that resets a playlists positions to 1, 2, 3, ..."""
+    cursor.execute('SELECT Song_Index FROM Playlist_Song WHERE PlaylistID = ? ORDER BY Position', (playlist_id,))
+    cursor.executemany('UPDATE Playlist_Song SET Position = ? WHERE PlaylistID = ? AND Song_Index = ?',
+                       [(position, playlist_id, song_id) for position, (song_id,) in enumerate(cursor.fetchall(), start=1)])
+
+def _place_song_id(cursor, playlist_id, song_id, before_id, new):
+    """Helper Function that adds (new) or moves one song in front of before_id, or to the end"""
+    if before_id is not None:
+        cursor.execute('SELECT 1 FROM Playlist_Song WHERE PlaylistID = ? AND Song_Index = ?', (playlist_id, before_id))
+        if cursor.fetchone() is None or before_id == song_id:
+            before_id = None  #The song it was placed in front of is gone, put it at the end
+
+    position = _position_before(cursor, playlist_id, song_id, before_id)
+    if position is None:
+        _renumber_playlist(cursor, playlist_id)
+        position = _position_before(cursor, playlist_id, song_id, before_id)
+
+    if new:
+        cursor.execute('INSERT OR IGNORE INTO Playlist_Song (PlaylistID, Song_Index, Position) VALUES (?, ?, ?)',
+                       (playlist_id, song_id, position))
     else:
-        #Playlist exists — replace the List column with the new songs
-        cursor.execute('UPDATE Playlist_Table SET List = ? WHERE Name = ? AND User_Username = ?', 
-                       (json.dumps(new_songs), playlist_name, username))
-        print(f"Playlist '{playlist_name}' updated for user {username} with new songs: {new_songs}")
-
-    conn.commit()
-    conn.close()
+        #A song removed meanwhile by someone else stays removed
+        cursor.execute('UPDATE Playlist_Song SET Position = ? WHERE PlaylistID = ? AND Song_Index = ?',
+                       (position, playlist_id, song_id))
 
-def get_playlist(playlist_name):
-    """Function to create a list of songs from the database Playlist_Table"""
-    conn = connect()
-    cursor = conn.cursor()
+@Instrumentation.timed
+def replace_playlist_songs(username, playlist_name, new_songs):
+    with connect(write=True) as conn:
+        cursor = conn.cursor()
 
-    #Retrieve the playlist for the given name
-    cursor.execute('SELECT List FROM Playlist_Table WHERE Name = ?', (playlist_name,))
-    row = cursor.fetchone()
+        #Check if the playlist exists for the user
+        playlist_id = _get_playlist_id(cursor, username, playlist_name)
 
-    if row:
-        song_list = json.loads(row[0])  #Parse the JSON list of songs
-        conn.close()
-        return song_list, None  #Return the playlist songs or an empty list if no songs
-    else:
-        conn.close()
-        return None, f"Playlist '{playlist_name}' not found."
+        if playlist_id is None:
+            #Playlist does not exist — create it with the new songs list
+            cursor.execute('INSERT INTO Playlist_Table (Name, User_Username) VALUES (?, ?)', (playlist_name, username))
+            playlist_id = cursor.lastrowid
+            log.debug("Playlist '%s' created for user %s with %d songs.", playlist_name, username, len(new_songs))
+        else:
+            #Playlist exists — replace its songs with the new songs
+            cursor.execute('DELETE FROM Playlist_Song WHERE PlaylistID = ?', (playlist_id,))
+            log.debug("Playlist '%s' updated for user %s with %d songs.", playlist_name, username, len(new_songs))
+
+        _append_song_ids(cursor, playlist_id, _resolve_song_ids(cursor, new_songs))
+        QueryCache.touch('Playlist_Table', 'Playlist_Song')
+
+@Instrumentation.timed
+def apply_playlist_edits(username, playlist_name, removed=(), placed=(), create=False):
+    """Function to save the edits recorded by a PlaylistEdit.PlaylistEditSession in one transaction"""
+    #removed lists the songs taken out, placed has (song, before_song, new) in edit order: new songs are added and the
+    #others moved, in front of before_song or at the end. Only edited rows are touched, the playlist size doesn't matter
+    with connect(write=True) as conn:
+        cursor = conn.cursor()
+        changes_before = conn.total_changes
+        playlist_id = _get_playlist_id(cursor, username, playlist_name)
+        if playlist_id is None:
+            if not create:
+                return False, f"Playlist '{playlist_name}' not found for user '{username}'."
+            cursor.execute('INSERT INTO Playlist_Table (Name, User_Username) VALUES (?, ?)', (playlist_name, username))
+            playlist_id = cursor.lastrowid
+
+        names = list(removed) + [song for song, _, _ in placed] + [song for _, song, _ in placed if song is not None]
+        song_ids = _resolve_song_ids(cursor, list(dict.fromkeys(names)))
+        cursor.executemany('DELETE FROM Playlist_Song WHERE PlaylistID = ? AND Song_Index = ?',
+                           [(playlist_id, song_ids[song]) for song in removed if song in song_ids])
+
+        #Runs of new songs going to the end are appended together, everything else is placed one at a time
+        appends = {}
+        for song, before_song, new in placed:
+            song_id = song_ids.get(song)
+            if song_id is None:
+                continue
+            if new and before_song is None:
+                appends[song] = song_id
+                continue
+            if appends:
+                _append_song_ids(cursor, playlist_id, appends)
+                appends = {}
+            _place_song_id(cursor, playlist_id, song_id, song_ids.get(before_song), new)
+        if appends:
+            _append_song_ids(cursor, playlist_id, appends)
+
+        changed = conn.total_changes - changes_before
+        if changed:
+            QueryCache.touch('Playlist_Table', 'Playlist_Song')
+        log.debug("Saved %d edits to playlist %s for user %s (%d rows changed).",
+                  len(removed) + len(placed), playlist_name, username, changed)
+        return True, f"Saved {len(removed) + len(placed)} changes to '{playlist_name}'."
+
+@Instrumentation.timed
+def get_playlist(playlist_name, username=None):
+    """Function to create a list of songs from a users playlist, username defaults to the logged in user"""
+    username = username or get_current_user()
+    if username is None:
+        return None, f"Playlist '{playlist_name}' not found, no user is logged in."
+    return _read_playlist(playlist_name, username)
+
+@QueryCache.cached('Playlist_Table', 'Playlist_Song', 'Song_Table')
+def _read_playlist(playlist_name, username):
+    """Helper Function that reads a users playlist, cached by the playlist and the user it belongs to"""
+    with connect() as conn:
+        cursor = conn.cursor()
+
+        #Playlist names are only unique per user, look it up through the (User_Username, Name) index
+        playlist_id = _get_playlist_id(cursor, username, playlist_name)
+
+        if playlist_id is not None:
+            #Songs come back in playlist order through the (PlaylistID, Position) index
+            cursor.execute('''
+            SELECT Song_Table.Song FROM Playlist_Song
+            JOIN Song_Table ON Song_Table."Index" = Playlist_Song.Song_Index
+            WHERE Playlist_Song.PlaylistID = ?
+            ORDER BY Playlist_Song.Position
+            ''', (playlist_id,))
+            song_list = [song for (song,) in cursor.fetchall()]
+            return song_list, None  #Return the playlist songs or an empty list if no songs
+        else:
+            return None, f"Playlist '{playlist_name}' not found for user '{username}'."
     
+@Instrumentation.timed
+@QueryCache.cached('Playlist_Table')
 def get_all_playlists_for_user(username):
     """Function to create a list of playlist names from the database Playlist_Table"""
-    conn = connect()
-    cursor = conn.cursor()
+    with connect() as conn:
+        cursor = conn.cursor()
 
-    #Query to fetch all playlists for the given user
-    cursor.execute('SELECT Name FROM Playlist_Table WHERE User_Username = ?', (username,))
-    rows = cursor.fetchall()  #Fetch all rows
+        #Query to fetch all playlists for the given user, read in name order straight from the index
+        cursor.execute('SELECT Name FROM Playlist_Table WHERE User_Username = ? ORDER BY Name', (username,))
+        rows = cursor.fetchall()  #Fetch all rows
 
     #Ensure that playlists are being returned
     playlists = [row[0] for row in rows if row[0]]  #Extract playlist names
-    conn.close()
 
     if playlists:
         return playlists, None  #Return the list of playlists
     else:
         return None, f"No playlists found for user '{username}'."
     
+@Instrumentation.timed
+@QueryCache.cached('Playlist_Table', 'Playlist_Song', 'Song_Metadata')
+def get_playlist_summaries(username):
+    """Function to list a users playlists with their track counts and total durations in one query"""
+    with connect() as conn:
+        cursor = conn.cursor()
+
+        #Songs without cached metadata count as a track but add nothing to the duration
+        cursor.execute('''
+        SELECT Playlist_Table.Name, COUNT(Playlist_Song.Song_Index), COALESCE(SUM(Song_Metadata.Duration), 0)
+        FROM Playlist_Table
+        LEFT JOIN Playlist_Song ON Playlist_Song.PlaylistID = Playlist_Table.PlaylistID
+        LEFT JOIN Song_Metadata ON Song_Metadata.Song_Index = Playlist_Song.Song_Index
+        WHERE Playlist_Table.User_Username = ? AND Playlist_Table.Name IS NOT NULL
+        GROUP BY Playlist_Table.Name
+        ORDER BY Playlist_Table.Name
+        ''', (username,))
+        summaries = [{'name': name, 'tracks': tracks, 'duration': duration} for name, tracks, duration in cursor.fetchall()]
+
+    if summaries:
+        return summaries, None
+    else:
+        return None, f"No playlists found for user '{username}'."
+
+@Instrumentation.timed
 def get_song_details(song_name):
     """Function to split the stored database info into usefull information."""
 
-    #Step 1: Split the song name into TITLE and AUTHOR
-    if ',' in song_name:
-        title, author = song_name.split(',', 1)  #Split only on the first comma
-    else:
-        title = song_name
-        author = "Unknown"  #Default to "Unknown" if no comma is found
-
-    #Step 2: Remove the ".mp3" from the author if it exists
-    author = author.replace('.mp3', '').strip()
+    #Step 1: Split the song name into TITLE and AUTHOR ("Title, Author.mp3")
+    title, author = LibrarySync.parse_song_name(song_name)
 
-    #Step 3: Get the song duration from the Songs directory
-    song_path = os.path.join("Songs", song_name)
+    #Step 2: Get the song duration from the metadata cache (filled when the song was synced)
+    _ensure_initialized()
+    metadata = Metadata.get_song_metadata(song_name)
     
     #Initialize duration to None in case the file isn't found or can't be processed
     duration = None
 
-    if os.path.exists(song_path):
-        try:
-            #Load the MP3 file and get the duration
-            audio = MP3(song_path)
-            duration = audio.info.length  #Duration in seconds
+    if metadata and metadata['duration'] is not None:
+        #Convert seconds to minutes and seconds
+        minutes = int(metadata['duration'] // 60)  #Get the full minutes
+        seconds = int(metadata['duration'] % 60)  #Get the remaining seconds
 
-            #Convert seconds to minutes and seconds
-            minutes = int(duration // 60)  #Get the full minutes
-            seconds = int(duration % 60)  #Get the remaining seconds
-
-            #Format the duration as "X minutes Y seconds"
-            duration = f"{minutes} minutes {seconds} seconds"
-
-        except Exception as e:
-            print(f"Error reading duration from {song_name}: {e}")
+        #Format the duration as "X minutes Y seconds"
+        duration = f"{minutes} minutes {seconds} seconds"
     
     #Return a tuple with TITLE, AUTHOR, and DURATION (formatted as minutes and seconds)
     return title.strip(), author.strip(), duration
 
+@Instrumentation.timed
+def search_songs(query, limit=100, offset=0):
+    """Function to search song titles and artists through the Song_Search full-text index"""
+    #Every word typed so far must prefix-match a word of the title or artist
+    terms = re.findall(r'\w+', query.lower())
+    match = ' '.join(f'"{term}"*' for term in terms)
+    limit = -1 if limit is None else limit  #No limit
+
+    with connect() as conn:
+        cursor = conn.cursor()
+
+        if match:
+            #Best matches first, ranked by bm25
+            cursor.execute('''
+            SELECT Song_Table.Song FROM Song_Search
+            JOIN Song_Table ON Song_Table."Index" = Song_Search.rowid
+            WHERE Song_Search MATCH ?
+            ORDER BY Song_Search.rank
+            LIMIT ? OFFSET ?
+            ''', (match, limit, offset))
+        else:
+            #An empty search shows the library in the same order as get_all_songs
+            cursor.execute('SELECT Song FROM Song_Table ORDER BY "Index" LIMIT ? OFFSET ?', (limit, offset))
+
+        return [row[0] for row in cursor.fetchall() if row[0]]
+
+#Catalog sort orders: the key columns compared for keyset pagination, "Index" last so every key is unique
+SORT_ORDERS = {
+    'title': ('Title', '"Index"'),
+    'artist': ('Artist', 'Title', '"Index"'),
+    'added': ('"Index"',),  #"Index" only ever grows, so this is the order songs were added in
+}
+PAGE_SIZE = 200
+
+#COLLATE NOCASE only folds the ASCII letters, str.lower() would also fold e.g. É and put it elsewhere
+_NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def song_sort_key(sort="title"):
+    """Function to get a key that orders new song file names like get_songs_page, None for 'added' (they go last)"""
+    #A new song's "Index" is higher than every loaded one's, so among equal keys it goes last and "Index" is left out
+    if sort == 'added':
+        return None
+    if sort not in SORT_ORDERS:
+        raise ValueError(f"Unknown sort order '{sort}', use one of {', '.join(SORT_ORDERS)}.")
+
+    def key(song):
+        title, artist = LibrarySync.parse_song_name(song)
+        if sort == 'artist':
+            return artist.translate(_NOCASE), title.translate(_NOCASE)
+        return title.translate(_NOCASE)
+    return key
+
+def _sort_clause(sort):
+    """Helper Function that returns the key columns, ORDER BY expressions and cursor placeholders of a sort order"""
+    if sort not in SORT_ORDERS:
+        raise ValueError(f"Unknown sort order '{sort}', use one of {', '.join(SORT_ORDERS)}.")
+    columns = SORT_ORDERS[sort]
+    #Titles and artists sort case-insensitively, matching the idx_Song_Table_*_Sort indexes
+    keys = [column if column == '"Index"' else f'{column} COLLATE NOCASE' for column in columns]
+    placeholders = ['?' if column == '"Index"' else '? COLLATE NOCASE' for column in columns]
+    return columns, keys, placeholders
+
+@Instrumentation.timed
+def get_songs_page(sort="title", after=None, limit=PAGE_SIZE):
+    """Function to get one page of the catalog, returns (songs, cursor for the next page or None at the end)"""
+    columns, keys, placeholders = _sort_clause(sort)
+    query = f'SELECT Song, {", ".join(columns)} FROM Song_Table'
+    params = []
+    if after is not None:
+        #Keyset pagination: continue right after the last row of the previous page, however deep it is.
+        #The collation goes on the right-hand side, written this way SQLite seeks in the index instead of scanning it
+        query += f' WHERE ({", ".join(columns)}) > ({", ".join(placeholders)})'
+        params.extend(after)
+    query += f' ORDER BY {", ".join(keys)} LIMIT ?'
+    params.append(limit)
+
+    with connect() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    songs = [row[0] for row in rows if row[0]]
+    cursor = tuple(rows[-1][1:]) if len(rows) == limit else None
+    return songs, cursor
+
+def iter_songs(sort="title", chunk_size=500):
+    """Generator Function that streams the whole catalog in sort order, fetching chunk_size rows at a time"""
+    columns, keys, placeholders = _sort_clause(sort)
+
+    #Holds one pooled connection (and a consistent snapshot) until the loop ends or the generator is closed,
+    #so consume it on the thread that started it
+    with connect() as conn:
+        cursor = conn.execute(f'SELECT Song FROM Song_Table ORDER BY {", ".join(keys)}')
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                if row[0]:
+                    yield row[0]
+
+@Instrumentation.timed
+def search_songs_page(query, after=None, limit=PAGE_SIZE):
+    """Function to get one page of search results, returns (songs, cursor for the next page or None)"""
+    #Results are ranked rather than sorted by a column, so the cursor is simply how many were already shown
+    offset = after or 0
+    songs = search_songs(query, limit, offset)
+    return songs, (offset + limit if len(songs) == limit else None)
+
+@Instrumentation.timed
+def get_library_stats():
+    """Function to count the users, songs and playlists in the database"""
+    with connect() as conn:
+        cursor = conn.cursor()
+        stats = {}
+        for key, query in (('users', 'SELECT COUNT(*) FROM User_Table'),
+                           ('songs', 'SELECT COUNT(*) FROM Song_Table'),
+                           ('playlists', 'SELECT COUNT(*) FROM Playlist_Table'),
+                           ('playlist_entries', 'SELECT COUNT(*) FROM Playlist_Song'),
+                           ('songs_with_metadata', 'SELECT COUNT(*) FROM Song_Metadata'),
+                           ('total_duration', 'SELECT COALESCE(SUM(Duration), 0) FROM Song_Metadata')):
+            cursor.execute(query)
+            stats[key] = cursor.fetchone()[0]
+        stats['schema_version'] = Migrations.get_version(conn)
+    return stats
+
 #Debug Methods
 
+@Instrumentation.timed
+@QueryCache.cached('Song_Table')
 def get_all_songs():
     """ Debug Function to see if the database works XD """
-    conn = connect()
-    cursor = conn.cursor()
+    with connect() as conn:
+        cursor = conn.cursor()
 
-    #Query to fetch all songs from the Song_Table
-    cursor.execute('SELECT Song FROM Song_Table')
-    rows = cursor.fetchall()  #Fetch all rows
+        #Query to fetch all songs from the Song_Table
+        cursor.execute('SELECT Song FROM Song_Table')
+        rows = cursor.fetchall()  #Fetch all rows
 
     #Ensure that songs are being returned
     songs = [row[0] for row in rows if row[0]]
-    conn.close()
     
     return songs
-
-create_tables()
\ No newline at end of file
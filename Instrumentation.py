@@ -0,0 +1,250 @@
+"""
+Module: Instrumentation.py
+Author: Jacob       : Backend
+
+Description:
+This module shows where the app spends its time. When it is switched on it records three kinds of timings, each in a
+histogram with fixed buckets (count, sum, min, max):
+
+- function timings for everything decorated with @timed (the public Database functions, library sync, search, ...)
+- SQL statements, counted and timed through sqlite3's trace callback on every pooled connection. SQLite only reports
+  when a statement starts, so a statement's time runs until the next statement on that connection starts or the
+  connection goes back to the pool. That includes fetching its rows, which is usually what we want to know anyway.
+- Tk event handlers decorated with @tk_handler, plus how late the Tk event loop runs its after() callbacks (watch_tk),
+  which is how long the window was frozen
+
+Switched off (the default) the decorators only check one flag. The switch can be flipped at any time with enable() and
+disable(), or at startup with the MUSICDB_INSTRUMENT=1 environment variable. Results can be dumped as JSON or in the
+Prometheus text format.
+
+The module also sets up logging: the backend reports through leveled loggers ("musicdb.<module>") instead of print(),
+and configure_logging() (or MUSICDB_LOG=DEBUG) decides how much of it is shown.
+
+Usage:
+- `@Instrumentation.timed` on a function, `@Instrumentation.tk_handler` on a Tk callback
+- `Instrumentation.enable()`, then `Instrumentation.dump_json()` or `Instrumentation.dump_prometheus()`
+- `log = Instrumentation.get_logger(__name__)`, then `log.debug("Added %d songs", count)`
+
+Dependencies:
+- logging, threading, time (for the loggers, per-thread SQL state and timers)
+"""
+
+import bisect, functools, json, logging, os, re, threading, time
+
+#Bucket upper bounds in seconds, the same for every histogram so they can be compared
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_TEXT_LIMIT = 200  #Longer statements are cut so the report stays readable
+TK_WATCH_INTERVAL_MS = 100
+
+_enabled = os.environ.get("MUSICDB_INSTRUMENT", "") not in ("", "0")
+_lock = threading.Lock()
+_local = threading.local()
+
+class Histogram:
+    """Class that counts observations into fixed buckets and keeps their sum, min and max"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  #The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def quantile(self, fraction):
+        """Function to estimate a quantile as the upper bound of the bucket it falls in"""
+        target = fraction * self.count
+        running = 0
+        for bound, count in zip(BUCKETS + (self.max,), self.counts):
+            running += count
+            if running >= target and count:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum_ms': self.sum * 1000,
+            'mean_ms': self.sum / self.count * 1000 if self.count else None,
+            'min_ms': self.min * 1000 if self.count else None,
+            'p50_ms': self.quantile(0.5) * 1000 if self.count else None,
+            'p95_ms': self.quantile(0.95) * 1000 if self.count else None,
+            'max_ms': self.max * 1000 if self.count else None,
+        }
+
+#Histograms by kind ('function', 'sql', 'tk') and name
+_histograms = {'function': {}, 'sql': {}, 'tk': {}}
+
+def record(kind, name, seconds):
+    """Function to add one timing to the histogram for (kind, name)"""
+    with _lock:
+        histogram = _histograms[kind].get(name)
+        if histogram is None:
+            histogram = _histograms[kind][name] = Histogram()
+        histogram.observe(seconds)
+
+#Runtime switch
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    """Function to forget everything recorded so far"""
+    with _lock:
+        for histograms in _histograms.values():
+            histograms.clear()
+
+#Function timings
+def timed(function=None, name=None):
+    """Decorator that records how long each call takes, usable as @timed or @timed(name="...")"""
+    if function is None:
+        return functools.partial(timed, name=name)
+    label = name or f"{function.__module__}.{function.__qualname__}"
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record('function', label, time.perf_counter() - started)
+    return wrapper
+
+#SQL statement timings
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+def _normalize(statement):
+    """Helper Function that turns traced SQL back into one key per statement shape"""
+    #sqlite3 traces statements with their parameters filled in, put the placeholders back
+    statement = _LITERALS.sub('?', statement)
+    statement = re.sub(r'\s+', ' ', statement).strip()
+    return statement[:SQL_TEXT_LIMIT]
+
+def _trace(statement):
+    """Helper Function called by sqlite3 as each statement starts"""
+    now = time.perf_counter()
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        record('sql', pending[0], now - pending[1])
+    _local.pending = (_normalize(statement), now)
+
+def attach_connection(conn):
+    """Function called by ConnectionPool when it lends out a connection, turns statement tracing on or off"""
+    conn.set_trace_callback(_trace if _enabled else None)
+
+def detach_connection(conn):
+    """Function called by ConnectionPool when a connection comes back, finishes the last traced statement"""
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        _local.pending = None
+        record('sql', pending[0], time.perf_counter() - pending[1])
+
+#Tk handler timings
+def tk_handler(function=None, name=None):
+    """Decorator for Tk callbacks, like timed() but reported under 'tk'"""
+    if function is None:
+        return functools.partial(tk_handler, name=name)
+    label = name or function.__qualname__.replace('.<locals>', '')
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record('tk', label, time.perf_counter() - started)
+    return wrapper
+
+def watch_tk(widget, interval_ms=TK_WATCH_INTERVAL_MS):
+    """Function to measure how late the Tk event loop runs after() callbacks, i.e. how long it was blocked"""
+    expected = time.perf_counter() + interval_ms / 1000
+
+    def tick():
+        nonlocal expected
+        now = time.perf_counter()
+        if _enabled:
+            record('tk', 'event_loop_lag', max(0.0, now - expected))
+        expected = now + interval_ms / 1000
+        if widget.winfo_exists():
+            widget.after(interval_ms, tick)
+
+    widget.after(interval_ms, tick)
+
+#Dumps
+def snapshot():
+    """Function to return every histogram as plain dictionaries"""
+    with _lock:
+        result = {kind: {name: histogram.to_dict() for name, histogram in histograms.items()}
+                  for kind, histograms in _histograms.items()}
+    result['enabled'] = _enabled
+    result['sql_statements'] = sum(entry['count'] for entry in result['sql'].values())
+    return result
+
+def dump_json(path=None):
+    """Function to return the snapshot as JSON text, and write it to path if given"""
+    text = json.dumps(snapshot(), indent=2)
+    if path:
+        with open(path, "w") as handle:
+            handle.write(text)
+    return text
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+def dump_prometheus(path=None):
+    """Function to return every histogram in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        for kind, histograms in _histograms.items():
+            metric = f"musicdb_{kind}_duration_seconds"
+            label = 'statement' if kind == 'sql' else 'name'
+            lines.append(f"# HELP {metric} Time spent per {kind} call.")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, histogram in sorted(histograms.items()):
+                running = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                    running += count
+                    bound = "+Inf" if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{{label}="{_label(name)}",le="{bound}"}} {running}')
+                lines.append(f'{metric}_sum{{{label}="{_label(name)}"}} {histogram.sum}')
+                lines.append(f'{metric}_count{{{label}="{_label(name)}"}} {histogram.count}')
+    text = "\n".join(lines) + "\n"
+    if path:
+        with open(path, "w") as handle:
+            handle.write(text)
+    return text
+
+#Logging
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+def get_logger(module_name):
+    """Function to get the logger for a backend module, e.g. musicdb.Database"""
+    return logging.getLogger(f"musicdb.{module_name}")
+
+def configure_logging(level=None):
+    """Function to show backend log messages on stderr, level defaults to MUSICDB_LOG or INFO"""
+    level = level or os.environ.get("MUSICDB_LOG", "INFO")
+    logger = logging.getLogger("musicdb")
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(handler)
+    return logger
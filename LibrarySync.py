@@ -0,0 +1,173 @@
+"""
+Module: LibrarySync.py
+Author: Jacob       : Backend
+
+Description:
+This module keeps Song_Table in step with the files in the Songs directory without re-checking every song on every login.
+A scan manifest (file name, size and modification time) is persisted in the Scan_Manifest table. Each sync stats the folder
+once with os.scandir, compares the result against the manifest, and only touches the database for files that were added,
+changed or removed. New songs are written with a single executemany call, so re-syncing an unchanged library costs one
+directory pass plus one manifest read.
+
+Usage:
+- `sync_library("Songs")` applies the changes and returns a dict with the added, changed and removed file names.
+  `read_library("Songs")` does the slow part (statting and reading the files) first, so it can run on another thread and
+  be passed in as `sync_library("Songs", prepared=...)`.
+- `sync_files("Songs", names)` does the same for just the named files (LibraryWatcher uses it for live updates).
+- `scan_folder()` and `diff_manifest()` can be used on their own to preview what a sync would do.
+- `parse_song_name()` splits a "Title, Artist.mp3" file name the same way everywhere in the app.
+
+Dependencies:
+- ConnectionPool module (for the shared database connections)
+- Metadata module (for caching duration and tags of new or changed files)
+- Catalog module (for keeping the catalog's change log short)
+- os (for directory scanning)
+- Instrumentation module (for timing syncs)
+- QueryCache module (for dropping cached song and playlist reads after a sync)
+"""
+
+import os
+import Catalog
+import ConnectionPool
+import Instrumentation
+import Metadata
+import QueryCache
+
+SONGS_FOLDER = "Songs"
+
+def parse_song_name(song_name):
+    """Function to split a "Title, Artist.mp3" file name into its title and artist"""
+    if ',' in song_name:
+        title, artist = song_name.split(',', 1)  #Split only on the first comma
+    else:
+        title = song_name
+        artist = "Unknown"  #Default to "Unknown" if no comma is found
+
+    #Remove the ".mp3" from the artist if it exists
+    artist = artist.replace('.mp3', '')
+    return title.strip(), artist.strip()
+
+def scan_folder(songs_folder=SONGS_FOLDER):
+    """Function to stat every file in the songs folder in a single os.scandir pass"""
+    entries = {}
+    with os.scandir(songs_folder) as it:
+        for entry in it:
+            if entry.is_file():
+                stat = entry.stat()
+                entries[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return entries
+
+def load_manifest(conn, names=None):
+    """Function to read the persisted scan manifest as {file name: (size, mtime)}, optionally only for some files"""
+    if names is None:
+        cursor = conn.execute('SELECT Path, Size, Mtime FROM Scan_Manifest')
+        return {path: (size, mtime) for path, size, mtime in cursor}
+
+    manifest = {}
+    names = list(names)
+    for start in range(0, len(names), 500):
+        batch = names[start:start + 500]
+        cursor = conn.execute(f'SELECT Path, Size, Mtime FROM Scan_Manifest WHERE Path IN ({", ".join("?" * len(batch))})',
+                              batch)
+        manifest.update((path, (size, mtime)) for path, size, mtime in cursor)
+    return manifest
+
+def diff_manifest(manifest, entries):
+    """Function to compare a fresh scan against the manifest"""
+    added = [name for name in entries if name not in manifest]
+    removed = [name for name in manifest if name not in entries]
+    changed = [name for name, stat in entries.items() if name in manifest and manifest[name] != stat]
+    return added, changed, removed
+
+def read_library(songs_folder=SONGS_FOLDER, read_metadata=True):
+    """Function to stat the songs folder and read the metadata of new or changed files, without writing anything"""
+    #Make sure Songs/ folder exists
+    if not os.path.exists(songs_folder):
+        os.makedirs(songs_folder)
+
+    entries = scan_folder(songs_folder)
+    with ConnectionPool.connection() as conn:
+        added, changed, _ = diff_manifest(load_manifest(conn), entries)
+    rows = {}
+    if read_metadata:
+        for name in added + changed:
+            path = os.path.join(songs_folder, name)
+            rows[name] = Metadata.metadata_row(*entries[name], Metadata.read_audio_metadata(path), name)
+    return entries, rows
+
+@Instrumentation.timed
+def sync_library(songs_folder=SONGS_FOLDER, read_metadata=True, prepared=None):
+    """Function to apply the difference between the songs folder and the database in one short write transaction,
+    prepared is read_library()' result if it was already read"""
+    #Reading the audio files is the slow part, do it before taking the write lock so other writers aren't held up
+    entries, rows = prepared or read_library(songs_folder, read_metadata)
+
+    with ConnectionPool.connection(write=True) as conn:
+        #Diff again, another sync may have committed while the files were read
+        added, changed, removed = diff_manifest(load_manifest(conn), entries)
+        apply_changes(conn, songs_folder, entries, added, changed, removed, metadata_rows=rows)
+        late = [name for name in added + changed if name not in rows]
+        if read_metadata and late:
+            Metadata.refresh_metadata(conn, songs_folder, late, entries)
+
+    return {'added': added, 'changed': changed, 'removed': removed}
+
+def read_files(songs_folder, names, read_metadata=True):
+    """Function to stat and read the metadata of just the named files, without touching the database"""
+    entries = {}
+    rows = {}
+    for name in names:
+        path = os.path.join(songs_folder, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue  #Deleted (or moved away), the sync will remove it
+        if not os.path.isfile(path):
+            continue
+        entries[name] = (stat.st_size, stat.st_mtime_ns)
+        if read_metadata:
+            rows[name] = Metadata.metadata_row(*entries[name], Metadata.read_audio_metadata(path), name)
+    return entries, rows
+
+@Instrumentation.timed
+def sync_files(songs_folder, names, prepared=None):
+    """Function to sync only the named files, prepared is read_files()' result if it was already read"""
+    #Reading the files is the slow part, read_files can run before (and outside) the write transaction
+    entries, rows = prepared or read_files(songs_folder, names)
+
+    with ConnectionPool.connection(write=True) as conn:
+        added, changed, removed = diff_manifest(load_manifest(conn, names), entries)
+        apply_changes(conn, songs_folder, entries, added, changed, removed, metadata_rows=rows)
+
+    return {'added': added, 'changed': changed, 'removed': removed}
+
+def apply_changes(conn, songs_folder, entries, added, changed, removed, read_metadata=True, metadata_rows=None):
+    """Function to write a diff of the songs folder to Song_Table, Scan_Manifest and Song_Metadata"""
+    if added:
+        #Songs that were stored before the manifest existed are skipped by the unique index on Song
+        conn.executemany('INSERT OR IGNORE INTO Song_Table (Song, Title, Artist) VALUES (?, ?, ?)',
+                         [(name, *parse_song_name(name)) for name in added])
+
+    if removed:
+        #Removed songs also leave every playlist they were in and lose their cached metadata
+        for table in ('Playlist_Song', 'Song_Metadata'):
+            conn.executemany(f'DELETE FROM {table} WHERE Song_Index IN (SELECT "Index" FROM Song_Table WHERE Song = ?)',
+                             [(name,) for name in removed])
+        Metadata.invalidate(removed)
+        conn.executemany('DELETE FROM Song_Table WHERE Song = ?', [(name,) for name in removed])
+        conn.executemany('DELETE FROM Scan_Manifest WHERE Path = ?', [(name,) for name in removed])
+
+    if added or changed:
+        conn.executemany('INSERT OR REPLACE INTO Scan_Manifest (Path, Size, Mtime) VALUES (?, ?, ?)',
+                         [(name, *entries[name]) for name in added + changed])
+
+        #Read the audio metadata once here so showing song details never opens the file
+        #(BulkIngest turns this off and reads large imports on a process pool instead)
+        if metadata_rows is not None:
+            Metadata.store_metadata(conn, [metadata_rows[name] for name in added + changed if name in metadata_rows])
+        elif read_metadata:
+            Metadata.refresh_metadata(conn, songs_folder, added + changed, entries)
+
+    if added or removed:
+        Catalog.prune_change_log(conn)
+        QueryCache.touch('Song_Table', 'Playlist_Song', 'Song_Metadata')
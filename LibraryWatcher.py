@@ -0,0 +1,233 @@
+"""
+Module: LibraryWatcher.py
+Author: Jacob       : Backend
+
+Description:
+This module keeps the database in step with the Songs directory while the app is open, so songs dropped into (or
+deleted from) the folder show up without logging in again. A LibraryWatcher runs on a background thread. On Linux it
+asks the kernel for inotify events on the folder (through ctypes, no extra packages); anywhere else, or if inotify is
+not available, it falls back to re-scanning the folder every few seconds and comparing sizes and modification times.
+
+Events are not applied one by one. Copying an album produces a burst of create/close/move events, so the watcher
+collects the affected file names until the folder has been quiet for a moment (or a maximum delay has passed) and then
+syncs just those files in one batch with LibrarySync.sync_files. Files are read before the write transaction starts,
+also for the full re-scan that follows an inotify queue overflow.
+After every batch that changed something, the subscribers get a {'added', 'changed', 'removed'} dict so open views can
+update their lists in place.
+
+Usage:
+- `watcher = LibraryWatcher("Songs")`, `watcher.subscribe(callback)`, `watcher.start()` ... `watcher.stop()`
+- Callbacks run on the watcher thread; Tk code should hand the changes to the Tk thread (e.g. through a queue).
+- `write=function` routes the database step elsewhere, e.g. through AsyncDatabase's single writer thread.
+
+Dependencies:
+- ctypes, select (for inotify on Linux)
+- LibrarySync module (for the incremental sync)
+- Instrumentation module (for the musicdb.LibraryWatcher logger)
+"""
+
+import ctypes, ctypes.util, os, select, struct, sys, threading, time
+import Instrumentation
+import LibrarySync
+
+log = Instrumentation.get_logger(__name__)
+
+QUIET_PERIOD = 0.3  #Seconds without new events before a batch is synced
+MAX_DELAY = 2.0  #Longest a change waits while events keep arriving
+POLL_INTERVAL = 2.0  #Seconds between scans when inotify is not available
+
+#inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII')  #wd, mask, cookie, len
+
+def _open_inotify(folder):
+    """Helper Function that starts an inotify watch on folder, returns its file descriptor or None if unsupported"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(fd, os.fsencode(folder), WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(error, "inotify_add_watch failed")
+    except (OSError, AttributeError) as e:
+        log.warning("inotify unavailable (%s), polling %s instead", e, folder)
+        return None
+    return fd
+
+def parse_events(data):
+    """Function to split a buffer read from inotify into (mask, file name) pairs"""
+    events = []
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+        wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        events.append((mask, os.fsdecode(name)))
+    return events
+
+class LibraryWatcher:
+    """Class that watches the songs folder and syncs changed files to the database in coalesced batches"""
+
+    def __init__(self, songs_folder=LibrarySync.SONGS_FOLDER, quiet_period=QUIET_PERIOD, max_delay=MAX_DELAY,
+                 poll_interval=POLL_INTERVAL, write=None, use_inotify=True):
+        self.songs_folder = songs_folder
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self._write = write or (lambda function, *args: function(*args))
+        self._subscribers = []
+        self._pending = set()
+        self._first_event = None
+        self._last_event = None
+        self._full_sync = False  #Set when inotify dropped events, the next batch re-scans everything
+        self._stop = threading.Event()
+        self._thread = None
+        self.backend = None
+        self.stats = {'events': 0, 'batches': 0, 'files_synced': 0, 'full_syncs': 0, 'errors': 0}
+
+    def subscribe(self, callback):
+        """Function to be told about every batch that changed the library, callback(changes) runs on the watcher thread"""
+        self._subscribers.append(callback)
+
+    def start(self):
+        if not os.path.exists(self.songs_folder):
+            os.makedirs(self.songs_folder)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="library-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    #Watcher thread
+    def _run(self):
+        fd = _open_inotify(self.songs_folder) if self.use_inotify else None
+        self.backend = "inotify" if fd is not None else "polling"
+        try:
+            if fd is not None:
+                self._watch_inotify(fd)
+            if not self._stop.is_set():
+                self._watch_polling()  #Also where inotify ends up if the folder itself goes away
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _watch_inotify(self, fd):
+        """Helper Function that waits on inotify events, returns if the watch ends (folder deleted or moved)"""
+        while not self._stop.is_set():
+            readable, _, _ = select.select([fd], [], [], self._timeout(0.5))
+            if readable:
+                try:
+                    data = os.read(fd, 65536)
+                except BlockingIOError:
+                    data = b''
+                for mask, name in parse_events(data):
+                    if mask & IN_Q_OVERFLOW:
+                        self._full_sync = True  #The kernel dropped events, we no longer know what changed
+                        self._note(None)
+                    elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        log.warning("%s is no longer watched, switching to polling", self.songs_folder)
+                        self.backend = "polling"
+                        self._full_sync = True
+                        self._flush()
+                        return
+                    elif name and not mask & IN_ISDIR:
+                        self._note(name)
+            self._flush_if_due()
+        self._flush()
+
+    def _watch_polling(self):
+        """Helper Function that re-scans the folder every poll_interval and notes files whose stat changed"""
+        snapshot = self._scan()
+        while not self._stop.wait(self._timeout(self.poll_interval)):
+            entries = self._scan()
+            for name in entries.keys() | snapshot.keys():
+                if entries.get(name) != snapshot.get(name):
+                    self._note(name)
+            snapshot = entries
+            self._flush_if_due()
+        self._flush()
+
+    def _scan(self):
+        try:
+            return LibrarySync.scan_folder(self.songs_folder)
+        except FileNotFoundError:
+            return {}
+
+    def _note(self, name):
+        """Helper Function that adds a changed file to the pending batch"""
+        now = time.monotonic()
+        self.stats['events'] += 1
+        if name is not None and not name.startswith('.'):  #Skip hidden and partial-download files
+            self._pending.add(name)
+        if self._first_event is None:
+            self._first_event = now
+        self._last_event = now
+
+    def _timeout(self, idle):
+        """Helper Function that returns how long to wait before the pending batch is due"""
+        if self._first_event is None:
+            return idle
+        due = min(self._last_event + self.quiet_period, self._first_event + self.max_delay)
+        return max(0.0, min(idle, due - time.monotonic()))
+
+    def _flush_if_due(self):
+        if self._first_event is not None and self._timeout(float('inf')) <= 0:
+            self._flush()
+
+    def _flush(self):
+        """Helper Function that syncs the pending batch and tells the subscribers what changed"""
+        names, self._pending = sorted(self._pending), set()
+        full_sync, self._full_sync = self._full_sync, False
+        self._first_event = self._last_event = None
+        if not names and not full_sync:
+            return
+
+        try:
+            #Read the files here so the database is only busy for the writes
+            if full_sync:
+                self.stats['full_syncs'] += 1
+                prepared = LibrarySync.read_library(self.songs_folder)
+                changes = self._write(LibrarySync.sync_library, self.songs_folder, True, prepared)
+            else:
+                prepared = LibrarySync.read_files(self.songs_folder, names)
+                changes = self._write(LibrarySync.sync_files, self.songs_folder, names, prepared)
+        except Exception as e:
+            self.stats['errors'] += 1
+            log.error("Could not sync %d changed files: %s", len(names), e)
+            return
+
+        self.stats['batches'] += 1
+        count = sum(len(changed) for changed in changes.values())
+        self.stats['files_synced'] += count
+        if not count:
+            return
+        log.info("Library watcher: %d added, %d changed, %d removed.",
+                 len(changes['added']), len(changes['changed']), len(changes['removed']))
+        for callback in list(self._subscribers):
+            try:
+                callback(changes)
+            except Exception as e:
+                log.error("Library change subscriber failed: %s", e)
@@ -12,19 +12,54 @@ Usage:
 1. Run the Main.py to launch the sign-in window.
 2. Users can either sign up by providing a username and password or log in if they already have an account.
 3. The script calls appropriate functions from the `Database` module to handle user registration and authentication.
+4. After a successful login the Activity window (and with it pygame) is loaded.
 
 
 Dependencies:
 - Tkinter (for GUI)
 - Database module (for database operations like fetching songs, creating playlists, etc.)
+- Instrumentation module (for the backend log output)
 
 """
 
 import tkinter as tk
-from tkinter import PhotoImage
+from tkinter import PhotoImage, messagebox
 import Database
+import Instrumentation
 import os
 
+def do_signup(entry_username, entry_password):
+    """Function to handles the signup button"""
+    username = entry_username.get()
+    password = entry_password.get()
+
+    success, message = Database.signup(username, password)
+    if success:
+        messagebox.showinfo("Success", message)
+    else:
+        messagebox.showerror("Error", message)
+
+def do_login(entry_username, entry_password, root):
+    """Function to handles the login button"""
+    username = entry_username.get()
+    password = entry_password.get()
+
+    success, message = Database.login(username, password)
+    if success:
+        root.destroy()  #Close the old login window
+        Database.load_songs_to_database()  #Load songs for any user
+
+        import Activity  #Loads pygame, only needed once someone is logged in
+        Activity.launch_activity()  #Launch the Activity window
+    else:
+        messagebox.showerror("Login Error", message)
+
+# Show backend log messages (MUSICDB_LOG=DEBUG shows everything)
+Instrumentation.configure_logging()
+
+# Open (and if needed create or upgrade) the database
+Database.init()
+
 # Creates the Sign in Page
 root = tk.Tk()
 root.title("Python Final Sign-In Page")
@@ -40,8 +75,8 @@ entry_password = tk.Entry(root, show="*")
 entry_password.pack()
 
 # Functions to sign in with database
-tk.Button(root, text="Signup", command=lambda: Database.do_signup(entry_username, entry_password)).pack(pady=5)
-tk.Button(root, text="Login", command=lambda: Database.do_login(entry_username, entry_password, root)).pack(pady=5)
+tk.Button(root, text="Signup", command=lambda: do_signup(entry_username, entry_password)).pack(pady=5)
+tk.Button(root, text="Login", command=lambda: do_login(entry_username, entry_password, root)).pack(pady=5)
 absolute_path = os.path.dirname(os.path.abspath(__file__))
 filename = os.path.join(absolute_path, "logo.png")
 og_image = PhotoImage(file = filename)
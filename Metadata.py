@@ -0,0 +1,161 @@
+"""
+Module: Metadata.py
+Author: Jacob       : Backend
+
+Description:
+This module caches audio metadata so showing a song's details never has to open the MP3 file. Duration, bitrate,
+sample rate and the ID3 title/artist are read once with mutagen when a file is ingested by LibrarySync and stored in the
+Song_Metadata table together with the file size and mtime they were read from. A sync that sees a file's size or mtime
+change re-reads it. Lookups go through a small in-process LRU cache in front of the table. Lookups never write: a song
+that was never ingested is read from its file and the result is only kept in memory, the next sync stores it.
+
+Usage:
+- `get_song_metadata(song_name)` returns the cached metadata dict for a song (or None if it is unknown).
+- `refresh_metadata(conn, folder, names, entries)` is called by LibrarySync for new and changed files.
+
+Dependencies:
+- mutagen (for MP3 file metadata extraction)
+- ConnectionPool module (for the shared database connections)
+- Instrumentation module (for timings and the musicdb.Metadata logger)
+- QueryCache module (for dropping cached reads of Song_Metadata, e.g. playlist durations)
+"""
+
+import os, threading
+from collections import OrderedDict
+import ConnectionPool
+import Instrumentation
+import QueryCache
+
+log = Instrumentation.get_logger(__name__)
+
+CACHE_SIZE = 2048
+FIELDS = ('size', 'mtime', 'duration', 'bitrate', 'sample_rate', 'title', 'artist')
+
+class LRUCache:
+    """Class for a small thread-safe least-recently-used cache"""
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0  #Bumped on every discard, see put()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, generation=None):
+        """Function to store a value, skipped if something was discarded since generation was read"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return  #It may have been read from before a write that has since been committed
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+_cache = LRUCache()
+
+def read_audio_metadata(path):
+    """Function to read duration, bitrate, sample rate and ID3 title/artist from an MP3 file"""
+    from mutagen.mp3 import MP3  #Imported on first use so the backend loads without mutagen's startup cost
+
+    info = {'duration': None, 'bitrate': None, 'sample_rate': None, 'title': None, 'artist': None}
+    try:
+        audio = MP3(path)
+        info['duration'] = audio.info.length  #Duration in seconds
+        info['bitrate'] = audio.info.bitrate
+        info['sample_rate'] = audio.info.sample_rate
+        if audio.tags is not None:
+            if 'TIT2' in audio.tags:
+                info['title'] = str(audio.tags['TIT2'])
+            if 'TPE1' in audio.tags:
+                info['artist'] = str(audio.tags['TPE1'])
+    except Exception as e:
+        log.warning("Error reading metadata from %s: %s", path, e)
+    return info
+
+def metadata_row(size, mtime, info, song_name):
+    """Function to build the row store_metadata expects from read_audio_metadata's result"""
+    return (size, mtime, info['duration'], info['bitrate'], info['sample_rate'], info['title'], info['artist'], song_name)
+
+def store_metadata(conn, rows):
+    """Function to save (size, mtime, duration, bitrate, sample rate, title, artist, song name) rows"""
+    conn.executemany('''
+    INSERT OR REPLACE INTO Song_Metadata (Song_Index, Size, Mtime, Duration, Bitrate, Sample_Rate, Tag_Title, Tag_Artist)
+    SELECT "Index", ?, ?, ?, ?, ?, ?, ? FROM Song_Table WHERE Song = ?
+    ''', rows)
+    if rows:
+        invalidate([row[-1] for row in rows])
+        QueryCache.touch('Song_Metadata')
+
+def refresh_metadata(conn, songs_folder, names, entries):
+    """Function to (re)read the metadata of new or changed files, entries maps name to (size, mtime)"""
+    rows = []
+    for name in names:
+        size, mtime = entries[name]
+        rows.append(metadata_row(size, mtime, read_audio_metadata(os.path.join(songs_folder, name)), name))
+    store_metadata(conn, rows)
+
+def invalidate(names):
+    """Function to drop songs from the in-process cache, once the current write transaction (if any) commits"""
+    def discard():
+        for name in names:
+            _cache.discard(name)
+    ConnectionPool.after_commit(discard)
+
+def is_plain_file_name(song_name):
+    """Function to tell if a song name is a plain file name, so joining it to the Songs folder can't leave it"""
+    return bool(song_name) and song_name == os.path.basename(song_name) and not song_name.startswith('.') \
+        and '\\' not in song_name and '\0' not in song_name
+
+@Instrumentation.timed
+def get_song_metadata(song_name, songs_folder="Songs"):
+    """Function to look up a song's metadata, the audio file is only read if it was never ingested"""
+    if not is_plain_file_name(song_name):
+        return None  #Names like "../secret" come from outside (e.g. a service URL), never follow them
+    metadata = _cache.get(song_name)
+    if metadata is not None:
+        return metadata
+
+    generation = _cache.generation
+    with ConnectionPool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT Song_Metadata.Size, Song_Metadata.Mtime, Duration, Bitrate, Sample_Rate, Tag_Title, Tag_Artist
+        FROM Song_Table JOIN Song_Metadata ON Song_Metadata.Song_Index = Song_Table."Index"
+        WHERE Song_Table.Song = ?
+        ''', (song_name,))
+        row = cursor.fetchone()
+
+    if row is None:
+        #Not ingested yet (e.g. added since the last sync), read the file but leave storing it to the sync
+        song_path = os.path.join(songs_folder, song_name)
+        if not os.path.isfile(song_path):
+            return None
+        stat = os.stat(song_path)
+        row = metadata_row(stat.st_size, stat.st_mtime_ns, read_audio_metadata(song_path), song_name)[:-1]
+
+    metadata = dict(zip(FIELDS, row))
+    _cache.put(song_name, metadata, generation)
+    return metadata
+
+def get_cache_stats():
+    return {'hits': _cache.hits, 'misses': _cache.misses, 'size': len(_cache._data), 'max_size': _cache.max_size}
@@ -0,0 +1,241 @@
+"""
+Module: Migrations.py
+Author: Jacob       : Backend
+
+Description:
+This module upgrades existing song_database.db files in place. The schema version is kept in SQLite's user_version
+header field; create_tables() in Database.py builds the original tables and then calls migrate(), which runs every
+migration newer than the stored version inside the same transaction and records the new version.
+
+Usage:
+- To change the schema, write a function that takes a connection and append it to MIGRATIONS with the next number.
+- Migrations must work both on a brand new database and on one created by an older version of the app.
+
+Dependencies:
+- LibrarySync module (for parsing song file names into title and artist)
+- Instrumentation module (for the musicdb.Migrations logger)
+"""
+
+import json
+import Instrumentation
+import LibrarySync
+
+log = Instrumentation.get_logger(__name__)
+
+def _column_names(conn, table):
+    """Helper Function that lists the columns of a table"""
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+def _song_title_artist(conn):
+    """Migration 1: unique song file names plus indexed Title and Artist columns"""
+    columns = _column_names(conn, 'Song_Table')
+    if 'Title' not in columns:
+        conn.execute('ALTER TABLE Song_Table ADD COLUMN Title TEXT')
+    if 'Artist' not in columns:
+        conn.execute('ALTER TABLE Song_Table ADD COLUMN Artist TEXT')
+
+    #Older syncs could store the same file twice, keep the first copy so the unique index can be built
+    conn.execute('DELETE FROM Song_Table WHERE "Index" NOT IN (SELECT MIN("Index") FROM Song_Table GROUP BY Song)')
+
+    rows = conn.execute('SELECT "Index", Song FROM Song_Table').fetchall()
+    conn.executemany('UPDATE Song_Table SET Title = ?, Artist = ? WHERE "Index" = ?',
+                     [(*LibrarySync.parse_song_name(song), index) for index, song in rows if song])
+
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_Song_Table_Song ON Song_Table (Song)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_Song_Table_Title ON Song_Table (Title)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_Song_Table_Artist ON Song_Table (Artist)')
+
+def _playlist_song_table(conn):
+    """Migration 2: move playlist contents from the JSON List column into the Playlist_Song join table"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS Playlist_Song (
+        PlaylistID INTEGER NOT NULL,
+        Song_Index INTEGER NOT NULL,
+        Position REAL NOT NULL,
+        PRIMARY KEY (PlaylistID, Song_Index),
+        FOREIGN KEY (PlaylistID) REFERENCES Playlist_Table(PlaylistID),
+        FOREIGN KEY (Song_Index) REFERENCES Song_Table("Index")
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_Playlist_Song_Position ON Playlist_Song (PlaylistID, Position)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_Playlist_Song_Song ON Playlist_Song (Song_Index)')
+
+    playlists = conn.execute("SELECT PlaylistID, List FROM Playlist_Table WHERE List IS NOT NULL AND List != '[]'").fetchall()
+    for playlist_id, song_json in playlists:
+        songs = json.loads(song_json)
+
+        #Songs whose file is gone are kept as rows so no playlist loses entries in the upgrade itself, migration 9
+        #gives them manifest rows so the first sync afterwards removes them like any other deleted file
+        conn.executemany('INSERT OR IGNORE INTO Song_Table (Song, Title, Artist) VALUES (?, ?, ?)',
+                         [(song, *LibrarySync.parse_song_name(song)) for song in songs])
+        conn.executemany('''
+        INSERT OR IGNORE INTO Playlist_Song (PlaylistID, Song_Index, Position)
+        SELECT ?, "Index", ? FROM Song_Table WHERE Song = ?
+        ''', [(playlist_id, position, song) for position, song in enumerate(songs, start=1)])
+
+    #The JSON column is no longer read or written
+    conn.execute('UPDATE Playlist_Table SET List = NULL')
+
+def _song_search_index(conn):
+    """Migration 3: FTS5 index over song titles and artists, kept in step with Song_Table by triggers"""
+    conn.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS Song_Search USING fts5(
+        Title, Artist,
+        content='Song_Table', content_rowid='Index',
+        prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+    )
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS Song_Search_Insert AFTER INSERT ON Song_Table BEGIN
+        INSERT INTO Song_Search (rowid, Title, Artist) VALUES (new."Index", new.Title, new.Artist);
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS Song_Search_Delete AFTER DELETE ON Song_Table BEGIN
+        INSERT INTO Song_Search (Song_Search, rowid, Title, Artist) VALUES ('delete', old."Index", old.Title, old.Artist);
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS Song_Search_Update AFTER UPDATE ON Song_Table BEGIN
+        INSERT INTO Song_Search (Song_Search, rowid, Title, Artist) VALUES ('delete', old."Index", old.Title, old.Artist);
+        INSERT INTO Song_Search (rowid, Title, Artist) VALUES (new."Index", new.Title, new.Artist);
+    END
+    ''')
+
+    #Index the songs that are already stored
+    conn.execute("INSERT INTO Song_Search (Song_Search) VALUES ('rebuild')")
+
+def _song_metadata_table(conn):
+    """Migration 4: cached audio metadata, read once per file version at ingest time"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS Song_Metadata (
+        Song_Index INTEGER PRIMARY KEY,
+        Size INTEGER,
+        Mtime INTEGER,
+        Duration REAL,
+        Bitrate INTEGER,
+        Sample_Rate INTEGER,
+        Tag_Title TEXT,
+        Tag_Artist TEXT,
+        FOREIGN KEY (Song_Index) REFERENCES Song_Table("Index")
+    )
+    ''')
+
+    #Forget the scan manifest so the next sync treats every file as new and fills the cache
+    conn.execute('DELETE FROM Scan_Manifest')
+
+def _catalog_sort_indexes(conn):
+    """Migration 5: case-insensitive indexes matching the catalog's title and artist sort orders"""
+    #Keyset pagination compares sort keys, a NULL would end a page early
+    conn.execute("UPDATE Song_Table SET Title = COALESCE(Title, ''), Artist = COALESCE(Artist, 'Unknown') "
+                 "WHERE Title IS NULL OR Artist IS NULL")
+
+    #The new indexes also serve lookups by Title or Artist, so the old case-sensitive ones go
+    conn.execute('DROP INDEX IF EXISTS idx_Song_Table_Title')
+    conn.execute('DROP INDEX IF EXISTS idx_Song_Table_Artist')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_Song_Table_Title_Sort ON Song_Table (Title COLLATE NOCASE)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_Song_Table_Artist_Sort ON Song_Table '
+                 '(Artist COLLATE NOCASE, Title COLLATE NOCASE)')
+
+def _song_change_log(conn):
+    """Migration 6: log of changed song ids, so the in-memory catalog can refresh without reloading"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS Song_Change_Log (
+        Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        Song_Index INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS Song_Change_Log_Insert AFTER INSERT ON Song_Table BEGIN
+        INSERT INTO Song_Change_Log (Song_Index) VALUES (new."Index");
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS Song_Change_Log_Delete AFTER DELETE ON Song_Table BEGIN
+        INSERT INTO Song_Change_Log (Song_Index) VALUES (old."Index");
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS Song_Change_Log_Update AFTER UPDATE ON Song_Table BEGIN
+        INSERT INTO Song_Change_Log (Song_Index) VALUES (new."Index");
+        INSERT INTO Song_Change_Log (Song_Index) SELECT old."Index" WHERE old."Index" != new."Index";
+    END
+    ''')
+
+def _playlist_user_name_index(conn):
+    """Migration 7: one playlist per (user, name), enforced by a unique index that also serves per-user lookups"""
+    #signup used to create the starter playlist without an owner, give it back to the user it was made for
+    conn.execute('''
+    UPDATE Playlist_Table SET User_Username = (
+        SELECT Username FROM User_Table WHERE User_Table.Playlist_Table_Name = Playlist_Table.Name LIMIT 1
+    ) WHERE User_Username IS NULL
+    ''')
+
+    #Merge same-named playlists of a user into the oldest one, the extra songs go after its own
+    duplicates = conn.execute('''
+    SELECT Playlist_Table.PlaylistID, Keep.PlaylistID FROM Playlist_Table
+    JOIN (SELECT User_Username, Name, MIN(PlaylistID) AS PlaylistID FROM Playlist_Table
+          GROUP BY User_Username, Name HAVING COUNT(*) > 1) AS Keep
+      ON Keep.User_Username = Playlist_Table.User_Username AND Keep.Name = Playlist_Table.Name
+    WHERE Playlist_Table.PlaylistID != Keep.PlaylistID
+    ORDER BY Playlist_Table.PlaylistID
+    ''').fetchall()
+    for duplicate_id, keep_id in duplicates:
+        last_position = conn.execute('SELECT MAX(Position) FROM Playlist_Song WHERE PlaylistID = ?',
+                                     (keep_id,)).fetchone()[0] or 0
+        conn.execute('''
+        INSERT OR IGNORE INTO Playlist_Song (PlaylistID, Song_Index, Position)
+        SELECT ?, Song_Index, Position + ? FROM Playlist_Song WHERE PlaylistID = ?
+        ''', (keep_id, last_position, duplicate_id))
+        conn.execute('DELETE FROM Playlist_Song WHERE PlaylistID = ?', (duplicate_id,))
+        conn.execute('DELETE FROM Playlist_Table WHERE PlaylistID = ?', (duplicate_id,))
+    if duplicates:
+        log.info("Merged %d duplicate playlists.", len(duplicates))
+
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_Playlist_Table_User_Name ON Playlist_Table (User_Username, Name)')
+
+def _table_versions(conn):
+    """Migration 8: per-table version counters, bumped by every write so other processes' query caches see it"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS Table_Version (
+        Name TEXT PRIMARY KEY,
+        Version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+
+def _manifest_orphans(conn):
+    """Migration 9: scan manifest rows for songs that have none, so the next sync can remove the ones without a file"""
+    #Migration 2 stored playlist songs whose file was already gone, and migration 4 emptied the manifest. A song without
+    #a manifest row is never diffed, so a missing file stayed in the catalog for good. With a size that matches no file,
+    #the next sync removes it if the file is gone and re-reads it (as migration 4 meant to) if it is there
+    conn.execute('''
+    INSERT INTO Scan_Manifest (Path, Size, Mtime)
+    SELECT Song, -1, -1 FROM Song_Table
+    WHERE Song IS NOT NULL AND Song NOT IN (SELECT Path FROM Scan_Manifest)
+    ''')
+
+#Ordered list of (version, migration function)
+MIGRATIONS = [
+    (1, _song_title_artist),
+    (2, _playlist_song_table),
+    (3, _song_search_index),
+    (4, _song_metadata_table),
+    (5, _catalog_sort_indexes),
+    (6, _song_change_log),
+    (7, _playlist_user_name_index),
+    (8, _table_versions),
+    (9, _manifest_orphans),
+]
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    """Function to run every migration newer than the database's schema version"""
+    version = get_version(conn)
+    for number, migration in MIGRATIONS:
+        if number > version:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+            log.info("Database migrated to schema version %d.", number)
+    return get_version(conn)
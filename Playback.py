@@ -0,0 +1,198 @@
+"""
+Module: Playback.py
+Author: Jacob       : Backend
+        Marlenne    : Frontend
+
+Description:
+This module owns audio playback for the Activity window. A PlaybackEngine keeps a background thread that reads the next
+songs of the play queue into memory ahead of time (one buffered read per file), so pressing Play or moving on to the next
+playlist song never waits on the disk. While a song plays, the next one is handed to pygame's music queue so it starts
+without a gap; song lengths from the Metadata cache tell the engine when that hand-over has happened.
+
+The engine also measures latency-to-first-audio (time from play() until pygame reports that music is playing) and
+whether each song was already prefetched when it was needed.
+
+Usage:
+- `engine = PlaybackEngine()` once per window, `engine.play(song, upcoming=[...])` and `engine.stop()` from the UI.
+- `engine.prefetch([song])` warms the buffer for a song the user is likely to play (e.g. the selected one).
+- `engine.current` is the song that is playing now, `engine.get_metrics()` returns the latency numbers.
+
+Dependencies:
+- Pygame (for audio output)
+- Metadata module (for song durations)
+- Instrumentation module (for the musicdb.Playback logger)
+"""
+
+import io, os, threading, time
+from collections import OrderedDict
+import pygame
+import Instrumentation
+import Metadata
+
+log = Instrumentation.get_logger(__name__)
+
+PREFETCH_COUNT = 2  #How many upcoming songs are kept in memory
+POLL_INTERVAL = 0.05  #Seconds between checks of the playback state
+
+class PlaybackEngine:
+    """Class that plays songs through pygame and prefetches/queues the following songs on a background thread"""
+
+    def __init__(self, songs_folder="Songs", prefetch_count=PREFETCH_COUNT):
+        pygame.mixer.init()
+        self.songs_folder = songs_folder
+        self.prefetch_count = prefetch_count
+        self.current = None  #Song that is playing now
+        self.upcoming = []  #Songs that follow the current one
+        self.playing = False
+
+        self._buffers = OrderedDict()  #Song name -> file contents
+        self._wanted = []  #Songs the UI asked to have ready
+        self._queued = None  #Song already handed to pygame's queue
+        self._track_started = 0.0
+        self._track_length = None
+        self._play_requested = None  #perf_counter() of the last play(), until audio starts
+        self._metrics = {'plays': 0, 'latencies_ms': [], 'prefetch_hits': 0, 'prefetch_misses': 0, 'gapless': 0}
+
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="playback", daemon=True)
+        self._thread.start()
+
+    #Calls from the UI
+    def play(self, song, upcoming=()):
+        """Function to start a song now, upcoming songs play after it without a gap"""
+        with self._lock:
+            self.upcoming = list(upcoming)
+            self._play_requested = time.perf_counter()
+            self._metrics['plays'] += 1
+            self._start(song)
+        self._wake.set()
+
+    def stop(self):
+        with self._lock:
+            pygame.mixer.music.stop()
+            self.playing = False
+            self._queued = None
+            self._play_requested = None
+
+    def prefetch(self, songs):
+        """Function to ask the background thread to load songs into memory"""
+        with self._lock:
+            self._wanted = list(songs)
+        self._wake.set()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self.stop()
+
+    def get_metrics(self):
+        """Function to summarise latency-to-first-audio and prefetch hit counts"""
+        with self._lock:
+            last = self._metrics['latencies_ms'][-1] if self._metrics['latencies_ms'] else None
+            latencies = sorted(self._metrics['latencies_ms'])
+            metrics = {key: value for key, value in self._metrics.items() if key != 'latencies_ms'}
+        metrics['first_audio_ms'] = {
+            'count': len(latencies),
+            'last': last,
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': latencies[len(latencies) // 2] if latencies else None,
+            'max': latencies[-1] if latencies else None,
+        }
+        return metrics
+
+    #Engine internals (called with the lock held unless noted)
+    def _source(self, song):
+        """Helper Function that returns a file object for pygame, from the prefetch buffer when possible"""
+        data = self._buffers.get(song)
+        if data is None:
+            self._metrics['prefetch_misses'] += 1
+            data = self._read(song)
+            self._buffers[song] = data
+        else:
+            self._metrics['prefetch_hits'] += 1
+        return io.BytesIO(data)
+
+    def _read(self, song):
+        """Helper Function that reads a whole song file in one buffered read (no lock needed)"""
+        with open(os.path.join(self.songs_folder, song), 'rb', buffering=0) as handle:
+            data = bytearray(os.fstat(handle.fileno()).st_size)
+            handle.readinto(data)
+        return bytes(data)
+
+    def _length(self, song):
+        metadata = Metadata.get_song_metadata(song, self.songs_folder)
+        return metadata['duration'] if metadata else None
+
+    def _start(self, song):
+        pygame.mixer.music.load(self._source(song), os.path.splitext(song)[1].lstrip('.') or 'mp3')
+        pygame.mixer.music.play()
+        self.current = song
+        self.playing = True
+        self._queued = None
+        self._track_started = time.perf_counter()
+        self._track_length = self._length(song)
+
+    def _run(self):
+        """Helper Function for the background thread: prefetch, queue the next song and follow track changes"""
+        while not self._closed:
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                self._prefetch_pending()
+                with self._lock:
+                    self._follow_playback()
+            except Exception as e:
+                log.error("Playback error: %s", e)
+
+    def _prefetch_pending(self):
+        """Helper Function that reads the wanted and upcoming songs that are not buffered yet"""
+        with self._lock:
+            keep = [song for song in [self.current] + self._wanted + self.upcoming[:self.prefetch_count] if song]
+            missing = [song for song in keep if song not in self._buffers]
+
+        #Disk reads happen without the lock so the UI thread never waits on them
+        loaded = {}
+        for song in missing:
+            try:
+                loaded[song] = self._read(song)
+            except OSError as e:
+                log.warning("Could not prefetch %s: %s", song, e)
+
+        with self._lock:
+            self._buffers.update(loaded)
+            for song in list(self._buffers):
+                if song not in keep:
+                    del self._buffers[song]
+
+    def _follow_playback(self):
+        if not self.playing:
+            return
+        now = time.perf_counter()
+        busy = pygame.mixer.music.get_busy()
+
+        if self._play_requested is not None and busy:
+            self._metrics['latencies_ms'].append((now - self._play_requested) * 1000)
+            self._play_requested = None
+
+        #Hand the next song to pygame early so it starts without a gap (only when we can tell when it starts)
+        if self._queued is None and self.upcoming and self._track_length and self.upcoming[0] in self._buffers:
+            song = self.upcoming[0]
+            pygame.mixer.music.queue(self._source(song), os.path.splitext(song)[1].lstrip('.') or 'mp3')
+            self._queued = song
+
+        if self._queued is not None and now - self._track_started >= self._track_length:
+            #pygame has moved on to the queued song
+            self._track_started += self._track_length
+            self.current = self.upcoming.pop(0)
+            self._queued = None
+            self._track_length = self._length(self.current)
+            self._metrics['gapless'] += 1
+        elif not busy and (self._play_requested is None or now - self._play_requested > 5):
+            #The song ended without a queued follower (or never started)
+            if self.upcoming:
+                self._play_requested = now
+                self._start(self.upcoming.pop(0))
+            else:
+                self.playing = False
@@ -0,0 +1,110 @@
+"""
+Module: PlaylistEdit.py
+Author: Jacob       : Backend
+
+Description:
+This module records the edits made to a playlist in an editor view and saves only what changed. A PlaylistEditSession
+starts from the songs the playlist had when the editor opened and keeps adds, removes and moves as a diff instead of
+the whole new list. Edits that cancel out are coalesced as they come in: a song that is added and removed again is
+forgotten, a song that is unchecked and checked again keeps its place, and a song moved several times only keeps its
+last move. Saving sends that diff to Database.apply_playlist_edits, which applies it in one transaction, so changing
+one song in a 50k track playlist writes one row instead of rewriting all of them.
+
+Usage:
+- `session = PlaylistEditSession(username, name, current_songs)`, or `PlaylistEditSession(username, name, create=True)`
+  for a playlist that does not exist yet.
+- `session.add(song)`, `session.remove(song)`, `session.move(song, before_song)` or `session.set_checked(song, checked)`
+  (the VirtualList on_toggle callback) record edits.
+- `session.apply()` saves on this thread and starts the next round of edits from there. `session.submit(db)` saves on
+  an AsyncDatabase writer thread, the editor then reopens with a new session. Both give (success, message).
+
+Dependencies:
+- Database module (for apply_playlist_edits)
+- Instrumentation module (for the musicdb.PlaylistEdit logger)
+"""
+
+import collections
+import Database
+import Instrumentation
+
+log = Instrumentation.get_logger(__name__)
+
+class PlaylistEditSession:
+    """Class that keeps a playlist's pending edits as a coalesced diff against the songs it started with"""
+
+    def __init__(self, username, playlist_name, songs=(), create=False):
+        self.username = username
+        self.playlist_name = playlist_name
+        self.create = create
+        self._base = set(songs)  #Songs in the playlist when the session started
+        self._removed = set()
+        self._placed = collections.OrderedDict()  #Song -> song it goes in front of (None for the end), in edit order
+
+    def __contains__(self, song):
+        """Function to tell if song is in the playlist with the pending edits applied"""
+        return song in self._placed or (song in self._base and song not in self._removed)
+
+    def __len__(self):
+        """Function to count the pending edits"""
+        return len(self._removed) + len(self._placed)
+
+    def add(self, song, before=None):
+        """Function to record adding song, in front of before or at the end"""
+        if song in self._removed:
+            self._removed.discard(song)  #Removed and added again, it keeps its old place unless told otherwise
+            if before is not None:
+                self.move(song, before)
+        elif song in self:
+            if before is not None:
+                self.move(song, before)
+        else:
+            self._placed[song] = before
+
+    def remove(self, song):
+        """Function to record taking song out of the playlist"""
+        self._placed.pop(song, None)  #An add that was never saved is simply forgotten
+        if song in self._base:
+            self._removed.add(song)
+
+    def move(self, song, before=None):
+        """Function to record moving song in front of before, or to the end"""
+        if song == before or song not in self:
+            return
+        self._placed.pop(song, None)  #Only the last move counts, and it is applied after the earlier edits
+        self._placed[song] = before
+
+    def set_checked(self, song, checked):
+        """Function to record a checkbox change, for VirtualList(on_toggle=session.set_checked)"""
+        if checked:
+            self.add(song)
+        else:
+            self.remove(song)
+
+    def changes(self):
+        """Function to get the pending edits as the (removed, placed) arguments of Database.apply_playlist_edits"""
+        removed = sorted(self._removed)
+        placed = [(song, before, song not in self._base) for song, before in self._placed.items()]
+        return removed, placed
+
+    def apply(self):
+        """Function to save the pending edits now, returns (success, message)"""
+        removed, placed = self.changes()
+        return self._saved(Database.apply_playlist_edits(self.username, self.playlist_name, removed, placed, self.create))
+
+    def submit(self, database):
+        """Function to save the pending edits through an AsyncDatabase, returns a Future of (success, message)"""
+        #The Future finishes on the writer thread, so the session is left as it is; start a new one after saving
+        removed, placed = self.changes()
+        return database.apply_playlist_edits(self.username, self.playlist_name, removed, placed, self.create)
+
+    def _saved(self, result):
+        """Helper Function that makes the saved edits the new starting point"""
+        success, message = result
+        if success:
+            self._base.difference_update(self._removed)
+            self._base.update(self._placed)
+            self._removed.clear()
+            self._placed.clear()
+            self.create = False
+            log.debug("Playlist '%s' of %s: %s", self.playlist_name, self.username, message)
+        return result
@@ -0,0 +1,297 @@
+"""
+Module: PlaylistIO.py
+Author: Jacob       : Backend
+
+Description:
+This module moves playlists in and out of the database as files, so they no longer have to be built by ticking checkboxes.
+Three formats are supported, picked from the file extension unless given:
+
+- M3U / M3U8 (.m3u, .m3u8): one path per line, with optional "#EXTINF:seconds,Artist - Title" lines before it
+- JSON Lines (.jsonl, .ndjson): one object per line with "song", "title", "artist" (a bare JSON string is a song name)
+- CSV (.csv): a header row with a "song" column and optional "title" and "artist" columns
+
+Both directions stream. An import reads the file entry by entry and resolves it against Song_Table in batches: first by
+file name (for M3U, the last part of the path), then for entries that did not match, by title and artist without regard
+to case through the Artist/Title index, with one query for all of a batch's misses. Entries that still do not match are
+counted and reported (a sample in the result and, if asked, every one of them in a separate file) instead of stopping
+the import. The whole file is written inside a single transaction, so a failed import leaves the playlist as it was. An
+export reads the playlist with a cursor in batches and writes to a temporary file that replaces the target at the end.
+Neither keeps the playlist in memory, so files with hundreds of thousands of entries are fine.
+
+Usage:
+- `import_playlist(username, name, "mix.m3u")` returns (report, None) or (None, error message).
+- `export_playlist(username, name, "mix.csv")` returns (report, None) or (None, error message).
+- `python -m CommandLine playlist import|export USERNAME NAME ...` does the same from the command line.
+
+Dependencies:
+- csv, json (for the file formats)
+- Database module (for connections and the playlist helpers)
+- LibrarySync module (for splitting song file names into title and artist)
+- Instrumentation module (for timings and the musicdb.PlaylistIO logger)
+- QueryCache module (for dropping cached reads of the imported playlist)
+"""
+
+import csv, json, os, tempfile
+from urllib.parse import unquote, urlparse
+import Database
+import Instrumentation
+import LibrarySync
+import QueryCache
+
+log = Instrumentation.get_logger(__name__)
+
+BATCH_SIZE = 500  #Entries resolved and inserted per round trip
+TITLE_BATCH_SIZE = 300  #Title/artist pairs per query, 3 parameters each stays under SQLite's old 999 limit
+UNMATCHED_SAMPLE = 100  #Unmatched entries listed in the report, the rest are only counted (or written to a file)
+FORMATS = {'.m3u': 'm3u', '.m3u8': 'm3u', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv'}
+CSV_FIELDS = ('position', 'song', 'title', 'artist', 'duration')
+
+def detect_format(path, format=None):
+    """Function to pick the file format from the format argument or the file extension"""
+    if format:
+        format = format.lower()
+        format = {'m3u8': 'm3u', 'ndjson': 'jsonl'}.get(format, format)
+        if format not in FORMATS.values():
+            raise ValueError(f"Unknown playlist format: {format}")
+        return format
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Cannot tell the playlist format of '{path}', use .m3u, .m3u8, .jsonl or .csv")
+    return FORMATS[extension]
+
+#Readers, each yields one {'song', 'title', 'artist', 'source'} dict per entry
+def _entry(song=None, title=None, artist=None, source=None):
+    return {'song': song or None, 'title': title or None, 'artist': artist or None, 'source': source}
+
+def _song_from_path(path):
+    """Helper Function that turns an M3U location (relative, absolute, Windows or file:// URL) into a file name"""
+    if path.startswith('file:'):
+        path = unquote(urlparse(path).path)
+    return path.replace('\\', '/').rsplit('/', 1)[-1]
+
+def read_m3u(handle):
+    extinf = None
+    for line in handle:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXTINF:'):
+            #"#EXTINF:213,Artist - Title", the display part is optional
+            info = line[len('#EXTINF:'):].split(',', 1)
+            extinf = info[1].strip() if len(info) > 1 else None
+        elif line.startswith('#'):
+            continue
+        else:
+            title = artist = None
+            if extinf and ' - ' in extinf:
+                artist, title = (part.strip() for part in extinf.split(' - ', 1))
+            yield _entry(_song_from_path(line), title, artist, line)
+            extinf = None
+
+def read_jsonl(handle):
+    for line in handle:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            yield _entry(source=line)  #Unreadable lines are reported as unmatched
+            continue
+        if isinstance(value, str):
+            yield _entry(value, source=line)
+        elif isinstance(value, dict):
+            yield _entry(value.get('song'), value.get('title'), value.get('artist'), line)
+        else:
+            yield _entry(source=line)
+
+def read_csv(handle):
+    reader = csv.DictReader(handle)
+    if reader.fieldnames:
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    for row in reader:
+        song = (row.get('song') or row.get('file') or row.get('path') or '').strip()
+        title, artist = (row.get('title') or '').strip(), (row.get('artist') or '').strip()
+        yield _entry(_song_from_path(song) if song else None, title, artist, song or f"{artist} - {title}")
+
+READERS = {'m3u': read_m3u, 'jsonl': read_jsonl, 'csv': read_csv}
+
+#Writers, each takes the output handle and an iterable of (song, title, artist, duration) rows
+def write_m3u(handle, rows, song_folder=None):
+    handle.write('#EXTM3U\n')
+    count = 0
+    for song, title, artist, duration in rows:
+        seconds = int(round(duration)) if duration else -1
+        handle.write(f'#EXTINF:{seconds},{artist} - {title}\n')
+        handle.write((os.path.join(song_folder, song) if song_folder else song) + '\n')
+        count += 1
+    return count
+
+def write_jsonl(handle, rows, song_folder=None):
+    count = 0
+    for song, title, artist, duration in rows:
+        handle.write(json.dumps({'song': song, 'title': title, 'artist': artist, 'duration': duration}) + '\n')
+        count += 1
+    return count
+
+def write_csv(handle, rows, song_folder=None):
+    writer = csv.writer(handle)
+    writer.writerow(CSV_FIELDS)
+    count = 0
+    for count, (song, title, artist, duration) in enumerate(rows, start=1):
+        writer.writerow((count, song, title, artist, '' if duration is None else round(duration, 3)))
+    return count
+
+WRITERS = {'m3u': write_m3u, 'jsonl': write_jsonl, 'csv': write_csv}
+
+def _batches(entries, batch_size):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _resolve_batch(cursor, batch):
+    """Helper Function that returns the Song_Table index of every entry in batch, None where nothing matched"""
+    names = list({entry['song'] for entry in batch if entry['song']})
+    by_name = {}
+    if names:
+        placeholders = ', '.join('?' * len(names))
+        cursor.execute(f'SELECT Song, "Index" FROM Song_Table WHERE Song IN ({placeholders})', names)
+        by_name = dict(cursor.fetchall())
+
+    song_ids = [by_name.get(entry['song']) for entry in batch]
+
+    #Entries that missed on file name are matched on title and artist, all of them in one query
+    wanted = []
+    for position, entry in enumerate(batch):
+        if song_ids[position] is not None:
+            continue
+        title, artist = entry['title'], entry['artist']
+        if not title and entry['song']:
+            #Renamed or re-encoded files often keep the "Title, Artist" part of the name
+            title, artist = LibrarySync.parse_song_name(entry['song'])
+        if title:
+            wanted.append((position, artist or "Unknown", title))
+    for start in range(0, len(wanted), TITLE_BATCH_SIZE):
+        chunk = wanted[start:start + TITLE_BATCH_SIZE]
+        values = ', '.join(['(?, ?, ?)'] * len(chunk))
+        cursor.execute(f'''
+        WITH Wanted(Position, Artist, Title) AS (VALUES {values})
+        SELECT Wanted.Position, MIN(Song_Table."Index") FROM Wanted
+        JOIN Song_Table ON Song_Table.Artist = Wanted.Artist COLLATE NOCASE
+                       AND Song_Table.Title = Wanted.Title COLLATE NOCASE
+        GROUP BY Wanted.Position
+        ''', [value for row in chunk for value in row])
+        for position, song_id in cursor.fetchall():
+            song_ids[position] = song_id
+    return song_ids
+
+@Instrumentation.timed
+def import_playlist(username, playlist_name, path, format=None, replace=True, unmatched_path=None,
+                    batch_size=BATCH_SIZE):
+    """Function to load a playlist file into a users playlist, creating it if needed (replace=False appends)"""
+    try:
+        format = detect_format(path, format)
+    except ValueError as e:
+        return None, str(e)
+
+    report = {'playlist': playlist_name, 'format': format, 'entries': 0, 'added': 0, 'duplicates': 0, 'unmatched': 0,
+              'unmatched_sample': []}
+    unmatched_file = None
+    try:
+        if unmatched_path:
+            unmatched_file = open(unmatched_path, 'w', encoding='utf-8')
+        with open(path, encoding='utf-8-sig', newline='') as handle, Database.connect(write=True) as conn:
+            cursor = conn.cursor()
+            playlist_id = Database._get_playlist_id(cursor, username, playlist_name)
+            if playlist_id is None:
+                cursor.execute('INSERT INTO Playlist_Table (Name, User_Username) VALUES (?, ?)', (playlist_name, username))
+                playlist_id = cursor.lastrowid
+            elif replace:
+                cursor.execute('DELETE FROM Playlist_Song WHERE PlaylistID = ?', (playlist_id,))
+
+            cursor.execute('SELECT MAX(Position) FROM Playlist_Song WHERE PlaylistID = ?', (playlist_id,))
+            position = cursor.fetchone()[0] or 0
+            QueryCache.touch('Playlist_Table', 'Playlist_Song')
+
+            for batch in _batches(READERS[format](handle), batch_size):
+                rows = []
+                for entry, song_id in zip(batch, _resolve_batch(cursor, batch)):
+                    if song_id is not None:
+                        position += 1
+                        rows.append((playlist_id, song_id, position))
+                        continue
+                    report['unmatched'] += 1
+                    if len(report['unmatched_sample']) < UNMATCHED_SAMPLE:
+                        report['unmatched_sample'].append(entry['source'])
+                    if unmatched_file is not None:
+                        unmatched_file.write(f"{entry['source']}\n")
+
+                #The primary key skips songs that are already in the playlist
+                before = conn.total_changes
+                cursor.executemany('INSERT OR IGNORE INTO Playlist_Song (PlaylistID, Song_Index, Position) '
+                                   'VALUES (?, ?, ?)', rows)
+                added = conn.total_changes - before
+                report['entries'] += len(batch)
+                report['added'] += added
+                report['duplicates'] += len(rows) - added
+    except (OSError, UnicodeDecodeError, csv.Error) as e:
+        log.error("Could not import %s: %s", path, e)
+        return None, f"Could not import '{path}': {e}"
+    finally:
+        if unmatched_file is not None:
+            unmatched_file.close()
+
+    log.info("Imported %d of %d entries from %s into '%s' (%d unmatched).",
+             report['added'], report['entries'], path, playlist_name, report['unmatched'])
+    return report, None
+
+def iter_playlist_rows(cursor, playlist_id, batch_size=BATCH_SIZE):
+    """Function to stream a playlist as (song, title, artist, duration) rows in playlist order"""
+    cursor.execute('''
+    SELECT Song_Table.Song, Song_Table.Title, Song_Table.Artist, Song_Metadata.Duration FROM Playlist_Song
+    JOIN Song_Table ON Song_Table."Index" = Playlist_Song.Song_Index
+    LEFT JOIN Song_Metadata ON Song_Metadata.Song_Index = Playlist_Song.Song_Index
+    WHERE Playlist_Song.PlaylistID = ?
+    ORDER BY Playlist_Song.Position
+    ''', (playlist_id,))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+@Instrumentation.timed
+def export_playlist(username, playlist_name, path, format=None, song_folder=None):
+    """Function to write a users playlist to a file, song_folder is put in front of the M3U paths"""
+    try:
+        format = detect_format(path, format)
+    except ValueError as e:
+        return None, str(e)
+
+    folder = os.path.dirname(os.path.abspath(path))
+    temporary = None
+    try:
+        with Database.connect() as conn:
+            cursor = conn.cursor()
+            playlist_id = Database._get_playlist_id(cursor, username, playlist_name)
+            if playlist_id is None:
+                return None, f"Playlist '{playlist_name}' not found for user '{username}'."
+
+            #Write next to the target and swap it in, so a failed export never leaves half a file behind
+            descriptor, temporary = tempfile.mkstemp(dir=folder, prefix='.playlist-', suffix='.tmp')
+            with open(descriptor, 'w', encoding='utf-8', newline='') as handle:
+                count = WRITERS[format](handle, iter_playlist_rows(cursor, playlist_id), song_folder)
+        os.chmod(temporary, 0o644)  #mkstemp files are private to the owner
+        os.replace(temporary, path)
+    except OSError as e:
+        if temporary and os.path.exists(temporary):
+            os.remove(temporary)
+        return None, f"Could not export to '{path}': {e}"
+
+    log.info("Exported %d songs from '%s' to %s.", count, playlist_name, path)
+    return {'playlist': playlist_name, 'format': format, 'count': count, 'output': path}, None
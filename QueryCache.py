@@ -0,0 +1,170 @@
+"""
+Module: QueryCache.py
+Author: Jacob       : Backend
+
+Description:
+This module keeps the results of the Database read functions in memory, so moving between the tabs and playlist views
+(which ask for the same playlists and summaries over and over) is answered without going back to SQLite. Every cached
+function names the tables it reads. Each table has a version counter in the Table_Version table (migration 8) that the
+write paths bump with touch() inside their own transaction, and a cached result is only used while the versions it was
+read at are still current. A playlist edit therefore drops the playlist reads, but not the song list, and nothing is
+ever served from before a write.
+
+The counters live in the database so writes from other processes count too, e.g. `python -m CommandLine sync` or
+`import` while the GUI or the service is running. Reading them on every lookup would cost a query, so a connection of
+our own watches PRAGMA data_version, which changes whenever any other connection commits, and the counters are only
+read again after it moved.
+
+Results are kept in one bounded LRU (MAX_ENTRIES results across all functions), and every lookup is counted so
+get_stats() can report hit rates overall and per function. Callers get a copy of the cached lists and dicts, so changing
+a result never changes what the next caller sees.
+
+Writes that bypass touch() (e.g. an sqlite3 shell) are not seen until clear(), or the next write to the same tables.
+
+Usage:
+- `@QueryCache.cached('Playlist_Table', 'Playlist_Song')` above a read function caches it by its arguments.
+- `QueryCache.touch('Playlist_Song')` in a write transaction invalidates every result read from that table, in every
+  process, once the transaction commits.
+- `QueryCache.get_stats()` reports hits, misses, stale results, evictions and the hit rate.
+
+Dependencies:
+- SQLite3 (for the connection that watches PRAGMA data_version)
+- ConnectionPool module (for bumping the versions in the write transaction)
+"""
+
+import functools, sqlite3, threading
+from collections import OrderedDict
+import ConnectionPool
+
+MAX_ENTRIES = 256  #Results kept across every cached function
+
+_lock = threading.Lock()
+_entries = OrderedDict()  #(function, args) -> (table versions, result)
+_max_entries = MAX_ENTRIES
+_stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0, 'version_reads': 0, 'bypassed': 0}
+_function_stats = {}
+
+#Connection that only reads Table_Version, its PRAGMA data_version moves whenever any other connection commits
+_watch = None
+_watch_path = None
+_data_version = None
+_versions = {}
+
+def _copy(value):
+    """Helper Function that copies the lists, tuples and dicts of a result so callers can't change the cached one"""
+    if isinstance(value, list):
+        return [_copy(item) for item in value] if value and isinstance(value[0], dict) else list(value)
+    if isinstance(value, tuple):
+        return tuple(_copy(item) for item in value)
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+def _close_watch():
+    """Helper Function that closes the watching connection, the next lookup opens a new one"""
+    global _watch, _watch_path, _data_version
+    if _watch is not None:
+        _watch.close()
+    _watch = _watch_path = _data_version = None
+
+def _current_versions():
+    """Helper Function (called with _lock held) that returns the committed table versions, or None without the table"""
+    global _watch, _watch_path, _data_version, _versions
+    path = ConnectionPool.get_pool().path
+    if _watch is None or _watch_path != path:
+        _close_watch()
+        _watch = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        _watch_path = path
+
+    #data_version is read before the counters, so a commit in between shows up as a change on the next lookup
+    data_version = _watch.execute('PRAGMA data_version').fetchone()[0]
+    if data_version != _data_version:
+        try:
+            _versions = dict(_watch.execute('SELECT Name, Version FROM Table_Version'))
+        except sqlite3.OperationalError:
+            return None  #Not migrated yet
+        _data_version = data_version
+        _stats['version_reads'] += 1
+    return _versions
+
+def touch(*tables):
+    """Function for the write paths, bumps the versions of tables in the current transaction so they change on commit"""
+    with ConnectionPool.connection(write=True) as conn:
+        conn.executemany('''
+        INSERT INTO Table_Version (Name, Version) VALUES (?, 1)
+        ON CONFLICT (Name) DO UPDATE SET Version = Version + 1
+        ''', [(table,) for table in tables])
+
+def cached(*tables):
+    """Decorator that memoizes a read function by its arguments until one of tables is written"""
+    def decorator(function):
+        name = f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            with _lock:
+                #Inside a write transaction the result may include rows that are never committed
+                current = None if ConnectionPool.in_transaction() else _current_versions()
+                if current is None:
+                    _stats['bypassed'] += 1
+                else:
+                    #Taken before reading, a write that commits meanwhile makes this result stale straight away
+                    versions = tuple(current.get(table, 0) for table in tables)
+                    counters = _function_stats.setdefault(name, {'hits': 0, 'misses': 0})
+                    entry = _entries.get(key)
+                    if entry is not None and entry[0] == versions:
+                        _entries.move_to_end(key)
+                        _stats['hits'] += 1
+                        counters['hits'] += 1
+                        return _copy(entry[1])
+                    _stats['misses'] += 1
+                    counters['misses'] += 1
+                    if entry is not None:
+                        _stats['stale'] += 1
+            if current is None:
+                return function(*args, **kwargs)
+
+            result = function(*args, **kwargs)
+            with _lock:
+                _entries[key] = (versions, result)
+                _entries.move_to_end(key)
+                while len(_entries) > _max_entries:
+                    _entries.popitem(last=False)
+                    _stats['evictions'] += 1
+            return _copy(result)
+
+        wrapper.uncached = function
+        return wrapper
+    return decorator
+
+def configure(max_entries=MAX_ENTRIES):
+    """Function to change how many results are kept"""
+    global _max_entries
+    with _lock:
+        _max_entries = max_entries
+        while len(_entries) > _max_entries:
+            _entries.popitem(last=False)
+            _stats['evictions'] += 1
+
+def clear():
+    """Function to drop every cached result, e.g. after switching to another database file"""
+    with _lock:
+        _entries.clear()
+        _close_watch()
+
+def get_stats():
+    """Function to report cache hits, misses and hit rates, overall and per function"""
+    with _lock:
+        stats = dict(_stats)
+        stats['entries'] = len(_entries)
+        stats['max_entries'] = _max_entries
+        stats['versions'] = dict(_versions)
+        functions = {name: dict(counters) for name, counters in _function_stats.items()}
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    for counters in functions.values():
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_rate'] = counters['hits'] / lookups if lookups else 0.0
+    stats['functions'] = functions
+    return stats
@@ -0,0 +1,114 @@
+"""
+Module: SearchController.py
+Author: Jacob       : Backend
+        Marlenne    : Frontend
+
+Description:
+This module keeps the Tkinter search boxes responsive while the user types. Instead of running a database query and
+rebuilding the song list on every keystroke, a SearchController waits for a short pause in typing (debounce), runs the
+query on a small shared worker pool, drops results that belong to an older search text, and hands the newest results
+back to the UI on the Tk thread through after(). Tk widgets are only ever touched from the Tk thread.
+
+Usage:
+- `SearchController(widget, query, on_results).attach(search_var)` wires a StringVar to a query function.
+- `query(text)` runs on a worker thread and must not touch Tk; `on_results(results)` runs on the Tk thread.
+- `when_done(widget, future, on_result, on_error)` delivers any other Future (e.g. an AsyncDatabase write) the same way.
+- `submit(function, *args)` runs other short reads (e.g. the next page of a song list) on the same worker pool.
+
+Dependencies:
+- Tkinter (for after() scheduling)
+- concurrent.futures (for the worker pool)
+- Instrumentation module (for the musicdb.SearchController logger)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import Instrumentation
+
+log = Instrumentation.get_logger(__name__)
+
+DEBOUNCE_MS = 250  #Pause in typing before a search starts
+POLL_MS = 15  #How often the Tk thread checks for a finished search
+
+#Shared by every search box, searches are short so two workers are plenty
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search")
+
+class SearchController:
+    """Class that debounces a search box and runs its query off the Tk thread"""
+
+    def __init__(self, widget, query, on_results, delay_ms=DEBOUNCE_MS):
+        self.widget = widget
+        self.query = query
+        self.on_results = on_results
+        self.delay_ms = delay_ms
+        self._generation = 0  #Bumped on every keystroke, older results are thrown away
+        self._after_id = None
+        self._future = None
+
+    def attach(self, string_var):
+        """Function to search whenever the StringVar changes"""
+        string_var.trace_add("write", lambda *args: self.schedule(string_var.get()))
+        return self
+
+    def schedule(self, text):
+        """Function to (re)start the debounce window for a new search text"""
+        self._generation += 1
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+        self._after_id = self.widget.after(self.delay_ms, self._start, text, self._generation)
+
+    def cancel(self):
+        """Function to stop any pending or running search, e.g. when the view is torn down"""
+        self._generation += 1
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+        if self._future is not None:
+            self._future.cancel()  #Only stops queries that have not started, running ones are ignored when they finish
+            self._future = None
+
+    def _start(self, text, generation):
+        """Helper Function that sends the query to the worker pool once typing has paused"""
+        self._after_id = None
+        if self._future is not None:
+            self._future.cancel()
+        self._future = _executor.submit(self.query, text)
+        self._poll(self._future, generation)
+
+    def _poll(self, future, generation):
+        """Helper Function that waits on the Tk thread for the query to finish"""
+        if generation != self._generation or not self.widget.winfo_exists():
+            return  #A newer search replaced this one, or the view is gone
+
+        if not future.done():
+            self.widget.after(POLL_MS, self._poll, future, generation)
+            return
+
+        self._future = None
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        if error is not None:
+            log.error("Search failed: %s", error)
+            return
+        self.on_results(future.result())
+
+def submit(function, *args, **kwargs):
+    """Function to run a short query on the shared worker pool, returns a Future"""
+    return _executor.submit(function, *args, **kwargs)
+
+def when_done(widget, future, on_result, on_error=None):
+    """Function to call on_result(result) or on_error(exception) on the Tk thread once a Future finishes"""
+    if not widget.winfo_exists():
+        return
+    if not future.done():
+        widget.after(POLL_MS, when_done, widget, future, on_result, on_error)
+        return
+
+    error = None if future.cancelled() else future.exception()
+    if error is None and not future.cancelled():
+        on_result(future.result())
+    elif error is not None and on_error is not None:
+        on_error(error)
+    elif error is not None:
+        log.error("Background task failed: %s", error)
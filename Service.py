@@ -0,0 +1,475 @@
+"""
+Module: Service.py
+Author: Jacob       : Backend
+
+Description:
+This module serves the music database over HTTP with JSON bodies, so one library can be used by many clients at once
+instead of only by the Tk window on the same machine. It is built on the standard library's http.server and calls the
+same backend functions the app uses (Database, Catalog, Metadata, AsyncDatabase).
+
+- Connections are kept alive (HTTP/1.1, every body is sent with its Content-Length) and served by a bounded pool of
+  worker threads. Connections beyond what the pool and its queue can hold get an immediate 503 instead of piling up.
+  While connections are waiting for a worker, a busy worker closes its keep-alive connection after the current response.
+- Catalog pages and search results carry an ETag made from the catalog change counter (Song_Change_Log). A client that
+  sends it back in If-None-Match gets a 304 without the page being read again, until a song is added, changed or
+  removed.
+- Songs are streamed with Range support and os.sendfile by the Streaming module, at most --max-streams at a time.
+- Playlist endpoints need a session token from /login, sent as "Authorization: Bearer <token>". Writes go through
+  AsyncDatabase's single writer thread, so concurrent edits from many clients are committed in batches.
+
+Endpoints:
+    POST   /login                          {"username", "password"} -> {"token"}
+    POST   /logout                         ends the session
+    GET    /songs?sort=title&limit=&cursor=  one catalog page, {"songs", "next_cursor"}
+    GET    /songs/<song>                   title, artist, duration and cached metadata of one song
+    GET    /search?q=&limit=&cursor=       one page of search results
+    GET    /playlists                      the user's playlists with track counts and durations
+    POST   /playlists                      {"name", "songs"} creates a playlist
+    GET    /playlists/<name>               the songs of a playlist
+    PUT    /playlists/<name>               {"songs"} replaces a playlist's songs
+    DELETE /playlists/<name>               removes a playlist
+    POST   /playlists/<name>/songs         {"song"} appends one song, {"songs"} appends several
+    DELETE /playlists/<name>/songs/<song>  takes a song out of a playlist
+    GET    /stream/<song>                  the song file, with Range support (HEAD gives just the headers)
+    GET    /health                         server, pool, cache and stream counters
+
+Usage:
+    python -m Service [--db song_database.db] [--host 127.0.0.1] [--port 8080] [--workers 16] [--max-pending 64]
+                      [--songs Songs] [--max-streams 8]
+- `make_server(host, port)` returns a server for use from Python.
+- The service does not scan the Songs folder itself, run `python -m CommandLine sync` to pick up new files.
+
+Dependencies:
+- http.server, concurrent.futures (for the HTTP server and its worker pool)
+- Database, AsyncDatabase, Catalog and Metadata modules (for everything the endpoints return)
+- Streaming module (for serving the song files)
+- QueryCache module (for its hit rate in /health)
+- Instrumentation module (for per-endpoint timings and the musicdb.Service logger)
+"""
+
+import argparse, base64, json, sqlite3, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+import AsyncDatabase
+import Catalog
+import ConnectionPool
+import Database
+import Instrumentation
+import Metadata
+import QueryCache
+import Streaming
+
+log = Instrumentation.get_logger(__name__)
+
+WORKERS = 16  #Requests handled at the same time
+MAX_PENDING = 64  #Connections allowed to wait for a worker, more than that are answered with 503
+KEEPALIVE_TIMEOUT = 5.0  #Seconds an idle keep-alive connection may hold a worker
+MAX_BODY = 8 * 1024 * 1024  #Largest request body accepted, in bytes
+MAX_PAGE = 1000  #Largest page a client can ask for
+RESPONDED = object()  #Returned by endpoints that wrote their own response
+
+class ApiError(Exception):
+    """Exception that becomes a JSON error response with the given status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def encode_cursor(cursor):
+    """Function to turn a page cursor (tuple or offset) into an opaque URL-safe string"""
+    if cursor is None:
+        return None
+    text = json.dumps(cursor, separators=(',', ':'))
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+def decode_cursor(text):
+    if not text:
+        return None
+    try:
+        value = json.loads(base64.urlsafe_b64decode(text + '=' * (-len(text) % 4)))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid cursor.")
+    return tuple(value) if isinstance(value, list) else value
+
+def _is_integer(value):
+    #JSON true/false come back as bools, which are ints to Python; SQLite only takes 64 bit integers
+    return isinstance(value, int) and not isinstance(value, bool) and -2**63 <= value < 2**63
+
+def _page_cursor(query, sort):
+    """Helper Function that decodes a catalog page cursor, the sort order's text keys followed by the song's index"""
+    cursor = decode_cursor(query.get('cursor'))
+    if cursor is None:
+        return None
+    keys = len(Database.SORT_ORDERS[sort]) - 1
+    if (not isinstance(cursor, tuple) or len(cursor) != keys + 1
+            or not all(isinstance(key, str) for key in cursor[:-1]) or not _is_integer(cursor[-1])):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid cursor.")
+    return cursor
+
+def _search_cursor(query):
+    """Helper Function that decodes a search cursor, the number of results already shown"""
+    cursor = decode_cursor(query.get('cursor'))
+    if cursor is not None and not (_is_integer(cursor) and cursor >= 0):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid cursor.")
+    return cursor
+
+def _limit(query):
+    try:
+        limit = int(query.get('limit', Database.PAGE_SIZE))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "limit must be a number.")
+    return max(1, min(limit, MAX_PAGE))
+
+def _field(body, key, kind, default=None):
+    """Helper Function that reads a request body field, raises a 400 if it isn't of the expected JSON type"""
+    value = body.get(key, default)
+    if value is not None and not isinstance(value, kind):
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{key} must be a {'string' if kind is str else 'list'}.")
+    return value
+
+def _song_list(body, default=None):
+    """Helper Function that reads the songs field of a request body, a list of song names"""
+    songs = body.get('songs', default)
+    if not isinstance(songs, list) or not all(isinstance(song, str) for song in songs):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "songs must be a list of song names.")
+    return songs
+
+def _write(name, *args):
+    """Helper Function that runs a Database write on the AsyncDatabase writer thread and waits for it"""
+    return AsyncDatabase.get_instance().call(name, *args).result()
+
+def _result(result, missing_status=HTTPStatus.NOT_FOUND):
+    """Helper Function that turns a (success, message) result into a response body or an ApiError"""
+    success, message = result
+    if not success:
+        raise ApiError(missing_status, message)
+    return {'message': message}
+
+#Endpoints, each takes (handler, query, body, *path parts) and returns a JSON-able body
+def login(handler, query, body):
+    username = _field(body, 'username', str)
+    success, message, token = Database.authenticate(username, _field(body, 'password', str))
+    if not success:
+        raise ApiError(HTTPStatus.UNAUTHORIZED, message)
+    return {'token': token, 'username': username}
+
+def logout(handler, query, body):
+    Database.end_session(handler.token)
+    return {'message': "Logged out."}
+
+def songs_page(handler, query, body):
+    sort = query.get('sort', 'title')
+    if sort not in Database.SORT_ORDERS:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"sort must be one of {', '.join(Database.SORT_ORDERS)}.")
+    songs, cursor = Database.get_songs_page(sort, _page_cursor(query, sort), _limit(query))
+    return {'songs': songs, 'next_cursor': encode_cursor(cursor)}
+
+def search(handler, query, body):
+    text = query.get('q', '').strip()
+    if not text:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "q is required.")
+    songs, cursor = Database.search_songs_page(text, _search_cursor(query), _limit(query))
+    return {'query': text, 'songs': songs, 'next_cursor': encode_cursor(cursor)}
+
+def song_details(handler, query, body, song):
+    #The name came from the URL, only look at files inside the Songs folder
+    if Streaming.resolve_song_path(song, handler.server.songs_folder) is None:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Song '{song}' not found.")
+    metadata = Metadata.get_song_metadata(song, handler.server.songs_folder)
+    if metadata is None:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Song '{song}' not found.")
+    title, artist, duration = Database.get_song_details(song)
+    return {'song': song, 'title': title, 'artist': artist, 'duration': duration, 'metadata': metadata}
+
+def list_playlists(handler, query, body):
+    summaries, _ = Database.get_playlist_summaries(handler.username)
+    return {'playlists': summaries or []}
+
+def create_playlist(handler, query, body):
+    name = _field(body, 'name', str)
+    if not name:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "name is required.")
+    songs = _song_list(body, [])
+    try:
+        return _result(_write('create_playlist', handler.username, name, songs))
+    except sqlite3.IntegrityError:
+        raise ApiError(HTTPStatus.CONFLICT, f"Playlist '{name}' already exists.")
+
+def get_playlist(handler, query, body, name):
+    songs, error = Database.get_playlist(name, handler.username)
+    if error:
+        raise ApiError(HTTPStatus.NOT_FOUND, error)
+    return {'name': name, 'songs': songs}
+
+def replace_playlist(handler, query, body, name):
+    _write('replace_playlist_songs', handler.username, name, _song_list(body))
+    return {'message': f"Playlist '{name}' saved."}
+
+def remove_playlist(handler, query, body, name):
+    return _result(_write('remove_playlist', handler.username, name))
+
+def add_playlist_songs(handler, query, body, name):
+    if 'song' in body:
+        song = _field(body, 'song', str)
+        if song is None:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "song must be a string.")
+        return _result(_write('append_song_to_playlist', handler.username, name, song), HTTPStatus.CONFLICT)
+    songs = _song_list(body, [])
+    _, error = Database.get_playlist(name, handler.username)
+    if error:
+        raise ApiError(HTTPStatus.NOT_FOUND, error)
+    _write('add_songs_to_playlist', handler.username, name, songs)
+    return {'message': f"Songs added to '{name}'."}
+
+def remove_playlist_song(handler, query, body, name, song):
+    return _result(_write('remove_song_from_playlist', handler.username, name, song))
+
+def stream_song(handler, query, body, song):
+    try:
+        status = Streaming.serve(handler, song, handler.server.songs_folder, head=handler.command == 'HEAD')
+    except Streaming.StreamError as e:
+        raise ApiError(e.status, e.message)
+    handler.server.count('responses_' + str(status // 100) + 'xx')
+    return RESPONDED
+
+def health(handler, query, body):
+    server = handler.server
+    return {'status': "ok", 'server': dict(server.get_stats(), workers=server.workers, queued=server.queued),
+            'pool': ConnectionPool.get_stats(), 'async_database': AsyncDatabase.get_instance().get_stats(),
+            'catalog_version': Catalog.change_counter(), 'query_cache': QueryCache.get_stats(),
+            'streaming': Streaming.get_stats()['totals']}
+
+#(method, path pattern, endpoint, needs a session, catalog ETag), "*" matches one path segment
+ROUTES = [
+    ('POST', ('login',), login, False, False),
+    ('POST', ('logout',), logout, True, False),
+    ('GET', ('songs',), songs_page, False, True),
+    ('GET', ('songs', '*'), song_details, False, False),
+    ('GET', ('search',), search, False, True),
+    ('GET', ('playlists',), list_playlists, True, False),
+    ('POST', ('playlists',), create_playlist, True, False),
+    ('GET', ('playlists', '*'), get_playlist, True, False),
+    ('PUT', ('playlists', '*'), replace_playlist, True, False),
+    ('DELETE', ('playlists', '*'), remove_playlist, True, False),
+    ('POST', ('playlists', '*', 'songs'), add_playlist_songs, True, False),
+    ('DELETE', ('playlists', '*', 'songs', '*'), remove_playlist_song, True, False),
+    ('GET', ('stream', '*'), stream_song, False, False),
+    ('HEAD', ('stream', '*'), stream_song, False, False),
+    ('GET', ('health',), health, False, False),
+]
+
+def match_route(method, parts):
+    """Function to find the route for a request, returns (route, path arguments) or raises ApiError"""
+    allowed = False
+    for route in ROUTES:
+        pattern = route[1]
+        if len(pattern) == len(parts) and all(p == '*' or p == part for p, part in zip(pattern, parts)):
+            if route[0] == method:
+                return route, [part for p, part in zip(pattern, parts) if p == '*']
+            allowed = True
+    if allowed:
+        raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not supported here.")
+    raise ApiError(HTTPStatus.NOT_FOUND, "No such endpoint.")
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Class that answers one connection's requests, kept alive between requests"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "MusicDB/1.0"
+    timeout = KEEPALIVE_TIMEOUT
+    disable_nagle_algorithm = True  #Headers and body are separate writes, Nagle would hold the body back ~40 ms
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def do_HEAD(self):
+        self._handle('HEAD')
+
+    def log_message(self, format, *args):
+        log.debug("%s %s", self.address_string(), format % args)
+
+    def _read_body(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True  #Without a length the body can't be told apart from the next request
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Content-Length must be a number.")
+        if length > MAX_BODY:
+            self.close_connection = True  #The unread body would be taken for the next request
+            raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body is too large.")
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Request body is not valid JSON.")
+        if not isinstance(body, dict):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object.")
+        return body
+
+    def _authorize(self):
+        header = self.headers.get('Authorization', '')
+        self.token = header[len('Bearer '):].strip() if header.startswith('Bearer ') else None
+        self.username = Database.check_session(self.token) if self.token else None
+        if self.username is None:
+            raise ApiError(HTTPStatus.UNAUTHORIZED, "Log in first, then send the token as 'Authorization: Bearer ...'.")
+
+    def _handle(self, method):
+        started = time.perf_counter()
+        self.server.count('requests')
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/') if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        name = method + ' /' + '/'.join(parts[:1])
+        etag = None
+        try:
+            body = self._read_body()
+            route, arguments = match_route(method, parts)
+            name = f"{method} /{'/'.join(route[1])}"
+            if route[3]:
+                self._authorize()
+            if route[4]:
+                #The page can only change when the catalog does, so the change counter identifies it
+                etag = f'"catalog-{Catalog.change_counter()}"'
+                if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+                    self.server.count('not_modified')
+                    self._send(HTTPStatus.NOT_MODIFIED, None, etag)
+                    return
+            status, response = HTTPStatus.OK, route[2](self, query, body, *arguments)
+        except ApiError as e:
+            status, response, etag = e.status, {'error': e.message}, None
+        except Exception as e:
+            log.exception("%s %s failed", method, self.path)
+            status, response, etag = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)}, None
+        finally:
+            if Instrumentation.is_enabled():
+                Instrumentation.record('function', f"Service.{name}", time.perf_counter() - started)
+        if response is not RESPONDED:
+            self._send(status, response, etag)
+
+    def _send(self, status, response, etag=None):
+        """Helper Function that writes a JSON response, keeping the connection open unless others are waiting"""
+        if self.server.queued:
+            self.close_connection = True  #Hand this worker to a waiting connection
+        payload = b'' if response is None else json.dumps(response).encode()
+        self.send_response(status)
+        if response is not None:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(payload)
+        self.server.count('responses_' + str(status // 100) + 'xx')
+
+BUSY_BODY = b'{"error": "Server is busy, try again."}'
+BUSY_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\n'
+                 b'Content-Length: %d\r\nConnection: close\r\nRetry-After: 1\r\n\r\n' % len(BUSY_BODY)) + BUSY_BODY
+
+class ServiceServer(HTTPServer):
+    """Class for an HTTP server that hands connections to a bounded worker pool instead of one thread each"""
+
+    daemon_threads = True
+    request_queue_size = 128  #listen() backlog, the default of 5 drops connection attempts under load
+
+    def __init__(self, address, workers=WORKERS, max_pending=MAX_PENDING, songs_folder="Songs"):
+        self.workers = workers
+        self.songs_folder = songs_folder
+        self.queued = 0  #Connections accepted but not yet picked up by a worker
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="service")
+        self._queue_lock = threading.Lock()
+        self._stats_lock = threading.Lock()  #Counters are bumped from every worker thread
+        self.stats = {'connections': 0, 'rejected': 0, 'requests': 0, 'not_modified': 0,
+                      'responses_2xx': 0, 'responses_3xx': 0, 'responses_4xx': 0, 'responses_5xx': 0}
+        super().__init__(address, ServiceHandler)
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            self.count('rejected')
+            try:
+                request.sendall(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.count('connections')
+        with self._queue_lock:
+            self.queued += 1
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        with self._queue_lock:
+            self.queued -= 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
+def make_server(host="127.0.0.1", port=8080, workers=WORKERS, max_pending=MAX_PENDING, songs_folder="Songs"):
+    """Function to create (but not start) a service bound to host:port, port 0 picks a free port"""
+    return ServiceServer((host, port), workers, max_pending, songs_folder)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m Service", description="Serve the music database over HTTP.")
+    parser.add_argument("--db", default=ConnectionPool.DATABASE_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="0 picks a free port")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING)
+    parser.add_argument("--songs", default="Songs", help="folder the song files are streamed from")
+    parser.add_argument("--max-streams", type=int, default=Streaming.MAX_STREAMS,
+                        help="song transfers at once, keep it below --workers so the API stays responsive")
+    parser.add_argument("--log-level", default=None, help="DEBUG, INFO (default), WARNING or ERROR")
+    args = parser.parse_args(argv)
+
+    Instrumentation.configure_logging(args.log_level)
+    #Every worker may hold a connection, plus the writer thread
+    Database.init(args.db, pool_size=args.workers + 1)
+    Streaming.configure(max_streams=args.max_streams)
+    server = make_server(args.host, args.port, args.workers, args.max_pending, args.songs)
+    host, port = server.server_address[:2]
+    print(f"Serving on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        AsyncDatabase.get_instance().close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
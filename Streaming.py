@@ -0,0 +1,322 @@
+"""
+Module: Streaming.py
+Author: Jacob       : Backend
+
+Description:
+This module streams song files from the Songs directory over HTTP, so listeners on other machines can play the library
+through the service mode (Service.py: GET /stream/<song>) instead of only through pygame on this one.
+
+- HTTP Range requests are supported ("bytes=start-end", "bytes=start-" and "bytes=-suffix"), so players can seek and
+  resume. Responses carry an ETag and Last-Modified built from the file's inode, size and mtime; If-None-Match gives a
+  304 and If-Range falls back to the whole file when the file changed.
+- File data is sent with os.sendfile, which copies straight from the page cache to the socket without passing through
+  Python. Where sendfile is not available the range is read and sent in chunks instead.
+- Open file descriptors are kept in a small LRU cache shared by all streams, so popular songs are not re-opened for
+  every range request. A file that was replaced on disk (different inode, size or mtime) gets a fresh descriptor; the old one
+  is closed when the last stream using it finishes.
+- At most MAX_STREAMS transfers run at once, more get a 503. Every stream's bytes, time and throughput are recorded, and
+  get_stats() reports the totals, the streams running now and the most recent finished ones.
+
+Usage:
+- `Streaming.serve(handler, song)` answers a GET (or HEAD, head=True) from a BaseHTTPRequestHandler.
+- `Streaming.configure(max_streams=..., max_open_files=...)` changes the limits, `get_stats()` reports throughput.
+
+Dependencies:
+- os, select (for sendfile and waiting on slow sockets)
+- LibrarySync module (for the Songs folder location)
+- Metadata module (for telling plain song file names from paths)
+- Instrumentation module (for the musicdb.Streaming logger)
+"""
+
+import collections, itertools, mimetypes, os, select, threading, time
+from email.utils import formatdate
+from http import HTTPStatus
+import Instrumentation
+import LibrarySync
+import Metadata
+
+log = Instrumentation.get_logger(__name__)
+
+MAX_STREAMS = 8  #Transfers at once, each holds a service worker while it sends
+MAX_OPEN_FILES = 64  #Descriptors kept open by the file cache
+SEND_CHUNK = 1024 * 1024  #Bytes per sendfile call
+SEND_TIMEOUT = 30.0  #Seconds a stalled listener may keep a stream open
+STREAM_HISTORY = 100  #Finished streams kept for get_stats()
+
+class StreamError(Exception):
+    """Exception for a stream that could not be started, with the HTTP status to answer"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class RangeNotSatisfiable(Exception):
+    """Exception for a Range header that lies outside the file"""
+
+class OpenFile:
+    """Class for a cached file descriptor and the file version it was opened for"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        stat = os.fstat(self.fd)
+        self.version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.etag = '"%x-%x-%x"' % self.version
+        self.users = 0
+        self.retired = False  #Set once the cache dropped it, closed by the last user
+
+class FileCache:
+    """Class that keeps the most recently streamed files open, safe to share between threads"""
+
+    def __init__(self, max_open=MAX_OPEN_FILES):
+        self.max_open = max_open
+        self._files = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'stale': 0}
+
+    def acquire(self, path):
+        """Function to get an open file for path, the caller must release() it"""
+        stat = os.stat(path)  #Cheap next to an open, and tells us if the file was replaced
+        version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is not None and cached.version == version:
+                self._files.move_to_end(path)
+                cached.users += 1
+                self.stats['hits'] += 1
+                return cached
+            if cached is not None:
+                self.stats['stale'] += 1
+                self._retire(self._files.pop(path))
+
+        opened = OpenFile(path)
+        with self._lock:
+            self.stats['misses'] += 1
+            cached = self._files.get(path)
+            if cached is not None and cached.version == opened.version:
+                #Another stream opened it meanwhile, use that one
+                os.close(opened.fd)
+                cached.users += 1
+                self._files.move_to_end(path)
+                return cached
+            if cached is not None:
+                self._retire(self._files.pop(path))
+            opened.users = 1
+            self._files[path] = opened
+            self._evict()
+            return opened
+
+    def release(self, opened):
+        with self._lock:
+            opened.users -= 1
+            if opened.retired and opened.users == 0:
+                os.close(opened.fd)
+
+    def _retire(self, opened):
+        opened.retired = True
+        if opened.users == 0:
+            os.close(opened.fd)
+
+    def _evict(self):
+        """Helper Function that drops the least recently used files beyond max_open"""
+        while len(self._files) > self.max_open:
+            _, opened = self._files.popitem(last=False)
+            self._retire(opened)
+            self.stats['evictions'] += 1
+
+    def close(self):
+        with self._lock:
+            while self._files:
+                self._retire(self._files.popitem()[1])
+
+    def __len__(self):
+        return len(self._files)
+
+def parse_range(header, size):
+    """Function to turn a Range header into (start, end) with end inclusive, None to send the whole file"""
+    if not header or not header.startswith('bytes='):
+        return None
+    specs = header[len('bytes='):].split(',')
+    if len(specs) != 1:
+        return None  #Multiple ranges are allowed to be answered with the whole file
+    start, _, end = specs[0].strip().partition('-')
+    try:
+        if not start:
+            #"bytes=-500" is the last 500 bytes
+            length = int(end)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None  #A malformed Range is ignored
+    if start >= size or end < start:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+def resolve_song_path(song, songs_folder=LibrarySync.SONGS_FOLDER):
+    """Function to get the path of a song file, None for names that would leave the Songs folder"""
+    if not Metadata.is_plain_file_name(song):
+        return None
+    path = os.path.join(songs_folder, song)
+    return path if os.path.isfile(path) else None
+
+def _sendfile(sock, opened, offset, count):
+    """Helper Function that sends count bytes of a file from offset with os.sendfile, returns the bytes sent"""
+    sent_total = 0
+    sock_fd = sock.fileno()
+    while count > 0:
+        try:
+            sent = os.sendfile(sock_fd, opened.fd, offset, min(count, SEND_CHUNK))
+        except BlockingIOError:
+            #Sockets with a timeout are non-blocking underneath, wait until the listener takes more
+            if not select.select([], [sock_fd], [], SEND_TIMEOUT)[1]:
+                raise TimeoutError("Listener stopped reading.")
+            continue
+        if sent == 0:
+            break  #The file got shorter since it was opened
+        offset += sent
+        count -= sent
+        sent_total += sent
+    return sent_total
+
+def _copy_range(sock, opened, offset, count):
+    """Helper Function for systems without os.sendfile, reads and sends the range in chunks"""
+    sent_total = 0
+    with open(opened.path, 'rb') as handle:  #Its own file position, the shared descriptor is left alone
+        handle.seek(offset)
+        while count > 0:
+            chunk = handle.read(min(count, SEND_CHUNK))
+            if not chunk:
+                break
+            sock.sendall(chunk)
+            count -= len(chunk)
+            sent_total += len(chunk)
+    return sent_total
+
+send_range = _sendfile if hasattr(os, 'sendfile') else _copy_range
+
+#Shared state for every stream
+_files = FileCache()
+_slots = threading.BoundedSemaphore(MAX_STREAMS)
+_max_streams = MAX_STREAMS
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_active = {}
+_history = collections.deque(maxlen=STREAM_HISTORY)
+_totals = {'streams': 0, 'completed': 0, 'aborted': 0, 'rejected': 0, 'not_modified': 0, 'bytes_sent': 0,
+           'seconds': 0.0}
+
+def configure(max_streams=None, max_open_files=None):
+    """Function to change the concurrent stream limit and the number of cached file descriptors"""
+    global _slots, _max_streams, _files
+    if max_streams is not None:
+        _slots = threading.BoundedSemaphore(max_streams)
+        _max_streams = max_streams
+    if max_open_files is not None:
+        old_files, _files = _files, FileCache(max_open_files)
+        old_files.close()
+
+def _send_headers(handler, status, headers):
+    handler.send_response(status)
+    for name, value in headers:
+        handler.send_header(name, value)
+    handler.end_headers()
+
+def serve(handler, song, songs_folder=LibrarySync.SONGS_FOLDER, head=False):
+    """Function to answer a stream request on handler, returns the HTTP status sent or raises StreamError"""
+    path = resolve_song_path(song, songs_folder)
+    if path is None:
+        raise StreamError(HTTPStatus.NOT_FOUND, f"Song '{song}' not found.")
+
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        with _lock:
+            _totals['rejected'] += 1
+        raise StreamError(HTTPStatus.SERVICE_UNAVAILABLE, "Too many streams, try again shortly.")
+    files = _files
+    try:
+        try:
+            opened = files.acquire(path)
+        except FileNotFoundError:
+            raise StreamError(HTTPStatus.NOT_FOUND, f"Song '{song}' not found.")
+        try:
+            return _serve_file(handler, song, opened, head)
+        finally:
+            files.release(opened)
+    finally:
+        slots.release()
+
+def _serve_file(handler, song, opened, head):
+    headers = [('ETag', opened.etag), ('Last-Modified', formatdate(opened.mtime, usegmt=True)),
+               ('Accept-Ranges', 'bytes')]
+    if opened.etag in [tag.strip() for tag in handler.headers.get('If-None-Match', '').split(',')]:
+        with _lock:
+            _totals['not_modified'] += 1
+        _send_headers(handler, HTTPStatus.NOT_MODIFIED, headers)
+        return HTTPStatus.NOT_MODIFIED
+
+    #If-Range: only honour the Range if the listener still has this version of the file
+    if_range = handler.headers.get('If-Range')
+    try:
+        byte_range = parse_range(handler.headers.get('Range'), opened.size) \
+            if not if_range or if_range == opened.etag else None
+    except RangeNotSatisfiable:
+        _send_headers(handler, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE,
+                      headers + [('Content-Range', f'bytes */{opened.size}'), ('Content-Length', '0')])
+        return HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+
+    start, end = byte_range or (0, opened.size - 1)
+    length = max(0, end - start + 1)
+    status = HTTPStatus.PARTIAL_CONTENT if byte_range else HTTPStatus.OK
+    headers.append(('Content-Type', mimetypes.guess_type(song)[0] or 'application/octet-stream'))
+    headers.append(('Content-Length', str(length)))
+    if byte_range:
+        headers.append(('Content-Range', f'bytes {start}-{end}/{opened.size}'))
+    _send_headers(handler, status, headers)
+    if head or not length:
+        return status
+
+    stream_id = next(_ids)
+    record = {'id': stream_id, 'song': song, 'client': handler.client_address[0], 'range': [start, end],
+              'bytes': 0, 'started': time.time()}
+    with _lock:
+        _active[stream_id] = record
+        _totals['streams'] += 1
+    started = time.perf_counter()
+    completed = False
+    try:
+        record['bytes'] = send_range(handler.connection, opened, start, length)
+        completed = record['bytes'] == length
+    except (OSError, TimeoutError) as e:
+        log.debug("Stream of %s to %s ended early: %s", song, record['client'], e)
+    finally:
+        seconds = time.perf_counter() - started
+        record['seconds'] = seconds
+        record['mbit_per_second'] = record['bytes'] * 8 / seconds / 1e6 if seconds > 0 else None
+        record['completed'] = completed
+        with _lock:
+            del _active[stream_id]
+            _history.append(record)
+            _totals['completed' if completed else 'aborted'] += 1
+            _totals['bytes_sent'] += record['bytes']
+            _totals['seconds'] += seconds
+    if not completed:
+        handler.close_connection = True  #The response is cut short, the connection can't be reused
+    return status
+
+def get_stats():
+    """Function to report stream totals, the streams running now and the recently finished ones"""
+    with _lock:
+        totals = dict(_totals)
+        active = [dict(record, seconds=time.time() - record['started']) for record in _active.values()]
+        recent = list(_history)
+    totals['mbit_per_second'] = totals['bytes_sent'] * 8 / totals['seconds'] / 1e6 if totals['seconds'] else None
+    totals['max_streams'] = _max_streams
+    totals['open_files'] = len(_files)
+    totals['file_cache'] = dict(_files.stats)
+    return {'totals': totals, 'active': active, 'recent': recent}
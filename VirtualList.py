@@ -0,0 +1,213 @@
+"""
+Module: VirtualList.py
+Author: Jacob       : Backend
+        Marlenne    : Frontend
+
+Description:
+This module provides a scrollable song list that stays fast with tens of thousands of songs. Instead of creating one
+Button or Checkbutton per song, a VirtualList only creates enough row widgets to fill the visible part of its canvas and
+moves/relabels them as the user scrolls. For checkbox lists the checked songs are kept in a plain Python set, so
+filtering or scrolling never loses a selection and no Tk variable is created per song.
+
+A list can also be fed page by page: given a page loader it only fetches the first page, and asks for the next one on a
+worker thread when the user scrolls close to the end of what has been loaded, so a huge library never has to be read
+into memory just to show its first screen.
+
+Usage:
+- `VirtualList(parent, on_click=callback)` shows a list of buttons, `callback(song)` runs when one is clicked.
+- `VirtualList(parent, checkboxes=True)` shows checkboxes, the checked songs are in `view.selected`. With
+  `on_toggle=callback`, `callback(song, checked)` runs for every click, e.g. to record edits in a PlaylistEditSession.
+- `view.set_items(songs)` replaces the rows that are shown.
+- `view.set_pages(load_page)` shows pages from `load_page(cursor) -> (songs, next_cursor)`, e.g. Database.get_songs_page.
+- `view.remove_items(songs)` and `view.insert_items(songs, key)` update the list in place, e.g. after a library change.
+
+Dependencies:
+- Tkinter (for GUI)
+- SearchController module (for loading pages on the worker pool)
+- Instrumentation module (for the musicdb.VirtualList logger)
+"""
+
+import bisect
+import tkinter as tk
+from tkinter import RIGHT, VERTICAL, Y
+import Instrumentation
+import SearchController
+
+log = Instrumentation.get_logger(__name__)
+
+class VirtualList(tk.Frame):
+    """Class that draws only the visible rows of a long list and recycles them while scrolling"""
+
+    def __init__(self, master, on_click=None, checkboxes=False, font=("Arial", 16), row_height=None,
+                 width=900, height=800, empty_text="No songs found.", wraplength=None, on_toggle=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.on_click = on_click
+        self.on_toggle = on_toggle
+        self.checkboxes = checkboxes
+        self.font = font
+        self.row_height = row_height or font[1] * 2 + 8
+        self.empty_text = empty_text
+        self.wraplength = wraplength
+        self.items = []
+        self.selected = set()  #Checked songs, kept outside of Tk
+        self._rows = []  #Recycled (widget, canvas window id, IntVar or None) tuples
+
+        #Paged mode, see set_pages()
+        self._load_page = None
+        self._cursor = None
+        self._loading = False
+        self._generation = 0  #Bumped whenever the list is replaced, so late pages are dropped
+
+        self.canvas = tk.Canvas(self, width=width, height=height, highlightthickness=0)
+        self.scroll_bar = tk.Scrollbar(self, orient=VERTICAL, command=self.canvas.yview)
+        self.scroll_bar.pack(side=RIGHT, fill=Y)
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.canvas.configure(yscrollcommand=self._on_scroll)
+        self.canvas.bind('<Configure>', lambda e: self._render())
+        self._bind_wheel(self.canvas)
+
+        self._empty_label = self.canvas.create_text(10, 10, anchor="nw", text="", font=font)
+
+    def set_items(self, items):
+        """Function to replace the listed songs and scroll back to the top"""
+        self._generation += 1
+        self._load_page = None
+        self._loading = False
+        self.items = list(items)
+        self._show_items()
+        self.canvas.yview_moveto(0)
+        self._render()
+
+    def set_pages(self, load_page, first_page=None):
+        """Function to list songs a page at a time, first_page is (songs, cursor) if it was already fetched"""
+        songs, cursor = first_page or ([], None)
+        self.set_items(songs)
+        if first_page is None or cursor is not None:  #Otherwise everything fit on the first page
+            self._load_page = load_page
+            self._cursor = cursor
+        self._show_items()
+        if first_page is None:
+            self._request_page()
+        else:
+            self._render()
+
+    def remove_items(self, items):
+        """Function to drop songs from the list (and the selection) without reloading it"""
+        gone = set(items)
+        self.items = [item for item in self.items if item not in gone]
+        self.selected -= gone
+        self._show_items()
+        self._render()
+
+    def insert_items(self, items, key=None):
+        """Function to add songs where they belong in a list sorted by key, key=None adds them at the end. For pages
+        from the database key must sort exactly like the query does, e.g. Database.song_sort_key(sort)"""
+        present = set(self.items)
+        keys = [key(item) for item in self.items] if key else None
+        for item in sorted(items, key=key):
+            if item in present:
+                continue
+            if key is None or not self.items:
+                #Only once every page is loaded, otherwise a later page brings the song
+                if self._load_page is None:
+                    self.items.append(item)
+                continue
+            item_key = key(item)
+            if self._load_page is not None and item_key > keys[-1]:
+                continue  #Past the loaded pages, it will arrive with a later page
+            position = bisect.bisect_right(keys, item_key)
+            keys.insert(position, item_key)
+            self.items.insert(position, item)
+        self._show_items()
+        self._render()
+
+    def _show_items(self):
+        """Helper Function that sizes the scroll region to the loaded songs"""
+        self.canvas.configure(scrollregion=(0, 0, 0, len(self.items) * self.row_height))
+        empty = self.empty_text if self._load_page is None else ""  #Still loading
+        self.canvas.itemconfigure(self._empty_label, text="" if self.items else empty)
+
+    def _request_page(self):
+        """Helper Function that fetches the next page on the worker pool"""
+        if self._load_page is None or self._loading:
+            return
+        self._loading = True
+        generation = self._generation
+        future = SearchController.submit(self._load_page, self._cursor)
+        SearchController.when_done(self, future, lambda page: self._add_page(page, generation),
+                                   lambda error: self._add_page(None, generation, error))
+
+    def _add_page(self, page, generation, error=None):
+        if generation != self._generation:
+            return  #The list was replaced while this page loaded
+        self._loading = False
+        if error is not None:
+            log.error("Could not load more songs: %s", error)
+            self._load_page = None  #Stop here rather than retrying on every scroll
+            self._show_items()
+            return
+        songs, self._cursor = page
+        self.items.extend(songs)
+        if self._cursor is None:
+            self._load_page = None  #Reached the end
+        self._show_items()
+        self._render()
+
+    def _on_scroll(self, first, last):
+        """Helper Function that keeps the scrollbar in step and redraws the rows in view"""
+        self.scroll_bar.set(first, last)
+        self._render()
+
+    def _bind_wheel(self, widget):
+        widget.bind('<MouseWheel>', lambda e: self.canvas.yview_scroll(int(-e.delta / 120) or (-1 if e.delta > 0 else 1), "units"))
+        widget.bind('<Button-4>', lambda e: self.canvas.yview_scroll(-1, "units"))
+        widget.bind('<Button-5>', lambda e: self.canvas.yview_scroll(1, "units"))
+
+    def _make_row(self):
+        """Helper Function that creates one reusable row widget"""
+        var = None
+        if self.checkboxes:
+            var = tk.IntVar()
+            widget = tk.Checkbutton(self.canvas, variable=var, font=self.font, anchor="w", justify="left",
+                                    wraplength=self.wraplength or 0)
+        else:
+            widget = tk.Button(self.canvas, font=self.font)
+        self._bind_wheel(widget)
+        window_id = self.canvas.create_window(0, 0, window=widget, anchor="nw", state="hidden")
+        self._rows.append((widget, window_id, var))
+
+    def _render(self):
+        """Helper Function that points the recycled rows at the items currently in view"""
+        top = self.canvas.canvasy(0)
+        visible = int(max(self.canvas.winfo_height(), int(self.canvas['height'])) // self.row_height) + 2
+        first = max(0, int(top // self.row_height))
+
+        while len(self._rows) < visible:
+            self._make_row()
+
+        #Fetch the next page before the user reaches the end of the loaded songs
+        if self._load_page is not None and first + visible * 2 >= len(self.items):
+            self._request_page()
+
+        for slot, (widget, window_id, var) in enumerate(self._rows):
+            index = first + slot
+            if index >= len(self.items) or slot >= visible:
+                self.canvas.itemconfigure(window_id, state="hidden")
+                continue
+
+            item = self.items[index]
+            self.canvas.coords(window_id, 0, index * self.row_height)
+            self.canvas.itemconfigure(window_id, state="normal")
+            if var is not None:
+                var.set(item in self.selected)
+                widget.configure(text=item, command=lambda s=item, v=var: self._toggle(s, v))
+            else:
+                widget.configure(text=item, command=lambda s=item: self.on_click and self.on_click(s))
+
+    def _toggle(self, item, var):
+        if var.get():
+            self.selected.add(item)
+        else:
+            self.selected.discard(item)
+        if self.on_toggle:
+            self.on_toggle(item, bool(var.get()))
@@ -0,0 +1,228 @@
+"""
+Module: benchmarks/bench_database.py
+Author: Jacob       : Backend
+
+Description:
+Benchmark harness for the Database module at realistic library sizes. For every requested size it builds a synthetic
+library in a scratch directory: a Songs folder of "Title, Artist.mp3" files (the naming get_song_details expects, each a
+hard link to one tiny valid MP3 so a million tracks cost almost no disk) and a fresh database. It then times the calls
+the app makes, in the order the app makes them:
+
+- load_songs_to_database (first sync of the whole folder, then a re-sync with nothing changed)
+- add_songs_to_playlist (users with many large playlists are created this way)
+- get_all_songs (the query, and again answered from QueryCache), get_playlist, replace_playlist_songs and search_songs
+- get_songs_page for every sort order, and the time to the first song from iter_songs
+
+Names are generated from a fixed seed, so the same arguments always build the same library. Results are written as
+JSON together with the git commit they were measured on, and --compare reads an earlier results file and flags every
+operation that got slower than the threshold (exit code 1), so regressions can be caught between commits.
+
+Usage:
+    python benchmarks/bench_database.py                              1k and 100k tracks
+    python benchmarks/bench_database.py --sizes 1k,100k,1m --output after.json
+    python benchmarks/bench_database.py --output after.json --compare before.json --threshold 1.25
+
+Dependencies:
+- Database module (the code being measured), mutagen (read during the sync)
+- git (only to record which commit was measured)
+"""
+
+import argparse, contextlib, json, os, platform, random, sqlite3, statistics, subprocess, sys, tempfile, time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+import Auth
+import ConnectionPool
+import Database
+
+#Two silent MPEG frames, the smallest file mutagen reads a duration from
+MP3_FRAMES = (b'\xff\xfb\x90\x64' + b'\x00' * 413) * 2
+
+WORDS = (
+    "love night heart fire rain blue gold dream light city summer river wild moon star lost home road ocean dance "
+    "shadow silver paper glass electric golden midnight echo stone sweet broken young forever early velvet neon "
+    "honey thunder winter garden falling running secret highway little crazy"
+).split()
+SEARCH_QUERIES = ("love", "mid", "the night", "silver moon", "zzz")
+PAGES_WALKED = 5  #Catalog pages timed per sort order and repeat
+
+def parse_size(text):
+    """Helper Function that turns "1k", "100k" or "1m" into a number of tracks"""
+    text = text.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(text[-1], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+def song_names(tracks, seed):
+    """Function to generate `tracks` unique "Title, Artist.mp3" names from a seed"""
+    generator = random.Random(seed)
+    artists = [" ".join(generator.sample(WORDS, 2)).title() for _ in range(max(tracks // 20, 10))]
+    names = []
+    for number in range(tracks):
+        title = " ".join(generator.sample(WORDS, generator.randint(1, 3))).title()
+        names.append(f"{title} {number}, {generator.choice(artists)}.mp3")
+    return names
+
+def build_library(root, names):
+    """Function to create the Songs folder, every file is a hard link to one tiny MP3 when the filesystem allows it"""
+    songs_folder = os.path.join(root, "Songs")
+    os.makedirs(songs_folder)
+    template = os.path.join(root, "template.mp3")
+    with open(template, "wb") as handle:
+        handle.write(MP3_FRAMES)
+    for name in names:
+        try:
+            os.link(template, os.path.join(songs_folder, name))
+        except OSError:
+            with open(os.path.join(songs_folder, name), "wb") as handle:
+                handle.write(MP3_FRAMES)
+
+def timed(samples, label, function, *args, **kwargs):
+    """Helper Function that runs one call and records how long it took under `label`"""
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    samples.setdefault(label, []).append(time.perf_counter() - started)
+    return result
+
+def first_streamed_song(sort):
+    """Helper Function that starts streaming the catalog and stops after the first song"""
+    songs = Database.iter_songs(sort)
+    try:
+        return next(songs, None)
+    finally:
+        songs.close()
+
+def summarize(seconds):
+    return {
+        'calls': len(seconds),
+        'median_ms': statistics.median(seconds) * 1000,
+        'min_ms': min(seconds) * 1000,
+        'max_ms': max(seconds) * 1000,
+    }
+
+def run_size(tracks, args):
+    """Function to build one synthetic library and time every operation on it"""
+    names = song_names(tracks, args.seed)
+    playlist_size = min(args.playlist_size, tracks)
+    generator = random.Random(args.seed)
+    samples = {}
+
+    with tempfile.TemporaryDirectory() as root:
+        started = time.perf_counter()
+        build_library(root, names)
+        build_seconds = time.perf_counter() - started
+
+        cwd = os.getcwd()
+        os.chdir(root)  #load_songs_to_database syncs ./Songs
+        try:
+            #Backend debugging prints would dominate the timings and drown the report
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                Database.init(os.path.join(root, "bench.db"))
+                timed(samples, 'load_songs_to_database', Database.load_songs_to_database)
+                timed(samples, 'load_songs_to_database_unchanged', Database.load_songs_to_database)
+
+                users = [f"user{number}" for number in range(args.users)]
+                for user in users:
+                    Database.signup(user, "password")
+                    for number in range(args.playlists):
+                        timed(samples, 'add_songs_to_playlist', Database.add_songs_to_playlist,
+                              user, f"{user} mix {number}", generator.sample(names, playlist_size))
+
+                for _ in range(args.repeat):
+                    #Nothing writes Song_Table in this loop, so only the first call would reach the database
+                    timed(samples, 'get_all_songs', Database.get_all_songs.uncached)
+                    timed(samples, 'get_all_songs_cached', Database.get_all_songs)
+                    user = generator.choice(users)
+                    playlist = f"{user} mix {generator.randrange(args.playlists)}"
+                    timed(samples, 'get_playlist', Database.get_playlist, playlist, user)
+                    timed(samples, 'replace_playlist_songs', Database.replace_playlist_songs,
+                          user, playlist, generator.sample(names, playlist_size))
+                    for query in SEARCH_QUERIES:
+                        timed(samples, f'search_songs[{query}]', Database.search_songs, query)
+                    for sort in Database.SORT_ORDERS:
+                        cursor = None
+                        for _ in range(PAGES_WALKED):
+                            page, cursor = timed(samples, f'get_songs_page[{sort}]', Database.get_songs_page, sort, cursor)
+                            if cursor is None:
+                                break
+                        timed(samples, f'iter_songs_first_row[{sort}]', first_streamed_song, sort)
+        finally:
+            os.chdir(cwd)
+            ConnectionPool.get_pool().close()
+
+    samples['search_songs'] = [seconds for label, values in samples.items() if label.startswith('search_songs[')
+                               for seconds in values]
+    results = {label: summarize(seconds) for label, seconds in samples.items()}
+    results['library'] = {'tracks': tracks, 'users': args.users, 'playlists_per_user': args.playlists,
+                          'playlist_size': playlist_size, 'build_seconds': build_seconds}
+    return results
+
+def git_commit():
+    """Helper Function that names the measured tree, e.g. "4b4dbde" or "4b4dbde-dirty" """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+def compare(baseline, current, threshold):
+    """Function to print median timings side by side, returns the operations that got slower than threshold"""
+    regressions = []
+    for size, operations in current['results'].items():
+        for label, stats in operations.items():
+            old = baseline['results'].get(size, {}).get(label)
+            if label == 'library' or old is None:
+                continue
+            ratio = stats['median_ms'] / old['median_ms'] if old['median_ms'] else float('inf')
+            flag = "  REGRESSION" if ratio > threshold else ""
+            print(f"{size:>8} {label:40} {old['median_ms']:10.2f} -> {stats['median_ms']:10.2f} ms  "
+                  f"x{ratio:5.2f}{flag}", file=sys.stderr)
+            if flag:
+                regressions.append((size, label, ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the Database module on synthetic libraries.")
+    parser.add_argument("--sizes", default="1k,100k", help="comma separated track counts, e.g. 1k,100k,1m")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--playlists", type=int, default=10, help="playlists per user")
+    parser.add_argument("--playlist-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls per read/replace operation")
+    parser.add_argument("--seed", type=int, default=2520)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="RESULTS.json", help="earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    #Passwords aren't what is measured here, keep signup cheap
+    Auth.configure("pbkdf2_sha256", iterations=1000)
+
+    report = {
+        'commit': git_commit(),
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': {},
+    }
+    for size in args.sizes.split(","):
+        print(f"Benchmarking {size} tracks...", file=sys.stderr)
+        report['results'][size.strip()] = run_size(parse_size(size), args)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(text)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        print(f"Comparing {baseline.get('commit')} -> {report['commit']}", file=sys.stderr)
+        if compare(baseline, report, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Module: benchmarks/import_time.py
+Author: Jacob       : Backend
+
+Description:
+Startup-time benchmark for the backend. Each run starts a fresh Python interpreter in an empty scratch directory, times
+`import Database`, and records which heavy modules (tkinter, pygame, mutagen) the import pulled in and whether the import
+created a database file. With --compare the same measurement is taken for an older git revision, so the cost before and
+after a change can be read side by side.
+
+Usage:
+    python benchmarks/import_time.py                   measure the working tree
+    python benchmarks/import_time.py --compare HEAD~1  also measure another revision
+    python benchmarks/import_time.py --runs 20 --output import_time.json
+
+Dependencies:
+- git (only for --compare)
+"""
+
+import argparse, json, os, statistics, subprocess, sys, tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("tkinter", "pygame", "mutagen")
+
+#Runs inside the fresh interpreter
+PROBE = """
+import json, os, sys, time
+started = time.perf_counter()
+import Database
+elapsed = time.perf_counter() - started
+print(json.dumps({'seconds': elapsed,
+                  'loaded': [name for name in %r if name in sys.modules],
+                  'database_created': os.path.exists('song_database.db')}))
+""" % (HEAVY_MODULES,)
+
+def measure(source_dir, runs):
+    """Function to time `import Database` from source_dir in `runs` fresh interpreters"""
+    samples = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as scratch:
+            env = dict(os.environ, PYTHONPATH=source_dir, PYGAME_HIDE_SUPPORT_PROMPT="1")
+            output = subprocess.run([sys.executable, "-c", PROBE], cwd=scratch, env=env, check=True,
+                                    capture_output=True, text=True).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    seconds = [sample['seconds'] for sample in samples]
+    return {
+        'runs': runs,
+        'median_ms': statistics.median(seconds) * 1000,
+        'min_ms': min(seconds) * 1000,
+        'max_ms': max(seconds) * 1000,
+        'loaded_modules': samples[-1]['loaded'],
+        'database_created_on_import': samples[-1]['database_created'],
+    }
+
+def export_revision(revision, target_dir):
+    """Function to unpack a git revision of the repository into target_dir"""
+    archive = subprocess.run(["git", "archive", revision], cwd=REPO_ROOT, check=True, capture_output=True).stdout
+    subprocess.run(["tar", "-x", "-C", target_dir], input=archive, check=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long `import Database` takes.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--compare", metavar="REV", help="git revision to measure as well, e.g. HEAD~1")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {'working_tree': measure(REPO_ROOT, args.runs)}
+    if args.compare:
+        with tempfile.TemporaryDirectory() as old_tree:
+            export_revision(args.compare, old_tree)
+            results[args.compare] = measure(old_tree, args.runs)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(text)
+
+if __name__ == "__main__":
+    main()
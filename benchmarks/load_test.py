@@ -0,0 +1,243 @@
+"""
+Module: benchmarks/load_test.py
+Author: Jacob       : Backend
+
+Description:
+Local load test for the HTTP service (Service.py). A number of client threads each keep one HTTP/1.1 connection open and
+send a mix of requests for a fixed time: catalog pages (half of them conditional, sending back the ETag they got
+before), search queries, song details and, after logging in, the user's playlists and one playlist's songs. Every
+request's latency is recorded, and the report gives requests per second plus p50/p95/p99/max latency overall and per
+endpoint, and how many responses of each status came back.
+
+Either point it at a running service with --url, or give --db and it starts `python -m Service` on that database in a
+separate process (so the clients don't compete with the server for the same interpreter) and stops it afterwards.
+
+Usage:
+    python benchmarks/load_test.py --db song_database.db --clients 32 --seconds 20
+    python benchmarks/load_test.py --url http://127.0.0.1:8080 --username admin --password admin --output load.json
+
+Dependencies:
+- http.client, threading (for the keep-alive client connections)
+- Service module (only when --db starts the server)
+"""
+
+import argparse, http.client, json, os, random, re, subprocess, sys, threading, time
+from urllib.parse import quote, urlsplit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH_QUERIES = ("love", "mid", "the night", "billie", "zzz")
+
+#(endpoint name, weight), the names are also the keys of the per-endpoint report
+MIX = (
+    ('songs_page', 30),
+    ('songs_page_conditional', 30),
+    ('search', 20),
+    ('song_details', 10),
+    ('playlists', 5),
+    ('playlist_songs', 5),
+)
+
+def percentile(sorted_values, fraction):
+    """Helper Function that picks the value below which `fraction` of the sorted values fall"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def latency_summary(samples):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(samples, 0.50) * 1000 if samples else None,
+        'p95_ms': percentile(samples, 0.95) * 1000 if samples else None,
+        'p99_ms': percentile(samples, 0.99) * 1000 if samples else None,
+        'max_ms': samples[-1] * 1000 if samples else None,
+    }
+
+class Client:
+    """Class for one simulated user with a single keep-alive connection"""
+
+    def __init__(self, host, port, token, seed):
+        self.host, self.port = host, port
+        self.token = token
+        self.random = random.Random(seed)
+        self.connection = http.client.HTTPConnection(host, port, timeout=30)
+        self.etags = {}
+        self.songs = []
+        self.playlists = []
+        self.samples = {name: [] for name, _ in MIX}
+        self.statuses = {}
+        self.errors = 0
+
+    def request(self, method, path, body=None, headers=None):
+        """Function to send one request on the kept-alive connection, reconnecting if the server closed it"""
+        headers = dict(headers or {})
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        payload = json.dumps(body).encode() if body is not None else None
+        if payload is not None:
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            try:
+                self.connection.request(method, path, payload, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.connection.close()
+                return response.status, response.getheader('ETag'), data
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                if attempt:
+                    raise
+        return None
+
+    def pick(self):
+        total = sum(weight for _, weight in MIX)
+        point = self.random.uniform(0, total)
+        for name, weight in MIX:
+            point -= weight
+            if point <= 0:
+                return name
+        return MIX[-1][0]
+
+    def run_one(self):
+        name = self.pick()
+        if name in ('playlists', 'playlist_songs') and not self.token:
+            name = 'songs_page'
+        if name == 'playlist_songs' and not self.playlists:
+            name = 'playlists'
+        if name == 'song_details' and not self.songs:
+            name = 'songs_page'
+
+        headers = {}
+        if name.startswith('songs_page'):
+            sort = self.random.choice(('title', 'artist', 'added'))
+            path = f"/songs?sort={sort}&limit=50"
+            if name == 'songs_page_conditional' and path in self.etags:
+                headers['If-None-Match'] = self.etags[path]
+        elif name == 'search':
+            path = f"/search?q={quote(self.random.choice(SEARCH_QUERIES))}&limit=50"
+        elif name == 'song_details':
+            path = "/songs/" + quote(self.random.choice(self.songs))
+        elif name == 'playlists':
+            path = "/playlists"
+        else:
+            path = "/playlists/" + quote(self.random.choice(self.playlists))
+
+        started = time.perf_counter()
+        try:
+            status, etag, data = self.request('GET', path, headers=headers)
+        except (http.client.HTTPException, OSError):
+            self.errors += 1
+            return
+        self.samples[name].append(time.perf_counter() - started)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+        if status == 200:
+            if etag:
+                self.etags[path] = etag
+            body = json.loads(data)
+            if name.startswith('songs_page') and not self.songs:
+                self.songs = body['songs']
+            elif name == 'playlists':
+                self.playlists = [playlist['name'] for playlist in body['playlists']]
+
+def login(host, port, username, password):
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    connection.request('POST', '/login', json.dumps({'username': username, 'password': password}),
+                       {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    body = json.loads(response.read())
+    connection.close()
+    if response.status != 200:
+        raise SystemExit(f"Login failed: {body.get('error')}")
+    return body['token']
+
+def start_server(args):
+    """Function to start the service in a separate process on a free port, returns (process, host, port)"""
+    #Port 0 lets the service pick a free port, it prints the address it ended up on
+    command = [sys.executable, "-m", "Service", "--db", os.path.abspath(args.db), "--port", "0",
+               "--workers", str(args.workers), "--log-level", "WARNING"]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(args.db)) or ".",
+                               env=dict(os.environ, PYTHONPATH=REPO_ROOT), stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    match = re.search(r'http://([^:]+):(\d+)', line)
+    if not match:
+        process.kill()
+        raise SystemExit(f"Service did not start: {line.strip()}")
+    return process, match.group(1), int(match.group(2))
+
+def run(host, port, args):
+    token = login(host, port, args.username, args.password) if args.username else None
+    clients = [Client(host, port, token, seed) for seed in range(args.clients)]
+    deadline = time.perf_counter() + args.warmup + args.seconds
+    measure_from = time.perf_counter() + args.warmup
+
+    def work(client):
+        while time.perf_counter() < measure_from:
+            client.run_one()
+        client.samples = {name: [] for name, _ in MIX}
+        client.statuses = {}
+        while time.perf_counter() < deadline:
+            client.run_one()
+        client.connection.close()
+
+    threads = [threading.Thread(target=work, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    samples = [sample for client in clients for values in client.samples.values() for sample in values]
+    statuses = {}
+    for client in clients:
+        for status, count in client.statuses.items():
+            statuses[str(status)] = statuses.get(str(status), 0) + count
+    return {
+        'clients': args.clients,
+        'seconds': args.seconds,
+        'requests': len(samples),
+        'requests_per_second': len(samples) / args.seconds,
+        'latency': latency_summary(samples),
+        'endpoints': {name: latency_summary([sample for client in clients for sample in client.samples[name]])
+                      for name, _ in MIX},
+        'statuses': statuses,
+        'connection_errors': sum(client.errors for client in clients),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the music database HTTP service.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="a running service, e.g. http://127.0.0.1:8080")
+    target.add_argument("--db", help="start the service on this database for the test")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent keep-alive connections")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of requests before measuring")
+    parser.add_argument("--workers", type=int, default=16, help="service worker threads (with --db)")
+    parser.add_argument("--username", default="admin", help="log in as this user for the playlist requests")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--output", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    process = None
+    if args.db:
+        process, host, port = start_server(args)
+    else:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    try:
+        report = run(host, port, args)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(text)
+    print(f"{report['requests_per_second']:.0f} requests/s, p99 {report['latency']['p99_ms']:.1f} ms", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Module: benchmarks/login_bench.py
+Author: Jacob       : Backend
+
+Description:
+Login throughput benchmark. For each password hasher cost setting it creates a user in a scratch database, then times
+Database.login() for the right password, the wrong password and an unknown username (which should cost about the same,
+so usernames can't be guessed from timing). It also times Database.check_session(), which is what repeated authenticated
+calls pay once a session token has been issued, and the one-off upgrade of a legacy SHA-256 hash on first login.
+
+Usage:
+    python benchmarks/login_bench.py                     run every cost setting
+    python benchmarks/login_bench.py --logins 50 --only pbkdf2_sha256-600000
+    python benchmarks/login_bench.py --output login_bench.json
+
+Dependencies:
+- Database and Auth modules (the code being measured)
+"""
+
+import argparse, contextlib, hashlib, io, json, os, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Auth
+import ConnectionPool
+import Database
+
+#Label -> (hasher, cost parameters)
+COST_SETTINGS = {
+    'pbkdf2_sha256-100000': ("pbkdf2_sha256", {'iterations': 100000}),
+    'pbkdf2_sha256-300000': ("pbkdf2_sha256", {'iterations': 300000}),
+    'pbkdf2_sha256-600000': ("pbkdf2_sha256", {'iterations': 600000}),
+    'scrypt-n16384': ("scrypt", {'n': 2**14, 'r': 8, 'p': 1}),
+    'scrypt-n32768': ("scrypt", {'n': 2**15, 'r': 8, 'p': 1}),
+}
+
+def _rate(function, count):
+    """Helper Function that runs function `count` times, returns (per second, mean ms)"""
+    started = time.perf_counter()
+    for _ in range(count):
+        function()
+    elapsed = time.perf_counter() - started
+    return count / elapsed, elapsed / count * 1000
+
+def measure(label, logins, session_checks):
+    algorithm, params = COST_SETTINGS[label]
+    Auth.configure(algorithm, **params)
+    Database.signup("bench", "correct horse")
+
+    ok_rate, ok_ms = _rate(lambda: Database.login("bench", "correct horse"), logins)
+    bad_rate, bad_ms = _rate(lambda: Database.login("bench", "wrong"), logins)
+    unknown_rate, unknown_ms = _rate(lambda: Database.login("nobody", "wrong"), logins)
+
+    token = Database.get_session_token()
+    session_rate, session_ms = _rate(lambda: Database.check_session(token), session_checks)
+
+    #A user from before the KDF: the first login verifies SHA-256 and stores a new hash
+    with Database.connect(write=True) as conn:
+        conn.execute('INSERT INTO User_Table (Username, Password) VALUES (?, ?)',
+                     ("legacy", hashlib.sha256(b"old password").hexdigest()))
+    started = time.perf_counter()
+    Database.login("legacy", "old password")
+    upgrade_ms = (time.perf_counter() - started) * 1000
+
+    return {
+        'hasher': algorithm,
+        'params': params,
+        'logins_per_sec': ok_rate,
+        'login_ms': ok_ms,
+        'wrong_password_ms': bad_ms,
+        'unknown_user_ms': unknown_ms,
+        'legacy_upgrade_ms': upgrade_ms,
+        'session_checks_per_sec': session_rate,
+        'session_check_us': session_ms * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure logins/sec for each password hasher cost setting.")
+    parser.add_argument("--logins", type=int, default=20, help="logins timed per case")
+    parser.add_argument("--session-checks", type=int, default=100000)
+    parser.add_argument("--only", choices=sorted(COST_SETTINGS), action="append", help="run only this setting")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    for label in args.only or COST_SETTINGS:
+        with tempfile.TemporaryDirectory() as scratch:
+            #Backend debugging prints would drown the results
+            with contextlib.redirect_stdout(io.StringIO()):
+                Database.init(os.path.join(scratch, "bench.db"))
+                results[label] = measure(label, args.logins, args.session_checks)
+            ConnectionPool.get_pool().close()
+        print(f"{label:24} {results[label]['logins_per_sec']:8.1f} logins/s  "
+              f"{results[label]['login_ms']:7.1f} ms/login  "
+              f"{results[label]['session_check_us']:6.2f} us/session check", file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(text)
+
+if __name__ == "__main__":
+    main()